@@ -0,0 +1,230 @@
+"""
+Векторный бэктест стратегий на свечах из ClickHouse.
+
+Свечи загружаются в панель: по каждому полю непрерывный массив [T, N]
+(время x инструменты). Сигнальная функция получает панель и параметры и
+возвращает целевые веса позиций [T, N]; доходность, комиссия и сделки
+считаются операциями над целыми массивами, без цикла по свечам.
+
+Пример:
+    store = CandleStore(connection)
+    panel = load_panel(store, figi_list, start, end, interval=timedelta(hours=1))
+    result = run_backtest(panel, sma_crossover, fast=10, slow=50)
+    grid = sweep(panel, sma_crossover, {'fast': range(5, 50, 5), 'slow': range(50, 300, 25)})
+"""
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from candle_store import MINUTE, VALUE_COLUMNS
+
+# комиссия брокера за сделку, как PorfolioManager.comission
+COMISSION = 0.0025
+
+YEAR = timedelta(days=365)
+
+
+class Panel:
+    """
+    Свечи множества инструментов на общей оси времени.
+    fields[name] - float64 [T, N], NaN там, где у инструмента нет свечи
+    """
+
+    def __init__(self, time, figi, fields):
+        """
+        :param time: datetime64 [T], по возрастанию
+        :param figi: список из N figi
+        :param fields: dict имя поля -> np.ndarray [T, N]
+        """
+        self.time = time
+        self.figi = list(figi)
+        self.fields = {name: np.ascontiguousarray(values, dtype=np.float64) for name, values in fields.items()}
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    @property
+    def shape(self):
+        return len(self.time), len(self.figi)
+
+    @classmethod
+    def from_frame(cls, df, fields=VALUE_COLUMNS):
+        """
+        Панель из DataFrame с колонками figi, time и fields (как у CandleStore.read)
+        """
+        figi = df['figi'].astype('category')
+        times, rows = np.unique(df['time'].to_numpy(), return_inverse=True)
+        columns = figi.cat.codes.to_numpy()
+        shape = (len(times), len(figi.cat.categories))
+        arrays = {}
+        for name in fields:
+            values = np.full(shape, np.nan)
+            values[rows, columns] = df[name].to_numpy(dtype=np.float64)
+            arrays[name] = values
+        return cls(times, figi.cat.categories, arrays)
+
+    def filled(self, name):
+        """
+        Поле с пропусками, заполненными последним известным значением
+        """
+        values = self.fields[name]
+        t = np.arange(values.shape[0])[:, None]
+        last = np.maximum.accumulate(np.where(np.isnan(values), 0, t), axis=0)
+        return values[last, np.arange(values.shape[1])]
+
+    def periods_per_year(self):
+        """
+        Сколько свечей в году по фактической частоте данных (для годовых метрик)
+        """
+        if len(self.time) < 2:
+            return 1.0
+        span = pd.Timedelta(self.time[-1] - self.time[0]).to_pytimedelta()
+        return (len(self.time) - 1) / (span / YEAR)
+
+
+def load_panel(store, figi_list, start, end, interval=MINUTE, fields=VALUE_COLUMNS):
+    """
+    :param store: CandleStore
+    :param figi_list:
+    :param start:
+    :param end:
+    :param interval: timedelta или CandleInterval
+    :param fields: поля свечей
+    :return: Panel
+    """
+    df = store.read(figi_list, start, end, interval, columns=list(fields))
+    return Panel.from_frame(df, fields)
+
+
+class BacktestResult:
+    """
+    equity - кривая капитала [T] (начальный капитал 1),
+    returns - доходность за свечу после комиссии,
+    weights - удерживаемые веса [T, N], trades - DataFrame сделок
+    """
+
+    def __init__(self, panel, weights, returns, costs, trades):
+        self.panel = panel
+        self.weights = weights
+        self.returns = returns
+        self.costs = costs
+        self.equity = np.cumprod(1 + returns)
+        self.trades = trades
+
+    def equity_curve(self) -> pd.Series:
+        return pd.Series(self.equity, index=pd.DatetimeIndex(self.panel.time), name='equity')
+
+    def stats(self) -> dict:
+        periods = self.panel.periods_per_year()
+        std = self.returns.std()
+        peak = np.maximum.accumulate(self.equity)
+        return {
+            'total_return': self.equity[-1] - 1 if len(self.equity) else 0.0,
+            'sharpe': self.returns.mean() / std * np.sqrt(periods) if std > 0 else 0.0,
+            'max_drawdown': (1 - self.equity / peak).max() if len(self.equity) else 0.0,
+            'trades': len(self.trades),
+            'comission': self.costs.sum(),
+        }
+
+
+def run_backtest(panel, signal, comission=COMISSION, price='close', **params) -> BacktestResult:
+    """
+    Веса, выставленные сигналом по свече t, удерживаются со свечи t + 1,
+    поэтому сигнал видит только закрытые свечи.
+    Комиссия - comission от оборота: сумма |изменения весов| по инструментам
+    :param panel: Panel
+    :param signal: signal(panel, **params) -> целевые веса [T, N]; NaN - без позиции
+    :param comission: доля оборота
+    :param price: поле цены исполнения и оценки
+    :param params: параметры сигнала
+    :return: BacktestResult
+    """
+    target = np.nan_to_num(np.asarray(signal(panel, **params), dtype=np.float64))
+    prices = panel.filled(price)
+    asset_returns = np.zeros_like(prices)
+    asset_returns[1:] = np.nan_to_num(prices[1:] / prices[:-1] - 1)
+    # свеча без цены не даёт войти: вес сохраняется прежним
+    target = np.where(np.isnan(prices), np.nan, target)
+    t = np.arange(target.shape[0])[:, None]
+    last = np.maximum.accumulate(np.where(np.isnan(target), 0, t), axis=0)
+    weights = np.nan_to_num(target[last, np.arange(target.shape[1])])
+
+    held = np.zeros_like(weights)
+    held[1:] = weights[:-1]
+    change = np.diff(weights, axis=0, prepend=0)
+    costs = comission * np.abs(change).sum(axis=1)
+    returns = (held * asset_returns).sum(axis=1) - costs
+
+    rows, columns = np.nonzero(change)
+    trades = pd.DataFrame({
+        'time': panel.time[rows],
+        'figi': pd.Categorical.from_codes(columns, categories=panel.figi),
+        'weight_from': weights[rows, columns] - change[rows, columns],
+        'weight_to': weights[rows, columns],
+        'price': prices[rows, columns],
+        'comission': comission * np.abs(change[rows, columns]),
+    })
+    return BacktestResult(panel, weights, returns, costs, trades)
+
+
+def rolling_mean(values, window):
+    """
+    Скользящее среднее по оси времени через кумулятивную сумму; первые window - 1 свечей - NaN
+    """
+    csum = np.cumsum(np.nan_to_num(values), axis=0)
+    result = np.full(values.shape, np.nan)
+    result[window - 1:] = csum[window - 1:]
+    result[window:] -= csum[:-window]
+    result[window - 1:] /= window
+    return result
+
+
+def sma_crossover(panel, fast=10, slow=50, price='close'):
+    """
+    Лонг, когда быстрая средняя выше медленной, иначе без позиции; капитал поровну между инструментами
+    """
+    if fast >= slow:
+        return np.zeros(panel.shape)
+    prices = panel.filled(price)
+    signal = (rolling_mean(prices, fast) > rolling_mean(prices, slow)).astype(np.float64)
+    return signal / panel.shape[1]
+
+
+# панель процесса-исполнителя sweep, задаётся initializer
+_panel = None
+
+
+def _init_worker(panel):
+    global _panel
+    _panel = panel
+
+
+def _run_params(task):
+    signal, comission, params = task
+    return {**params, **run_backtest(_panel, signal, comission, **params).stats()}
+
+
+def sweep(panel, signal, grid, comission=COMISSION, max_workers=None, chunksize=16) -> pd.DataFrame:
+    """
+    Бэктест по всем комбинациям параметров в пуле процессов.
+    Панель передаётся процессу один раз в initializer (при fork - без копирования,
+    страницы общие с родителем), в задачах - только параметры.
+    signal должен быть функцией уровня модуля, чтобы его можно было передать процессу
+    :param panel: Panel
+    :param signal: сигнальная функция
+    :param grid: dict имя параметра -> список значений
+    :param comission:
+    :param max_workers: по умолчанию число CPU
+    :param chunksize: комбинаций в одной задаче
+    :return: DataFrame: параметры и stats() по комбинации
+    """
+    names = list(grid)
+    tasks = [(signal, comission, dict(zip(names, values))) for values in itertools.product(*grid.values())]
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                             initializer=_init_worker, initargs=(panel,)) as executor:
+        rows = list(executor.map(_run_params, tasks, chunksize=chunksize))
+    return pd.DataFrame(rows)
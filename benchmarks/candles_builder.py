@@ -0,0 +1,108 @@
+"""
+Бенчмарк сборки DataFrame свечей без сети.
+Синтетический генератор воспроизводит поток HistoricCandle от get_all_candles.
+
+Запуск из корня проекта:
+    python -m benchmarks.candles_builder --candles 130000 --legacy 5000
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+from random import Random
+from time import perf_counter
+from types import SimpleNamespace
+
+import pandas as pd
+
+from candles import CANDLE_COLUMNS, CandleColumns
+
+
+def synthetic_candles(n, seed=0, start=datetime(2022, 1, 3, 7, tzinfo=timezone.utc)):
+    """
+    Генератор минутных свечей со случайным блужданием цены
+    :param n: количество свечей
+    :param seed:
+    :param start: время первой свечи (UTC)
+    :return:
+    """
+    rnd = Random(seed)
+    price = 100.0
+
+    def quotation(v):
+        units = int(v)
+        return SimpleNamespace(units=units, nano=int(round((v - units) * 1e9)))
+
+    for i in range(n):
+        o = price
+        c = max(o + rnd.gauss(0, 0.1), 0.01)
+        h = max(o, c) + abs(rnd.gauss(0, 0.05))
+        l = max(min(o, c) - abs(rnd.gauss(0, 0.05)), 0.01)
+        price = c
+        yield SimpleNamespace(
+            time=start + timedelta(minutes=i),
+            volume=rnd.randint(1, 10000),
+            open=quotation(o), close=quotation(c),
+            high=quotation(h), low=quotation(l),
+            is_complete=True,
+        )
+
+
+def legacy_build(figi, candles):
+    """
+    Прежний путь: DataFrame на каждую свечу и append в общий DataFrame
+    """
+    all_df = pd.DataFrame(columns=CANDLE_COLUMNS)
+    for c in candles:
+        candle = pd.DataFrame([{
+            'figi': figi,
+            'time': c.time,
+            'volume': c.volume,
+            'open': c.open.units + c.open.nano / 1e9,
+            'close': c.close.units + c.close.nano / 1e9,
+            'high': c.high.units + c.high.nano / 1e9,
+            'low': c.low.units + c.low.nano / 1e9,
+        }])
+        candle['time'] = pd.to_datetime(candle['time']).dt.tz_localize(None)
+        # DataFrame.append удалён в pandas 2.0, concat - его прямой эквивалент
+        all_df = pd.concat([all_df, candle], ignore_index=True)
+    return all_df
+
+
+def columnar_build(figi, candles):
+    builder = CandleColumns(figi)
+    builder.extend(candles)
+    return builder.to_frame()
+
+
+def measure(build, figi, n):
+    candles = list(synthetic_candles(n))
+    started = perf_counter()
+    df = build(figi, candles)
+    elapsed = perf_counter() - started
+    return df, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--candles', type=int, default=130_000, help='свечей для колоночной сборки')
+    parser.add_argument('--legacy', type=int, default=5_000, help='свечей для прежнего пути (0 - пропустить)')
+    args = parser.parse_args()
+    figi = 'BBG000BENCH0'
+
+    df, elapsed = measure(columnar_build, figi, args.candles)
+    columnar_rate = len(df) / elapsed
+    print(f'columnar: {len(df)} свечей за {elapsed:.3f} с ({columnar_rate:,.0f} свечей/с)')
+
+    if args.legacy:
+        legacy_df, legacy_elapsed = measure(legacy_build, figi, args.legacy)
+        legacy_rate = len(legacy_df) / legacy_elapsed
+        print(f'legacy:   {len(legacy_df)} свечей за {legacy_elapsed:.3f} с ({legacy_rate:,.0f} свечей/с)')
+        # прежний путь квадратичный, поэтому сравнение скоростей на разных n занижает выигрыш
+        print(f'ускорение (по скорости): x{columnar_rate / legacy_rate:,.1f}')
+
+        check, _ = measure(columnar_build, figi, args.legacy)
+        pd.testing.assert_frame_equal(check, legacy_df.astype(check.dtypes.to_dict()), check_exact=False)
+        print('результаты совпадают')
+
+
+if __name__ == '__main__':
+    main()
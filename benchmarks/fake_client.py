@@ -0,0 +1,262 @@
+"""
+Детерминированный fake tinkoff.invest Services для бенчмарков без токена и сети.
+Отдаёт свечи, справочник инструментов, портфель, позиции и операции
+в объёме, заданном параметрами; одинаковые параметры - одинаковые ответы.
+
+    client = FakeServices(shares=2000, positions=50, operations=5000)
+    parser = InformationParser(client, limiter=unlimited_limiter(), candle_cache=False)
+"""
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from random import Random
+from types import SimpleNamespace
+
+from tinkoff.invest import AccessLevel
+
+from candles import CANDLE_INTERVAL_STEP
+from fx import CURRENCY_FIGI
+from instrument_fields import SHARE_FIELDS, ETF_FIELDS, BOND_FIELDS, FUTURE_FIELDS, QUOTATION, MONEY, DATETIME, ENUM
+from ratelimit import DEFAULT_LIMITS, RateLimiter
+
+RATES = {'usd': 75.0, 'eur': 80.0, 'cny': 11.0, 'hkd': 9.5}
+
+# торговая сессия для минутных свечей, UTC
+SESSION_START = timedelta(hours=7)
+SESSION_END = timedelta(hours=15, minutes=45)
+
+
+def unlimited_limiter():
+    """
+    RateLimiter без ожидания: бенчмарк меряет код, а не квоты API
+    """
+    return RateLimiter({service: 10 ** 9 for service in DEFAULT_LIMITS})
+
+
+def _seed(*parts):
+    return zlib.crc32('|'.join(map(str, parts)).encode())
+
+
+def quotation(v, currency=None):
+    units = int(v)
+    q = SimpleNamespace(units=units, nano=int(round((v - units) * 1e9)))
+    if currency is not None:
+        q.currency = currency
+    return q
+
+
+def synthetic_instruments(fields, n, seed=0, prefix=''):
+    """
+    Объекты с полями fields (Share, Etf, Bond, Future); nominal и прочие MoneyValue в rub или usd
+    :param fields: список Field из instrument_fields
+    :param n: количество инструментов
+    :param seed:
+    :param prefix: префикс строковых полей, чтобы figi разных типов не совпадали
+    """
+    rnd = Random(seed)
+    start = datetime(2018, 3, 7, 7, tzinfo=timezone.utc)
+    instruments = []
+    for i in range(n):
+        instrument = SimpleNamespace()
+        for field in fields:
+            if field.kind == QUOTATION:
+                value = quotation(rnd.uniform(0, 2))
+            elif field.kind == MONEY:
+                value = quotation(rnd.uniform(0, 100), rnd.choice(['rub', 'usd']))
+            elif field.kind == ENUM:
+                value = rnd.randint(0, 5)
+            elif field.kind == DATETIME:
+                value = start + timedelta(days=rnd.randint(0, 1000))
+            elif field.column.endswith('_flag'):
+                value = rnd.random() > 0.5
+            elif field.dtype is not None:
+                value = rnd.randint(1, 10 ** 6)
+            else:
+                value = f'{prefix}{field.column}_{i}'
+            setattr(instrument, field.column, value)
+        instruments.append(instrument)
+    return instruments
+
+
+class FakeMarketData:
+
+    def __init__(self, services):
+        self.services = services
+
+    def get_candles(self, figi, from_, to, interval):
+        """
+        Свечи случайного блуждания; цена зависит от figi, шум - от figi и начала окна.
+        Свечи меньше дня - только в торговую сессию по будням
+        """
+        self.services.wait()
+        step = CANDLE_INTERVAL_STEP[interval]
+        rnd = Random(_seed(figi, int(from_.timestamp()), interval))
+        price = 10 + _seed(figi) % 1000
+        intraday = step < timedelta(days=1)
+        candles = []
+        moment = from_
+        while moment < to:
+            day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+            if intraday and (moment.weekday() >= 5 or not SESSION_START <= moment - day < SESSION_END):
+                moment += step
+                continue
+            o = price
+            c = max(o * (1 + rnd.gauss(0, 0.001)), 0.01)
+            h = max(o, c) * (1 + abs(rnd.gauss(0, 0.0005)))
+            l = min(o, c) * (1 - abs(rnd.gauss(0, 0.0005)))
+            price = c
+            candles.append(SimpleNamespace(
+                time=moment, volume=rnd.randint(1, 10_000),
+                open=quotation(o), close=quotation(c), high=quotation(h), low=quotation(l),
+                is_complete=True,
+            ))
+            moment += step
+        return SimpleNamespace(candles=candles)
+
+    def get_last_prices(self, figi):
+        self.services.wait()
+        rates = {CURRENCY_FIGI[c]: rate for c, rate in RATES.items() if c in CURRENCY_FIGI}
+        return SimpleNamespace(last_prices=[
+            SimpleNamespace(figi=f, price=quotation(rates.get(f, 100.0)), time=datetime.now(timezone.utc))
+            for f in figi
+        ])
+
+
+class FakeInstruments:
+
+    def __init__(self, services):
+        self.services = services
+        self.cache = {}
+
+    def _response(self, name, fields, n):
+        self.services.wait()
+        if name not in self.cache:
+            self.cache[name] = synthetic_instruments(fields, n, seed=_seed(name), prefix=f'{name}_')
+        return SimpleNamespace(instruments=self.cache[name])
+
+    def shares(self, instrument_status=None):
+        return self._response('share', SHARE_FIELDS, self.services.scale['shares'])
+
+    def etfs(self, instrument_status=None):
+        return self._response('etf', ETF_FIELDS, self.services.scale['etfs'])
+
+    def bonds(self, instrument_status=None):
+        return self._response('bond', BOND_FIELDS, self.services.scale['bonds'])
+
+    def futures(self, instrument_status=None):
+        return self._response('future', FUTURE_FIELDS, self.services.scale['futures'])
+
+
+class FakeOperations:
+
+    def __init__(self, services):
+        self.services = services
+        self.cache = {}
+
+    def _rnd(self, account_id, name):
+        return Random(_seed(account_id, name))
+
+    def _cached(self, account_id, name, build):
+        key = (account_id, name)
+        if key not in self.cache:
+            self.cache[key] = build(account_id)
+        return self.cache[key]
+
+    def get_portfolio(self, account_id):
+        self.services.wait()
+        return self._cached(account_id, 'portfolio', self._portfolio)
+
+    def _portfolio(self, account_id):
+        rnd = self._rnd(account_id, 'portfolio')
+        positions = []
+        for i in range(self.services.scale['positions']):
+            currency = rnd.choice(['rub', 'rub', 'usd', 'eur'])
+            price = rnd.uniform(1, 500)
+            positions.append(SimpleNamespace(
+                figi=f'share_figi_{i}', instrument_type=rnd.choice(['share', 'bond', 'etf']),
+                quantity=quotation(rnd.randint(1, 1000)), expected_yield=quotation(rnd.uniform(-100, 100)),
+                average_position_price=quotation(price * rnd.uniform(0.8, 1.2), currency),
+                current_price=quotation(price, currency), current_nkd=quotation(0.0, currency),
+            ))
+        return SimpleNamespace(positions=positions)
+
+    def get_positions(self, account_id):
+        self.services.wait()
+        rnd = self._rnd(account_id, 'positions')
+        return SimpleNamespace(money=[quotation(rnd.uniform(0, 10 ** 5), c) for c in ('rub', 'usd', 'eur')])
+
+    def _operations(self, account_id):
+        rnd = self._rnd(account_id, 'operations')
+        start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        operations = []
+        for i in range(self.services.scale['operations']):
+            currency = rnd.choice(['rub', 'usd'])
+            quantity = rnd.randint(1, 100)
+            price = rnd.uniform(1, 500)
+            operations.append(SimpleNamespace(
+                id=f'{account_id}-{i}', date=start + timedelta(minutes=17 * i), name='Покупка ценных бумаг',
+                type=15, operation_type=15, currency=currency, instrument_type='share',
+                figi=f'share_figi_{rnd.randrange(self.services.scale["shares"] or 1)}', quantity=quantity,
+                state=1, payment=quotation(-price * quantity, currency), price=quotation(price, currency),
+            ))
+        return operations
+
+    def get_operations(self, account_id, from_=None, to=None):
+        self.services.wait()
+        return SimpleNamespace(operations=self._cached(account_id, 'operations', self._operations))
+
+    def get_operations_by_cursor(self, request):
+        self.services.wait()
+        operations = self._cached(request.account_id, 'operations', self._operations)
+        start = int(request.cursor or 0)
+        end = start + request.limit
+        return SimpleNamespace(items=operations[start:end], has_next=end < len(operations), next_cursor=str(end))
+
+
+class FakeUsers:
+
+    def __init__(self, services):
+        self.services = services
+
+    def get_accounts(self):
+        self.services.wait()
+        return SimpleNamespace(accounts=[
+            SimpleNamespace(id=f'20000000{i:02d}', access_level=AccessLevel.ACCOUNT_ACCESS_LEVEL_FULL_ACCESS)
+            for i in range(self.services.scale['accounts'])
+        ])
+
+
+class FakeServices:
+    """
+    Совместим с tinkoff.invest Services в части, которую использует проект.
+    latency - задержка каждого вызова, секунды (имитация сети)
+    """
+
+    def __init__(self, shares=2000, etfs=300, bonds=1500, futures=500, positions=50, operations=5000,
+                 accounts=3, latency=0.0):
+        self.scale = {
+            'shares': shares, 'etfs': etfs, 'bonds': bonds, 'futures': futures,
+            'positions': positions, 'operations': operations, 'accounts': accounts,
+        }
+        self.latency = latency
+        self.market_data = FakeMarketData(self)
+        self.instruments = FakeInstruments(self)
+        self.operations = FakeOperations(self)
+        self.users = FakeUsers(self)
+
+    def warm_up(self):
+        """
+        Генерирую справочник, портфели и операции заранее, чтобы их создание не попало в замер
+        """
+        latency, self.latency = self.latency, 0.0
+        for getter in (self.instruments.shares, self.instruments.etfs, self.instruments.bonds,
+                       self.instruments.futures):
+            getter()
+        for account in self.users.get_accounts().accounts:
+            self.operations.get_portfolio(account.id)
+            self.operations.get_operations(account.id)
+        self.latency = latency
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
@@ -0,0 +1,75 @@
+"""
+Локальный fake MarketDataStreamManager для StreamIngestor без сети.
+
+    stream = FakeMarketDataStream(minutes=60)
+    StreamIngestor(parser, figi_list, connection, stream_factory=lambda: stream).run()
+"""
+import threading
+from datetime import datetime, timedelta, timezone
+from random import Random
+from types import SimpleNamespace
+
+
+class _Subscription:
+    def __init__(self):
+        self.instruments = []
+
+    def subscribe(self, instruments):
+        self.instruments.extend(instruments)
+
+    def unsubscribe(self, instruments):
+        self.instruments = [i for i in self.instruments if i not in instruments]
+
+
+class FakeMarketDataStream:
+    """
+    Отдаёт по updates_per_minute обновлений минутной свечи и последней цены
+    на каждую подписанную figi; fail_after - оборвать стрим исключением после n событий
+    """
+
+    def __init__(self, minutes=60, updates_per_minute=3, start=datetime(2022, 1, 3, 7, tzinfo=timezone.utc),
+                 fail_after=None, seed=0):
+        self.candles = _Subscription()
+        self.last_price = _Subscription()
+        self.minutes = minutes
+        self.updates_per_minute = updates_per_minute
+        self.start = start
+        self.fail_after = fail_after
+        self.rnd = Random(seed)
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    @staticmethod
+    def _quotation(v):
+        units = int(v)
+        return SimpleNamespace(units=units, nano=int(round((v - units) * 1e9)))
+
+    def __iter__(self):
+        figi_list = [i.figi for i in self.candles.instruments]
+        prices = {figi: 100.0 for figi in figi_list}
+        sent = 0
+        for minute in range(self.minutes):
+            moment = self.start + timedelta(minutes=minute)
+            for figi in figi_list:
+                o = prices[figi]
+                h = l = c = o
+                volume = 0
+                for update in range(self.updates_per_minute):
+                    if self.stopped.is_set():
+                        return
+                    if self.fail_after is not None and sent >= self.fail_after:
+                        raise ConnectionError('fake stream dropped')
+                    c = max(c + self.rnd.gauss(0, 0.1), 0.01)
+                    h, l = max(h, c), min(l, c)
+                    volume += self.rnd.randint(1, 100)
+                    candle = SimpleNamespace(
+                        figi=figi, time=moment, volume=volume,
+                        open=self._quotation(o), close=self._quotation(c),
+                        high=self._quotation(h), low=self._quotation(l))
+                    price = SimpleNamespace(figi=figi, price=self._quotation(c),
+                                            time=moment + timedelta(seconds=update))
+                    sent += 1
+                    yield SimpleNamespace(candle=candle, last_price=price)
+                prices[figi] = c
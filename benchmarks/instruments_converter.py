@@ -0,0 +1,84 @@
+"""
+Микро-бенчмарк преобразования инструментов в DataFrame без сети:
+построчные dict (прежние *_pose_todict) против instruments_to_frame.
+
+Запуск из корня проекта:
+    python -m benchmarks.instruments_converter --instruments 20000
+"""
+import argparse
+from time import perf_counter
+
+import pandas as pd
+
+from benchmarks.fake_client import synthetic_instruments
+from instrument_fields import SHARE_FIELDS, QUOTATION, MONEY, instruments_to_frame
+
+USDRUR = 75.0
+
+
+def synthetic_shares(n, seed=0):
+    """
+    Объекты с полями Share; nominal в rub или usd
+    """
+    return synthetic_instruments(SHARE_FIELDS, n, seed)
+
+
+def cast_money(v, to_rub=True):
+    r = v.units + v.nano / 1e9
+    if to_rub and hasattr(v, 'currency') and getattr(v, 'currency') == 'usd':
+        r *= USDRUR
+    return r
+
+
+def legacy_convert(shares):
+    """
+    Прежний путь: dict на инструмент, cast_money на каждое поле
+    """
+    rows = []
+    for p in shares:
+        r = {}
+        for field in SHARE_FIELDS:
+            value = getattr(p, field.column)
+            if field.kind in (QUOTATION, MONEY):
+                value = cast_money(value)
+            r[field.column] = value
+        rows.append(r)
+    df = pd.DataFrame(rows)
+    df['first_1min_candle_date'] = pd.to_datetime(df['first_1min_candle_date']).dt.tz_localize(None)
+    df['first_1day_candle_date'] = pd.to_datetime(df['first_1day_candle_date']).dt.tz_localize(None)
+    return df
+
+
+def columnar_convert(shares):
+    return instruments_to_frame(shares, SHARE_FIELDS, lambda currencies: {'usd': USDRUR})
+
+
+def measure(convert, shares, repeat):
+    best = None
+    for _ in range(repeat):
+        started = perf_counter()
+        df = convert(shares)
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return df, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--instruments', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    shares = synthetic_shares(args.instruments)
+    legacy_df, legacy_elapsed = measure(legacy_convert, shares, args.repeat)
+    df, elapsed = measure(columnar_convert, shares, args.repeat)
+    print(f'legacy:   {legacy_elapsed:.3f} с')
+    print(f'columnar: {elapsed:.3f} с')
+    print(f'ускорение: x{legacy_elapsed / elapsed:,.1f}')
+
+    pd.testing.assert_frame_equal(df, legacy_df, check_dtype=False)
+    print('результаты совпадают')
+
+
+if __name__ == '__main__':
+    main()
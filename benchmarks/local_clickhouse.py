@@ -0,0 +1,81 @@
+"""
+Замена ClickHouse в процессе для бенчмарков: принимает запросы модуля clickhouse
+через connection['session'], INSERT только считает, на SELECT отвечает пустым результатом
+(таблицы всегда пусты, поэтому каждый прогон делает одинаковую работу).
+
+    sink = LocalClickHouse()
+    connection = {'host': 'http://localhost:8123', 'database': 'tinkoff', 'session': sink}
+"""
+import io
+import re
+import threading
+import time
+
+INSERT_RE = re.compile(r'^\s*INSERT\s+INTO\s+(\S+)', re.IGNORECASE)
+
+
+class LocalResponse:
+    """
+    Минимальный requests.Response
+    """
+
+    def __init__(self, content=b'', status_code=200):
+        self.status_code = status_code
+        self.content = content
+        self.raw = io.BytesIO(content)
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+
+class LocalClickHouse:
+    """
+    inserts[table] - количество INSERT, bytes_received[table] - байт в теле,
+    selects - количество прочих запросов; latency - задержка на запрос, секунды.
+    С keep_data тела вставок сохраняются в data[table] (для тестов)
+    """
+
+    def __init__(self, latency=0.0, keep_data=False):
+        self.latency = latency
+        self.keep_data = keep_data
+        self.data = {}
+        self.inserts = {}
+        self.bytes_received = {}
+        self.selects = 0
+        self.lock = threading.Lock()
+
+    def post(self, url, params=None, data=None, auth=None, stream=False):
+        params = params or {}
+        query = params.get('query')
+        if query is None:
+            query = data.decode() if isinstance(data, bytes) else data
+            data = None
+        if data is not None:
+            data = bytes(data) if isinstance(data, (bytes, bytearray)) else b''.join(data)
+        if self.latency:
+            time.sleep(self.latency)
+
+        match = INSERT_RE.match(query)
+        with self.lock:
+            if match:
+                table = match.group(1)
+                self.inserts[table] = self.inserts.get(table, 0) + 1
+                self.bytes_received[table] = self.bytes_received.get(table, 0) + len(data or b'')
+                if self.keep_data:
+                    self.data.setdefault(table, []).append(data)
+            else:
+                self.selects += 1
+        return LocalResponse()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'inserts': dict(self.inserts),
+                'bytes_received': dict(self.bytes_received),
+                'selects': self.selects,
+            }
@@ -0,0 +1,192 @@
+"""
+Бенчмарк конвейеров без токена и ClickHouse: FakeServices + LocalClickHouse.
+Для каждого конвейера - время, пропускная способность, пик памяти (tracemalloc,
+отдельным прогоном) и время стадий по метрикам metrics.default_registry.
+Отчёт пишется в JSON; --compare печатает разницу с прошлым отчётом
+и завершается с кодом 1 при падении пропускной способности больше порога.
+
+Запуск из корня проекта:
+    python -m benchmarks.pipelines --figi 20 --days 30 --output bench.json
+    python -m benchmarks.pipelines --figi 20 --days 30 --output bench-new.json --compare bench.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+from tinkoff.invest import CandleInterval
+
+import metrics
+from benchmarks.fake_client import FakeServices, unlimited_limiter
+from benchmarks.local_clickhouse import LocalClickHouse
+from functions import InformationParser
+
+
+def candles_pipeline(args, client, connection):
+    parser = InformationParser(client, limiter=unlimited_limiter(), candle_cache=False)
+    figi_list = [f'share_figi_{i}' for i in range(args.figi)]
+    parser.update_candles_table(figi_list, 'candles', connection, interval=CandleInterval.CANDLE_INTERVAL_1_MIN,
+                                depth=timedelta(days=args.days), max_workers=args.workers)
+    return int(metrics.counter('candles_rows_inserted_total', table='candles').value)
+
+
+def instruments_pipeline(args, client, connection):
+    parser = InformationParser(client, limiter=unlimited_limiter(), candle_cache=False)
+    return len(parser.total_instruments_df())
+
+
+def portfolio_pipeline(args, client, connection):
+    parser = InformationParser(client, limiter=unlimited_limiter(), candle_cache=False)
+    rows = 0
+    for account_id in parser.get_accounts():
+        for _ in range(args.repeat):
+            rows += len(parser.get_portfolio_df(account_id))
+    return rows
+
+
+def operations_pipeline(args, client, connection):
+    parser = InformationParser(client, limiter=unlimited_limiter(), candle_cache=False)
+    rows = 0
+    for account_id in parser.get_accounts():
+        for items in parser.iter_operations(account_id, datetime(2015, 1, 1, tzinfo=timezone.utc)):
+            rows += len([parser.operation_item_todict(o, account_id) for o in items])
+    return rows
+
+
+PIPELINES = {
+    'candles': candles_pipeline,
+    'instruments': instruments_pipeline,
+    'portfolio': portfolio_pipeline,
+    'operations': operations_pipeline,
+}
+
+
+def stage_timings():
+    """
+    Гистограммы времени из metrics: name{метки без figi} -> count, seconds
+    """
+    stages = {}
+    for name, kind, _, series in metrics.default_registry.series():
+        if kind != 'histogram':
+            continue
+        for labels, histogram in series:
+            labels = [(k, v) for k, v in labels if k != 'figi']
+            key = name + ('{' + ','.join(f'{k}={v}' for k, v in labels) + '}' if labels else '')
+            stage = stages.setdefault(key, {'count': 0, 'seconds': 0.0})
+            stage['count'] += histogram.count
+            stage['seconds'] += histogram.sum
+    return stages
+
+
+def run_pipeline(name, args, memory):
+    """
+    Прогон на новом FakeServices и LocalClickHouse, чтобы прогоны не зависели друг от друга
+    """
+    client = FakeServices(shares=args.shares, etfs=args.shares // 6, bonds=args.shares // 2,
+                          futures=args.shares // 4, positions=args.positions, operations=args.operations,
+                          accounts=args.accounts, latency=args.latency)
+    client.warm_up()
+    sink = LocalClickHouse()
+    connection = {'host': 'http://localhost:8123', 'database': 'tinkoff', 'table': 'instruments', 'session': sink}
+    metrics.default_registry.reset()
+    if memory:
+        tracemalloc.start()
+    started = perf_counter()
+    items = PIPELINES[name](args, client, connection)
+    seconds = perf_counter() - started
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return items, seconds, peak, sink
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, previous, threshold):
+    """
+    Печатаю изменения относительно previous
+    :return: True, если пропускная способность какого-то конвейера упала больше threshold
+    """
+    regression = False
+    print(f'\nСравнение с {previous.get("commit")} ({previous.get("created_at")}):')
+    for name, current in report['pipelines'].items():
+        old = previous.get('pipelines', {}).get(name)
+        if not old:
+            print(f'  {name}: нет в прошлом отчёте')
+            continue
+        change = current['throughput'] / old['throughput'] - 1 if old['throughput'] else 0.0
+        line = f'  {name}: {old["throughput"]:,.0f} -> {current["throughput"]:,.0f}/с ({change:+.1%})'
+        if current.get('peak_memory_bytes') and old.get('peak_memory_bytes'):
+            memory_change = current['peak_memory_bytes'] / old['peak_memory_bytes'] - 1
+            line += f', память {memory_change:+.1%}'
+        if change < -threshold:
+            regression = True
+            line += '  РЕГРЕССИЯ'
+        print(line)
+    return regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pipelines', nargs='+', default=list(PIPELINES), choices=list(PIPELINES))
+    parser.add_argument('--figi', type=int, default=20, help='figi в загрузке свечей')
+    parser.add_argument('--days', type=int, default=30, help='глубина истории минутных свечей')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--shares', type=int, default=2000, help='акций в справочнике, остальные типы - доли')
+    parser.add_argument('--positions', type=int, default=200)
+    parser.add_argument('--operations', type=int, default=20_000)
+    parser.add_argument('--accounts', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=10, help='запросов портфеля на счёт')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа fake API, секунды')
+    parser.add_argument('--no-memory', action='store_true', help='без прогона с tracemalloc')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='прошлый отчёт')
+    parser.add_argument('--threshold', type=float, default=0.1, help='допустимое падение пропускной способности')
+    args = parser.parse_args()
+
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'threshold')},
+        'pipelines': {},
+    }
+    for name in args.pipelines:
+        items, seconds, _, sink = run_pipeline(name, args, memory=False)
+        result = {
+            'items': items,
+            'seconds': seconds,
+            'throughput': items / seconds if seconds else 0.0,
+            'stages': stage_timings(),
+            'clickhouse': sink.stats(),
+        }
+        if not args.no_memory:
+            result['peak_memory_bytes'] = run_pipeline(name, args, memory=True)[2]
+        report['pipelines'][name] = result
+        memory = f', пик памяти {result["peak_memory_bytes"] / 2 ** 20:,.1f} МБ' if not args.no_memory else ''
+        print(f'{name}: {items:,} за {seconds:.2f} с, {result["throughput"]:,.0f}/с{memory}')
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f'Отчёт: {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(report, previous, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
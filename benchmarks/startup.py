@@ -0,0 +1,53 @@
+"""
+Время запуска: отдельный интерпретатор на каждый замер, медиана из --repeat.
+Сравнивает ленивый `import functions` и CLI с полной загрузкой подмодулей
+(как было до разделения functions на пакет).
+
+Запуск из корня проекта:
+    python -m benchmarks.startup --repeat 10
+Подробности по модулям: python -X importtime -c "import functions.information"
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+CASES = {
+    'python': 'pass',
+    'import functions': 'import functions',
+    'cli --help': 'import runpy, sys; sys.argv = ["functions", "--help"]; runpy.run_module("functions", run_name="__main__")',
+    'import functions.portfolio': 'import functions.portfolio',
+    'import functions.information': 'import functions.information',
+}
+
+
+def measure(code, repeat):
+    """
+    :return: (медиана секунд, ошибка или None)
+    """
+    times = []
+    for _ in range(repeat):
+        started = perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+        times.append(perf_counter() - started)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+    return statistics.median(times), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for name, code in CASES.items():
+        seconds, error = measure(code, args.repeat)
+        if error:
+            print(f'{name:32} ошибка: {error}')
+        else:
+            print(f'{name:32} {seconds * 1000:8.1f} мс')
+
+
+if __name__ == '__main__':
+    main()
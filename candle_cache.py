@@ -0,0 +1,103 @@
+"""
+Локальный кэш исторических свечей.
+Каждое выровненное окно GetCandles хранится отдельным .npy файлом
+и читается через memory map; размер кэша ограничен, вытесняются
+давно не читанные окна
+"""
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from candles import CandleColumns, RECORD_DTYPE
+
+
+class CandleCache:
+    """
+    Кэш завершённых окон свечей: market_data_cache/<interval>/<figi>/<window_from>.npy
+    """
+
+    def __init__(self, base_dir=Path('market_data_cache'), max_bytes=2 * 2 ** 30):
+        """
+        :param base_dir:
+        :param max_bytes: предельный размер кэша на диске
+        """
+        self.base_dir = Path(base_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.size = sum(p.stat().st_size for p in self.base_dir.rglob('*.npy'))
+
+    def path(self, figi, interval, window_from):
+        return self.base_dir / interval.name / figi / f'{int(window_from.timestamp())}.npy'
+
+    def get(self, figi, interval, window_from):
+        """
+        :param figi:
+        :param interval: CandleInterval
+        :param window_from: начало выровненного окна
+        :return: CandleColumns или None
+        """
+        path = self.path(figi, interval, window_from)
+        try:
+            try:
+                records = np.load(path, mmap_mode='r')
+            except ValueError:
+                # окно без свечей в память не отображается
+                records = np.load(path)
+        except (FileNotFoundError, ValueError):
+            records = None
+        if records is None or records.dtype != RECORD_DTYPE:
+            with self.lock:
+                self.misses += 1
+            return None
+        columns = CandleColumns.from_records(figi, records)
+        del records
+        try:
+            os.utime(path)  # время доступа для вытеснения
+        except FileNotFoundError:
+            pass  # окно уже вытеснено параллельным put, прочитанные свечи остаются верными
+        with self.lock:
+            self.hits += 1
+        return columns
+
+    def put(self, figi, interval, window_from, columns: CandleColumns):
+        path = self.path(figi, interval, window_from)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        with open(tmp, 'wb') as f:
+            np.save(f, columns.to_records())
+        old_size = path.stat().st_size if path.exists() else 0
+        os.replace(tmp, path)
+        with self.lock:
+            self.size += path.stat().st_size - old_size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Удаляю самые давно использованные окна, пока кэш не станет меньше 90% max_bytes
+        """
+        files = sorted(self.base_dir.rglob('*.npy'), key=lambda p: p.stat().st_mtime)
+        for p in files:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            size = p.stat().st_size
+            p.unlink(missing_ok=True)
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'evictions': self.evictions,
+                'size_bytes': self.size,
+            }
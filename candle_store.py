@@ -0,0 +1,201 @@
+"""
+Чтение свечей из ClickHouse с ресемплингом на стороне сервера
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import clickhouse
+from candles import CANDLE_COLUMNS, CANDLE_INTERVAL_STEP
+from schema import ROLLUPS, ROLLUP_SOURCE
+
+try:
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+MINUTE = timedelta(minutes=1)
+
+VALUE_COLUMNS = [c for c in CANDLE_COLUMNS if c not in ('figi', 'time')]
+
+
+def pick_source(step, table=ROLLUP_SOURCE):
+    """
+    Самый крупный агрегат, из свечей которого собирается свеча длиной step;
+    если такого нет - сама таблица. Агрегаты строятся только по ROLLUP_SOURCE,
+    для других таблиц (candles_hour, candles_day) они не подходят
+    :param step: timedelta
+    :param table: таблица свечей
+    :return: (таблица, длина её свечи; None для таблиц кроме ROLLUP_SOURCE)
+    """
+    if table != ROLLUP_SOURCE:
+        return table, None
+    for rollup, (rollup_step, _) in sorted(ROLLUPS.items(), key=lambda r: r[1][0], reverse=True):
+        if step >= rollup_step and step % rollup_step == timedelta(0):
+            return rollup, rollup_step
+    return table, MINUTE
+
+
+def interval_step(interval):
+    """
+    Длина свечи: timedelta или CandleInterval, кратно минуте
+    """
+    step = CANDLE_INTERVAL_STEP.get(interval, interval)
+    if step % MINUTE != timedelta(0):
+        raise ValueError(f'interval {interval} is not a whole number of minutes')
+    return step
+
+
+def candles_query(database, table, step, order=True):
+    """
+    SELECT свечей длиной step с колонками CANDLE_COLUMNS.
+    Параметры запроса: figi_list, start, end
+    :param database:
+    :param table: таблица свечей
+    :param step: timedelta
+    :param order: сортировать по (figi, time)
+    :return: текст запроса
+    """
+    source, _ = pick_source(step, table)
+    where = 'figi IN {figi_list:Array(String)} AND time >= {start:DateTime} AND time < {end:DateTime}'
+    order_by = 'ORDER BY figi, time' if order else ''
+
+    if source == table and step == MINUTE:
+        return f'SELECT {", ".join(CANDLE_COLUMNS)} FROM {database}.{table} FINAL WHERE {where} {order_by}'
+    # колонки переименованы в подзапросе, чтобы алиасы результата не перекрывали их в агрегатах
+    columns = 'time AS t, open AS o, close AS c, high AS h, low AS l, volume AS v'
+    if source == table:
+        inner = f'SELECT figi, {columns} FROM {database}.{table} FINAL WHERE {where}'
+        open_, close = 'argMin(o, t)', 'argMax(c, t)'
+    else:
+        inner = f'SELECT figi, {columns} FROM {database}.{source} WHERE {where}'
+        open_, close = 'argMinMerge(o)', 'argMaxMerge(c)'
+    return f'''
+        SELECT figi, toStartOfInterval(t, INTERVAL {int(step.total_seconds())} SECOND) AS time,
+               sum(v) AS volume, {open_} AS open, {close} AS close, max(h) AS high, min(l) AS low
+        FROM ({inner})
+        GROUP BY figi, time
+        {order_by}
+    '''
+
+
+def read_candles(connection, figi_list, start, end, interval=MINUTE, table='candles'):
+    """
+    Свечи figi_list за [start, end) длиной interval.
+    Агрегация выполняется в ClickHouse по самому крупному подходящему агрегату
+    (для table=ROLLUP_SOURCE) или по самой table
+    :param connection: connection pandahouse
+    :param figi_list:
+    :param start:
+    :param end:
+    :param interval: timedelta или CandleInterval
+    :param table: таблица свечей, например candles_day для дневной истории
+    :return: DataFrame с колонками CANDLE_COLUMNS, time - начало свечи (naive UTC)
+    """
+    q = candles_query(connection['database'], table, interval_step(interval))
+    params = {'figi_list': list(figi_list), 'start': start, 'end': end}
+    return clickhouse.read_frame(q, connection, params=params, parse_dates=['time'])
+
+
+def _row_dtype(columns):
+    """
+    Строка ответа CandleStore в RowBinary
+    """
+    return np.dtype([('figi_id', '<u2'), ('ts', '<i8')] + [(c, '<i8' if c == 'volume' else '<f8') for c in columns])
+
+
+class CandleStore:
+    """
+    Колоночное чтение свечей для исследований.
+    Фильтр по figi и времени и ресемплинг выполняются в ClickHouse,
+    ответ приходит в бинарном формате (ArrowStream, без pyarrow - RowBinary) и читается потоком.
+    figi передаётся номером в списке запроса, поэтому в ответе нет строк:
+    в DataFrame figi - category, остальные колонки numpy int64/float64/datetime64
+    """
+
+    def __init__(self, connection, table='candles', chunk_rows=1_000_000):
+        """
+        :param connection: connection pandahouse
+        :param table: таблица свечей, агрегаты используются только для ROLLUP_SOURCE
+        :param chunk_rows: строк в порции iter_read без pyarrow
+            (с pyarrow порция - блок ClickHouse)
+        """
+        self.connection = connection
+        self.table = table
+        self.chunk_rows = chunk_rows
+
+    def _query(self, step, columns):
+        inner = candles_query(self.connection['database'], self.table, step, order=False)
+        values = ', '.join(f'toInt64({c}) AS {c}' if c == 'volume' else f'toFloat64({c}) AS {c}' for c in columns)
+        return f'''
+            SELECT toUInt16(indexOf({{figi_list:Array(String)}}, figi) - 1) AS figi_id,
+                   toInt64(time) AS ts{', ' + values if values else ''}
+            FROM ({inner})
+            ORDER BY figi_id, ts
+        '''
+
+    def iter_read(self, figis, start, end, interval=MINUTE, columns=None):
+        """
+        Свечи порциями DataFrame, в порядке (figi в порядке figis, time)
+        :param figis: список figi
+        :param start:
+        :param end:
+        :param interval: timedelta или CandleInterval
+        :param columns: колонки из volume, open, close, high, low; по умолчанию все.
+            figi и time есть всегда
+        :return: генератор DataFrame
+        """
+        figi_list = list(dict.fromkeys(figis))
+        columns = list(columns or VALUE_COLUMNS)
+        unknown = set(columns) - set(VALUE_COLUMNS)
+        if unknown:
+            raise ValueError(f'unknown candle columns: {sorted(unknown)}')
+        query = self._query(interval_step(interval), columns)
+        params = {'figi_list': figi_list, 'start': start, 'end': end}
+
+        if pyarrow is not None:
+            response = clickhouse.execute(query, self.connection, params=params, stream=True,
+                                          settings={'default_format': 'ArrowStream'})
+            response.raw.decode_content = True
+            for batch in pyarrow.ipc.open_stream(response.raw):
+                yield self._frame(figi_list, {name: batch.column(name).to_numpy()
+                                              for name in batch.schema.names}, columns)
+            return
+
+        dtype = _row_dtype(columns)
+        response = clickhouse.execute(query, self.connection, params=params, stream=True,
+                                      settings={'default_format': 'RowBinary'})
+        buffer = bytearray()
+        chunk_bytes = self.chunk_rows * dtype.itemsize
+        for data in response.iter_content(chunk_size=2 ** 20):
+            buffer += data
+            if len(buffer) >= chunk_bytes:
+                size = len(buffer) // dtype.itemsize * dtype.itemsize
+                yield self._frame(figi_list, np.frombuffer(bytes(buffer[:size]), dtype=dtype), columns)
+                del buffer[:size]
+        if buffer:
+            yield self._frame(figi_list, np.frombuffer(bytes(buffer), dtype=dtype), columns)
+
+    def read(self, figis, start, end, interval=MINUTE, columns=None) -> pd.DataFrame:
+        """
+        Все свечи одним DataFrame, параметры как у iter_read
+        """
+        figi_list = list(dict.fromkeys(figis))
+        columns = list(columns or VALUE_COLUMNS)
+        chunks = list(self.iter_read(figi_list, start, end, interval, columns))
+        if not chunks:
+            return self._frame(figi_list, np.zeros(0, dtype=_row_dtype(columns)), columns)
+        return pd.concat(chunks, ignore_index=True)
+
+    @staticmethod
+    def _frame(figi_list, data, columns):
+        """
+        DataFrame из колонок ответа: figi_id -> category, ts -> datetime64 (naive UTC)
+        """
+        figi = pd.Categorical.from_codes(np.asarray(data['figi_id'], dtype=np.int32), categories=figi_list)
+        time = np.asarray(data['ts'], dtype=np.int64).astype('datetime64[s]').astype('datetime64[ns]')
+        frame = {'figi': figi, 'time': time}
+        for column in columns:
+            frame[column] = np.asarray(data[column])
+        return pd.DataFrame(frame, columns=['figi', 'time', *columns])
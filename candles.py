@@ -0,0 +1,265 @@
+from array import array
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from tinkoff.invest import CandleInterval
+
+import clickhouse
+import metrics
+
+CANDLE_COLUMNS = ['figi', 'time', 'volume', 'open', 'close', 'high', 'low']
+PRICE_COLUMNS = ['open', 'close', 'high', 'low']
+
+# максимальный период одного запроса GetCandles
+# https://tinkoff.github.io/investAPI/load_history/
+CANDLE_INTERVAL_WINDOW = {
+    CandleInterval.CANDLE_INTERVAL_1_MIN: timedelta(days=1),
+    CandleInterval.CANDLE_INTERVAL_5_MIN: timedelta(days=1),
+    CandleInterval.CANDLE_INTERVAL_15_MIN: timedelta(days=1),
+    CandleInterval.CANDLE_INTERVAL_HOUR: timedelta(days=7),
+    CandleInterval.CANDLE_INTERVAL_DAY: timedelta(days=364),
+}
+
+CANDLE_INTERVAL_STEP = {
+    CandleInterval.CANDLE_INTERVAL_1_MIN: timedelta(minutes=1),
+    CandleInterval.CANDLE_INTERVAL_5_MIN: timedelta(minutes=5),
+    CandleInterval.CANDLE_INTERVAL_15_MIN: timedelta(minutes=15),
+    CandleInterval.CANDLE_INTERVAL_HOUR: timedelta(hours=1),
+    CandleInterval.CANDLE_INTERVAL_DAY: timedelta(days=1),
+}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# сырые поля CandleColumns одной записью: для кэша на диске
+RECORD_DTYPE = np.dtype([
+    ('time', '<i8'), ('volume', '<i8'), ('units', '<i8', (4,)), ('nano', '<i4', (4,)),
+])
+
+
+def floor_time(moment, step):
+    """
+    Начало свечи длиной step, в которую попадает moment
+    """
+    return EPOCH + (moment - EPOCH) // step * step
+
+
+def candle_windows(from_, to, interval):
+    """
+    Делю [from_, to) на окна запросов GetCandles.
+    Границы окон выровнены от эпохи, поэтому одинаковы между запусками
+    :param from_:
+    :param to:
+    :param interval: CandleInterval
+    :return: список (window_from, window_to)
+    """
+    step = CANDLE_INTERVAL_WINDOW[interval]
+    windows = []
+    start = floor_time(from_, step)
+    while start < to:
+        end = start + step
+        windows.append((max(start, from_), min(end, to)))
+        start = end
+    return windows
+
+
+def quotation_to_float(units, nano):
+    """
+    Векторное преобразование Quotation/MoneyValue в float64
+    https://tinkoff.github.io/investAPI/faq_custom_types/
+    :param units: массив целых частей
+    :param nano: массив дробных частей (1e-9)
+    :return: np.ndarray float64
+    """
+    return np.asarray(units, dtype=np.float64) + np.asarray(nano, dtype=np.float64) / 1e9
+
+
+class CandleColumns:
+    """
+    Накопитель свечей одного figi.
+    Сырые поля складываются в растущие типизированные массивы (array.array),
+    DataFrame собирается один раз в to_frame()
+    """
+
+    def __init__(self, figi):
+        self.figi = figi
+        self._time = array('q')  # секунды от эпохи, UTC
+        self._volume = array('q')
+        self._units = array('q')  # open, close, high, low подряд
+        self._nano = array('i')
+
+    def __len__(self):
+        return len(self._volume)
+
+    def append(self, c):
+        """
+        Добавляю HistoricCandle/Candle
+        :param c:
+        :return:
+        """
+        self._time.append(int(c.time.timestamp()))
+        self._volume.append(c.volume)
+        self._units.extend((c.open.units, c.close.units, c.high.units, c.low.units))
+        self._nano.extend((c.open.nano, c.close.nano, c.high.nano, c.low.nano))
+
+    def extend(self, candles):
+        for c in candles:
+            self.append(c)
+
+    def extend_columns(self, other):
+        """
+        Дописываю накопленные колонки другого CandleColumns того же figi
+        """
+        self._time.extend(other._time)
+        self._volume.extend(other._volume)
+        self._units.extend(other._units)
+        self._nano.extend(other._nano)
+
+    def to_records(self) -> np.ndarray:
+        """
+        Сырые поля массивом RECORD_DTYPE
+        """
+        records = np.empty(len(self), dtype=RECORD_DTYPE)
+        records['time'] = np.array(self._time, dtype=np.int64)
+        records['volume'] = np.array(self._volume, dtype=np.int64)
+        records['units'] = np.array(self._units, dtype=np.int64).reshape(-1, 4)
+        records['nano'] = np.array(self._nano, dtype=np.int32).reshape(-1, 4)
+        return records
+
+    @classmethod
+    def from_records(cls, figi, records):
+        """
+        Обратное к to_records, records может быть memmap
+        """
+        columns = cls(figi)
+        columns._time.frombytes(np.ascontiguousarray(records['time'], dtype='<i8').tobytes())
+        columns._volume.frombytes(np.ascontiguousarray(records['volume'], dtype='<i8').tobytes())
+        columns._units.frombytes(np.ascontiguousarray(records['units'], dtype='<i8').tobytes())
+        columns._nano.frombytes(np.ascontiguousarray(records['nano'], dtype='<i4').tobytes())
+        return columns
+
+    def slice(self, from_, to):
+        """
+        Свечи с временем в [from_, to)
+        """
+        records = self.to_records()
+        time = records['time']
+        mask = (time >= int(from_.timestamp())) & (time < int(to.timestamp()))
+        return CandleColumns.from_records(self.figi, records[mask])
+
+    def _prices(self):
+        units = np.array(self._units, dtype=np.int64).reshape(-1, 4)
+        nano = np.array(self._nano, dtype=np.int32).reshape(-1, 4)
+        return quotation_to_float(units, nano)
+
+    def to_row_binary(self) -> bytes:
+        """
+        Строки в формате RowBinary с колонками CANDLE_COLUMNS
+        https://clickhouse.com/docs/en/interfaces/formats#rowbinary
+        :return:
+        """
+        figi = self.figi.encode()
+        # String в RowBinary: длина varint + байты; у figi длина < 128, varint из одного байта
+        prefix = bytes([len(figi)]) + figi
+        rows = np.empty(len(self), dtype=[
+            ('figi', f'S{len(prefix)}'), ('time', '<u4'), ('volume', '<i8'),
+            ('open', '<f8'), ('close', '<f8'), ('high', '<f8'), ('low', '<f8'),
+        ])
+        prices = self._prices()
+        rows['figi'] = prefix
+        rows['time'] = np.array(self._time, dtype=np.int64)
+        rows['volume'] = np.array(self._volume, dtype=np.int64)
+        for i, column in enumerate(PRICE_COLUMNS):
+            rows[column] = prices[:, i]
+        return rows.tobytes()
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Собираю DataFrame с колонками CANDLE_COLUMNS, time - naive UTC
+        :return:
+        """
+        prices = self._prices()
+        time = np.array(self._time, dtype=np.int64).astype('datetime64[s]').astype('datetime64[ns]')
+
+        return pd.DataFrame({
+            'figi': self.figi,
+            'time': time,
+            'volume': np.array(self._volume, dtype=np.int64),
+            'open': prices[:, 0],
+            'close': prices[:, 1],
+            'high': prices[:, 2],
+            'low': prices[:, 3],
+        }, columns=CANDLE_COLUMNS)
+
+
+class CandleWriter:
+    """
+    Буферизованная запись свечей в ClickHouse.
+    Свечи любых figi копятся в буфере RowBinary и отправляются одним INSERT,
+    когда набирается flush_rows строк или flush_bytes байт
+    """
+
+    def __init__(self, table, connection, flush_rows=100_000, flush_bytes=64 * 2 ** 20, on_flush=None):
+        """
+        :param table: таблица со свечами
+        :param connection: connection pandahouse
+        :param flush_rows:
+        :param flush_bytes:
+        :param on_flush: вызывается после вставки со списком записанных окон (figi, window_from, window_to)
+        """
+        self.query = f"INSERT INTO {connection['database']}.{table} ({', '.join(CANDLE_COLUMNS)}) FORMAT RowBinary"
+        self.table = table
+        self.connection = connection
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.on_flush = on_flush
+        self.rows_written = 0
+        self._chunks = []
+        self._rows = 0
+        self._bytes = 0
+        self._windows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+
+    def write(self, columns: CandleColumns, window=None):
+        """
+        :param columns: свечи одного окна
+        :param window: (window_from, window_to) - окно считается загруженным после вставки,
+            в том числе если свечей в нём нет
+        :return:
+        """
+        if window is not None:
+            self._windows.append((columns.figi, *window))
+        if len(columns):
+            chunk = columns.to_row_binary()
+            self._chunks.append(chunk)
+            self._rows += len(columns)
+            self._bytes += len(chunk)
+        if self._rows >= self.flush_rows or self._bytes >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        if self._chunks:
+            with metrics.timer('clickhouse_insert_seconds', 'Candle INSERT latency', table=self.table):
+                clickhouse.execute(self.query, self.connection, data=b''.join(self._chunks))
+            metrics.counter('candles_rows_inserted_total', 'Candle rows inserted', table=self.table).inc(self._rows)
+            metrics.counter('clickhouse_bytes_sent_total', 'RowBinary bytes sent', table=self.table).inc(self._bytes)
+        self.rows_written += self._rows
+        windows = self._windows
+        self.clear()
+        if self.on_flush and windows:
+            self.on_flush(windows)
+
+    def clear(self):
+        """
+        Сбрасываю буфер без вставки, например после неудачного flush: окна не отмечаются загруженными
+        """
+        self._chunks = []
+        self._rows = 0
+        self._bytes = 0
+        self._windows = []
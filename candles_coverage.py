@@ -0,0 +1,143 @@
+"""
+Индекс загруженных интервалов свечей.
+По нему синхронизация запрашивает у API только пропуски
+"""
+import clickhouse
+from candles import CANDLE_INTERVAL_STEP
+
+
+def merge_intervals(intervals):
+    """
+    Объединяю пересекающиеся и смежные интервалы [from, to)
+    :param intervals: iterable (from, to)
+    :return: отсортированный список (from, to)
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class CoverageIndex:
+    """
+    Загруженные интервалы [from, to) по figi для одного интервала свечей.
+    В таблице candles_coverage у figi одна строка с объединёнными интервалами
+    (ReplacingMergeTree по loaded_at), каждая запись переписывает её целиком,
+    поэтому таблица и чтение индекса не растут с числом загрузок
+    """
+
+    def __init__(self, connection, interval, table='candles_coverage'):
+        """
+        :param connection: connection pandahouse
+        :param interval: CandleInterval
+        :param table: таблица индекса
+        """
+        self.connection = connection
+        self.interval = interval
+        self.table = table
+        self.intervals = {}
+
+    def _read(self, figi_list):
+        """
+        Интервалы figi_list из таблицы индекса, как записаны
+        :return: dict figi -> список (from, to)
+        """
+        rows = clickhouse.read_rows(
+            f"SELECT figi, time_from, time_to FROM {self.connection['database']}.{self.table} FINAL "
+            'WHERE interval = {interval:String} AND figi IN {figi_list:Array(String)}',
+            self.connection, params={'figi_list': list(figi_list), 'interval': self.interval.name})
+        stored = {}
+        for r in rows:
+            stored.setdefault(r['figi'], []).extend(
+                (clickhouse.parse_datetime(start), clickhouse.parse_datetime(end))
+                for start, end in zip(r['time_from'], r['time_to']))
+        return stored
+
+    def _write(self, figi_list):
+        """
+        Переписываю строки figi_list текущими интервалами из памяти
+        """
+        clickhouse.insert_rows(self.table, [
+            {
+                'figi': figi,
+                'interval': self.interval.name,
+                'time_from': [start for start, _ in self.intervals[figi]],
+                'time_to': [end for _, end in self.intervals[figi]],
+            }
+            for figi in figi_list
+        ], self.connection)
+
+    def load(self, figi_list, candles_table=None):
+        """
+        Загружаю индекс по figi_list.
+        Для figi, по которым индекса ещё нет, но есть свечи в candles_table,
+        покрытым считается [min(time), max(time)] - так подхватываются данные,
+        загруженные до появления индекса
+        :param figi_list:
+        :param candles_table: таблица свечей для начального заполнения
+        :return:
+        """
+        stored = self._read(figi_list)
+        self.intervals = {figi: merge_intervals(v) for figi, v in stored.items()}
+        # строки с необъединёнными интервалами (после migrate_coverage_table) переписываю объединёнными
+        self._write([figi for figi, v in stored.items() if len(v) != len(self.intervals[figi])])
+
+        missing = [figi for figi in figi_list if figi not in self.intervals]
+        if candles_table and missing:
+            rows = clickhouse.read_rows(
+                "SELECT figi, min(time) AS time_from, max(time) AS time_to "
+                f"FROM {self.connection['database']}.{candles_table} "
+                'WHERE figi IN {figi_list:Array(String)} GROUP BY figi',
+                self.connection, params={'figi_list': missing})
+            step = CANDLE_INTERVAL_STEP[self.interval]
+            self.add([
+                (r['figi'], clickhouse.parse_datetime(r['time_from']), clickhouse.parse_datetime(r['time_to']) + step)
+                for r in rows
+            ])
+
+    def gaps(self, figi, start, end):
+        """
+        Незагруженные части [start, end)
+        :param figi:
+        :param start:
+        :param end:
+        :return: список (from, to)
+        """
+        gaps = []
+        cursor = start
+        for covered_from, covered_to in self.intervals.get(figi, []):
+            if covered_to <= cursor:
+                continue
+            if covered_from >= end:
+                break
+            if covered_from > cursor:
+                gaps.append((cursor, covered_from))
+            cursor = max(cursor, covered_to)
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def add(self, windows):
+        """
+        Отмечаю окна загруженными: в памяти и в таблице индекса.
+        Перед записью читаю строки этих figi из таблицы, чтобы не затереть интервалы,
+        записанные другим процессом (стрим, соседняя задача); если два процесса
+        пишут один figi одновременно, окна одного из них могут потеряться -
+        тогда они просто будут загружены повторно
+        :param windows: список (figi, from, to)
+        :return:
+        """
+        by_figi = {}
+        for figi, start, end in windows:
+            by_figi.setdefault(figi, []).append((start, end))
+        if not by_figi:
+            return
+        stored = self._read(by_figi)
+        for figi, figi_windows in by_figi.items():
+            self.intervals[figi] = merge_intervals(
+                self.intervals.get(figi, []) + stored.get(figi, []) + figi_windows)
+        self._write(by_figi)
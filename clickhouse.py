@@ -0,0 +1,110 @@
+"""
+Запросы к ClickHouse по HTTP с параметрами запроса
+https://clickhouse.com/docs/en/interfaces/http#cli-queries-with-parameters
+
+connection - тот же dict, что и у pandahouse: host, database, user, password;
+необязательный session - объект с методом post как у requests.Session
+(keep-alive между запросами или локальная замена сервера, см. benchmarks.local_clickhouse)
+"""
+import io
+import json
+from datetime import date, datetime, timezone
+
+import requests
+
+
+class ClickHouseError(Exception):
+    pass
+
+
+def _quote(value):
+    if isinstance(value, str):
+        return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+    return _format_param(value)
+
+
+def _format_param(value):
+    """
+    Значение параметра в текстовом формате ClickHouse
+    """
+    if isinstance(value, (list, tuple, set)):
+        return '[' + ','.join(_quote(v) for v in value) + ']'
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def execute(query, connection, params=None, data=None, stream=False, settings=None):
+    """
+    Выполняю запрос.
+    Если передан data, запрос уходит в url, а data - в теле (INSERT ... FORMAT ...)
+    :param query:
+    :param connection:
+    :param params: значения для {name:Type} в запросе
+    :param data: bytes или итератор bytes для вставки
+    :param stream: не читать ответ целиком
+    :param settings: настройки ClickHouse для запроса
+    :return: requests.Response
+    """
+    http_params = {'database': connection['database'], **(settings or {})}
+    for name, value in (params or {}).items():
+        http_params[f'param_{name}'] = _format_param(value)
+    if data is None:
+        body = query.encode()
+    else:
+        http_params['query'] = query
+        body = data
+
+    auth = None
+    if connection.get('user'):
+        auth = (connection['user'], connection.get('password', ''))
+    session = connection.get('session') or requests
+    response = session.post(connection['host'], params=http_params, data=body, auth=auth, stream=stream)
+    if response.status_code != 200:
+        raise ClickHouseError(response.text)
+    return response
+
+
+def read_rows(query, connection, params=None):
+    """
+    Выполняю SELECT и возвращаю строки списком dict
+    """
+    response = execute(query, connection, params=params, settings={'default_format': 'JSONEachRow'})
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+def read_frame(query, connection, params=None, parse_dates=None):
+    """
+    Выполняю SELECT и возвращаю pandas.DataFrame (формат CSVWithNames)
+    :param parse_dates: колонки DateTime
+    """
+    # pandas импортируется здесь: модулем пользуются и команды CLI без pandas (fx-rate через ratelimit и metrics)
+    import pandas as pd
+
+    response = execute(query, connection, params=params, settings={'default_format': 'CSVWithNames'})
+    return pd.read_csv(io.BytesIO(response.content), parse_dates=parse_dates)
+
+
+def insert_rows(table, rows, connection):
+    """
+    Вставляю список dict в формате JSONEachRow (для небольших служебных таблиц)
+    :param table: таблица в базе connection
+    :param rows:
+    :param connection:
+    :return:
+    """
+    if not rows:
+        return
+    data = '\n'.join(json.dumps(r, default=_format_param) for r in rows).encode()
+    execute(f"INSERT INTO {connection['database']}.{table} FORMAT JSONEachRow", connection, data=data)
+
+
+def parse_datetime(value):
+    """
+    DateTime из JSON-ответа ClickHouse (время сервера, UTC) в aware datetime
+    """
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
@@ -0,0 +1,220 @@
+"""
+Компактное хранение свечей в памяти и на диске.
+
+Строки отсортированы по (figi, time); figi не хранится в строках:
+offsets[i]:offsets[i + 1] - строки i-го figi. Время - uint32 (секунды UTC),
+объём - uint32, цены - int32 в шагах цены min_price_increment либо float32.
+Строка занимает 24 байта (плюс 8 байт offsets на figi). DataFrame из CandleStore.read
+(figi - category с кодами int8/int16, time, volume и цены по 8 байт) занимает 49-50 байт на строку,
+то есть выигрыш около 2.05 раза; против DataFrame со строковым figi (CandleColumns.to_frame) -
+около 2.3 раза без учёта самих строк.
+Массивы можно сохранить в каталог .npy и открыть через memory map:
+срезы по figi и времени - представления этих массивов, без копирования
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from candles import PRICE_COLUMNS
+
+TICKS = 'ticks'
+FLOAT32 = 'float32'
+
+ARRAYS = ['offsets', 'time', 'volume', *PRICE_COLUMNS]
+
+
+def ticks_from_instruments(instruments):
+    """
+    Шаг цены по figi из справочника инструментов
+    :param instruments: DataFrame с колонками figi, min_price_increment (таблица instruments)
+    :return: dict figi -> шаг цены
+    """
+    valid = instruments[instruments['min_price_increment'] > 0]
+    return dict(zip(valid['figi'], valid['min_price_increment'].astype(float)))
+
+
+class CandleSlice:
+    """
+    Свечи одного figi: представления массивов CompactCandles
+    """
+
+    def __init__(self, figi, tick, time, volume, prices):
+        self.figi = figi
+        self.tick = tick
+        self.time = time
+        self.volume = volume
+        self.raw = prices
+
+    def __len__(self):
+        return len(self.time)
+
+    def price(self, column):
+        """
+        Цены в float64 (копия)
+        """
+        values = self.raw[column]
+        if self.tick is None:
+            return values.astype(np.float64)
+        return values * self.tick
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            'time': self.time.astype('datetime64[s]').astype('datetime64[ns]'),
+            'volume': self.volume.astype(np.int64),
+            **{column: self.price(column) for column in PRICE_COLUMNS},
+        })
+
+
+class CompactCandles:
+    """
+    Свечи множества figi в плоских массивах, отсортированных по (figi, time)
+    """
+
+    def __init__(self, figi, ticks, arrays):
+        """
+        :param figi: список figi, номер в списке - id figi
+        :param ticks: шаг цены по figi (float64 [N]) или None для float32
+        :param arrays: dict имя из ARRAYS -> np.ndarray
+        """
+        self.figi = list(figi)
+        self.ids = {figi: i for i, figi in enumerate(self.figi)}
+        self.ticks = None if ticks is None else np.asarray(ticks, dtype=np.float64)
+        self.arrays = arrays
+
+    @property
+    def encoding(self):
+        return FLOAT32 if self.ticks is None else TICKS
+
+    def __len__(self):
+        return len(self.arrays['time'])
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.arrays.values())
+
+    @classmethod
+    def from_chunks(cls, figi, chunks, ticks=None):
+        """
+        Собираю из DataFrame-порций, отсортированных по (figi, time), например CandleStore.iter_read:
+        в памяти одновременно только порция float64 и уже сжатые массивы
+        :param figi: список figi порций (категории колонки figi)
+        :param chunks: итератор DataFrame с колонками figi (category), time, volume, open, close, high, low
+        :param ticks: dict figi -> шаг цены; None - цены в float32.
+            Цена, не кратная шагу своего figi, - ValueError: шаги потеряли бы её без следа
+        :return: CompactCandles
+        """
+        figi = list(figi)
+        if ticks is not None:
+            missing = [f for f in figi if f not in ticks]
+            if missing:
+                raise ValueError(f'no min_price_increment for {missing}')
+            ticks = np.array([ticks[f] for f in figi], dtype=np.float64)
+
+        parts = {name: [] for name in ARRAYS}
+        counts = np.zeros(len(figi), dtype=np.int64)
+        for chunk in chunks:
+            codes = chunk['figi'].cat.codes.to_numpy()
+            counts += np.bincount(codes, minlength=len(figi))
+            parts['time'].append(chunk['time'].to_numpy().astype('datetime64[s]').astype(np.uint32))
+            volume = chunk['volume'].to_numpy()
+            if volume.min(initial=0) < 0 or volume.max(initial=0) > np.iinfo(np.uint32).max:
+                raise ValueError('volume does not fit uint32')
+            parts['volume'].append(volume.astype(np.uint32))
+            for column in PRICE_COLUMNS:
+                values = chunk[column].to_numpy(dtype=np.float64)
+                if ticks is None:
+                    parts[column].append(values.astype(np.float32))
+                    continue
+                encoded = np.rint(values / ticks[codes])
+                if np.abs(encoded).max(initial=0) > np.iinfo(np.int32).max:
+                    raise ValueError(f'{column} does not fit int32 ticks, use float32')
+                # цена не кратна шагу, например история до смены min_price_increment
+                off_tick = ~np.isclose(encoded * ticks[codes], values, rtol=1e-9, atol=0)
+                if off_tick.any():
+                    off_figi = sorted({figi[code] for code in np.unique(codes[off_tick])})
+                    raise ValueError(f'{column} is not a multiple of min_price_increment for {off_figi}, '
+                                     'use float32')
+                parts[column].append(encoded.astype(np.int32))
+
+        price_dtype = np.float32 if ticks is None else np.int32
+        dtypes = {'time': np.uint32, 'volume': np.uint32, **{c: price_dtype for c in PRICE_COLUMNS}}
+        arrays = {name: np.concatenate(parts[name]) if parts[name] else np.zeros(0, dtype=dtypes[name])
+                  for name in dtypes}
+        arrays['offsets'] = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(figi, ticks, arrays)
+
+    @classmethod
+    def from_frame(cls, df, ticks=None):
+        """
+        :param df: DataFrame с колонками figi, time, volume, open, close, high, low в любом порядке строк
+        :param ticks: dict figi -> шаг цены; None - цены в float32
+        """
+        df = df.assign(figi=df['figi'].astype('category'))
+        df = df.sort_values(['figi', 'time'], kind='stable')
+        return cls.from_chunks(df['figi'].cat.categories, [df], ticks)
+
+    @classmethod
+    def from_store(cls, store, figi_list, start, end, interval, ticks=None):
+        """
+        Загружаю из CandleStore порциями
+        """
+        figi_list = list(dict.fromkeys(figi_list))
+        return cls.from_chunks(figi_list, store.iter_read(figi_list, start, end, interval), ticks)
+
+    def select(self, figi, start=None, end=None) -> CandleSlice:
+        """
+        Свечи figi за [start, end) без копирования: поиск границ searchsorted по отсортированному времени
+        """
+        i = self.ids[figi]
+        lo, hi = self.arrays['offsets'][i], self.arrays['offsets'][i + 1]
+        time = self.arrays['time'][lo:hi]
+        if start is not None:
+            lo += np.searchsorted(time, int(pd.Timestamp(start).timestamp()), side='left')
+        if end is not None:
+            hi = self.arrays['offsets'][i] + np.searchsorted(time, int(pd.Timestamp(end).timestamp()), side='left')
+        return CandleSlice(
+            figi, None if self.ticks is None else self.ticks[i],
+            self.arrays['time'][lo:hi], self.arrays['volume'][lo:hi],
+            {column: self.arrays[column][lo:hi] for column in PRICE_COLUMNS},
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Обратно в DataFrame с колонками CANDLE_COLUMNS (float64, figi - category)
+        """
+        counts = np.diff(self.arrays['offsets'])
+        codes = np.repeat(np.arange(len(self.figi)), counts)
+        prices = {}
+        for column in PRICE_COLUMNS:
+            values = self.arrays[column]
+            prices[column] = values.astype(np.float64) if self.ticks is None else values * self.ticks[codes]
+        return pd.DataFrame({
+            'figi': pd.Categorical.from_codes(codes, categories=self.figi),
+            'time': self.arrays['time'].astype('datetime64[s]').astype('datetime64[ns]'),
+            'volume': self.arrays['volume'].astype(np.int64),
+            **prices,
+        })
+
+    def save(self, directory):
+        """
+        Сохраняю массивы в directory/<имя>.npy, figi и шаги цены - в meta.json
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, values in self.arrays.items():
+            np.save(directory / f'{name}.npy', values)
+        meta = {'figi': self.figi, 'ticks': None if self.ticks is None else self.ticks.tolist()}
+        (directory / 'meta.json').write_text(json.dumps(meta))
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        :param directory: каталог save
+        :param mmap: открыть массивы через memory map (только чтение), данные читаются с диска по мере обращения
+        """
+        directory = Path(directory)
+        meta = json.loads((directory / 'meta.json').read_text())
+        arrays = {name: np.load(directory / f'{name}.npy', mmap_mode='r' if mmap else None) for name in ARRAYS}
+        return cls(meta['figi'], meta['ticks'], arrays)
@@ -0,0 +1,4 @@
+"""
+Корень проекта в sys.path для тестов (модули лежат в корне, не в пакете):
+    python -m pytest -q tests
+"""
@@ -0,0 +1,305 @@
+"""
+Долгоживущий сервис синхронизации: справочник инструментов, свечи 1m/1h/1d
+и операции по расписанию; метрики выгружаются в pipeline_metrics и, если задан файл, в textfile.
+
+Задачи выполняются в пуле потоков с приоритетом (меньше - раньше) и ограничением
+числа одновременных задач на сервис API; сами запросы идут через общий RateLimiter.
+Состояние задач (следующий запуск, ошибки) пишется в JSON после каждого запуска,
+поэтому после перезапуска выполняются только задачи, срок которых уже наступил.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from tinkoff.invest import CandleInterval
+
+import clickhouse
+import metrics
+import schema
+from instrument_cache import InstrumentCache
+from operations_store import OperationsStore
+
+logger = logging.getLogger(__name__)
+
+# интервал свечей -> (таблица, глубина истории, период обновления)
+CANDLE_SCHEDULE = {
+    CandleInterval.CANDLE_INTERVAL_1_MIN: ('candles', timedelta(days=30), timedelta(hours=1)),
+    CandleInterval.CANDLE_INTERVAL_HOUR: ('candles_hour', timedelta(days=730), timedelta(hours=6)),
+    CandleInterval.CANDLE_INTERVAL_DAY: ('candles_day', timedelta(days=3650), timedelta(days=1)),
+}
+
+# сколько задач одного сервиса API выполняется одновременно
+SERVICE_SLOTS = {
+    'market_data': 2,
+    'instruments': 1,
+    'operations': 1,
+}
+
+
+class Job:
+    """
+    Периодическая задача: func() вызывается раз в period.
+    При ошибке следующий запуск откладывается экспоненциально, но не дальше period
+    """
+
+    def __init__(self, name, func, period, priority=10, service=None, retry_delay=timedelta(minutes=1)):
+        """
+        :param name: уникальное имя, ключ состояния
+        :param func: функция без аргументов
+        :param period: timedelta
+        :param priority: меньше - раньше
+        :param service: сервис API из SERVICE_SLOTS
+        :param retry_delay: первая задержка после ошибки
+        """
+        self.name = name
+        self.func = func
+        self.period = period
+        self.priority = priority
+        self.service = service
+        self.retry_delay = retry_delay
+
+
+class Scheduler:
+
+    def __init__(self, state_path=Path('sync_state.json'), max_workers=4, service_slots=None):
+        """
+        :param state_path: файл состояния задач
+        :param max_workers: задач одновременно
+        :param service_slots: задач одновременно на сервис API
+        """
+        self.state_path = Path(state_path)
+        self.max_workers = max_workers
+        self.service_slots = {**SERVICE_SLOTS, **(service_slots or {})}
+        self.jobs = {}
+        self.running = set()
+        self.state = self._load_state()
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.stop_event = threading.Event()
+
+    def _load_state(self):
+        if not self.state_path.exists():
+            return {}
+        try:
+            return json.loads(self.state_path.read_text())
+        except ValueError:
+            logger.warning("Broken state file %s, all jobs are due", self.state_path)
+            return {}
+
+    def _save_state(self):
+        tmp = self.state_path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(self.state, indent=2, ensure_ascii=False))
+        os.replace(tmp, self.state_path)
+
+    def add(self, job: Job):
+        self.jobs[job.name] = job
+        self.state.setdefault(job.name, {'next_run': 0, 'failures': 0})
+
+    def due(self, moment):
+        """
+        Задачи, которые пора запускать и для которых есть свободный слот, в порядке приоритета
+        """
+        busy = {}
+        for name in self.running:
+            service = self.jobs[name].service
+            busy[service] = busy.get(service, 0) + 1
+        ready = []
+        for job in sorted(self.jobs.values(), key=lambda j: (j.priority, self.state[j.name]['next_run'])):
+            if job.name in self.running or self.state[job.name]['next_run'] > moment:
+                continue
+            if job.service is not None and busy.get(job.service, 0) >= self.service_slots.get(job.service, 1):
+                continue
+            busy[job.service] = busy.get(job.service, 0) + 1
+            ready.append(job)
+        return ready[:self.max_workers - len(self.running)]
+
+    def _run(self, job):
+        started = time.time()
+        error = None
+        try:
+            with metrics.timer('daemon_job_seconds', 'Scheduled job duration', job=job.name):
+                job.func()
+        except Exception as err:
+            logger.exception("Job %s failed", job.name)
+            error = repr(err)
+        finished = time.time()
+        with self.changed:
+            state = self.state[job.name]
+            state['last_run'] = started
+            state['duration'] = finished - started
+            if error is None:
+                state['failures'] = 0
+                state['last_success'] = finished
+                state.pop('last_error', None)
+                delay = job.period
+            else:
+                state['failures'] += 1
+                state['last_error'] = error
+                metrics.counter('daemon_job_failures_total', 'Failed scheduled jobs', job=job.name).inc()
+                delay = min(job.period, job.retry_delay * 2 ** (state['failures'] - 1))
+            state['next_run'] = finished + delay.total_seconds()
+            self.running.discard(job.name)
+            self._save_state()
+            self.changed.notify_all()
+
+    def stop(self):
+        self.stop_event.set()
+        with self.changed:
+            self.changed.notify_all()
+
+    def run(self):
+        """
+        Работаю до stop(); задачи, запущенные к этому моменту, дорабатывают
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sync') as executor:
+            with self.changed:
+                while not self.stop_event.is_set():
+                    moment = time.time()
+                    for job in self.due(moment):
+                        self.running.add(job.name)
+                        logger.info("Start job %s", job.name)
+                        executor.submit(self._run, job)
+                    # задачи, которым пора, но нет слота, ждут notify_all из _run, а не таймаута
+                    now = time.time()
+                    waiting = [self.state[name]['next_run'] for name in self.jobs
+                               if name not in self.running and self.state[name]['next_run'] > now]
+                    timeout = min(waiting, default=now + 60) - now
+                    self.changed.wait(timeout=min(timeout, 60))
+
+
+def instrument_figi(connection, instrument_types=('share', 'etf', 'future', 'bond')):
+    """
+    figi из таблицы инструментов
+    """
+    rows = clickhouse.read_rows(
+        f"SELECT DISTINCT figi FROM {connection['database']}.{connection['table']} "
+        "WHERE instrument_type IN {types:Array(String)}",
+        connection, params={'types': list(instrument_types)})
+    return [r['figi'] for r in rows]
+
+
+def portfolio_figi(manager):
+    """
+    figi позиций по всем счетам: их свечи обновляются первыми
+    """
+    figi = set()
+    for account_id in manager.get_accounts():
+        df = manager.get_portfolio_df(account_id)
+        if df is not None:
+            figi.update(df['figi'])
+    return figi
+
+
+def build_jobs(parser, connection, hot_figi=(), instrument_types=('share', 'etf', 'future'),
+               hot_period=timedelta(minutes=5), candle_schedule=None, max_workers=4,
+               metrics_textfile=None, metrics_period=timedelta(minutes=15)):
+    """
+    Задачи сервиса синхронизации
+    :param parser: InformationParser
+    :param connection: connection pandahouse (с ключом table - таблица инструментов)
+    :param hot_figi: figi, которые всегда обновляются первыми, вместе с figi портфеля
+    :param instrument_types: типы инструментов, по которым грузятся свечи
+    :param hot_period: период обновления минутных свечей горячих figi
+    :param candle_schedule: как CANDLE_SCHEDULE
+    :param max_workers: потоков загрузки свечей внутри задачи
+    :param metrics_textfile: файл для node_exporter textfile collector, None - только таблица pipeline_metrics
+    :param metrics_period: период выгрузки метрик
+    :return: список Job
+    """
+    candle_schedule = candle_schedule or CANDLE_SCHEDULE
+    cache = InstrumentCache()
+    hot = {'figi': None}
+
+    def sync_instruments():
+        parser.update_instruments_table(connection, cache=cache)
+
+    def sync_hot_figi():
+        hot['figi'] = set(hot_figi) | portfolio_figi(parser)
+
+    def sync_candles(interval, table, depth, only_hot):
+        def sync():
+            if hot['figi'] is None:
+                sync_hot_figi()
+            figi_list = sorted(hot['figi']) if only_hot else \
+                [f for f in instrument_figi(connection, instrument_types) if f not in hot['figi']]
+            if figi_list:
+                parser.update_candles_table(figi_list, table, connection, interval=interval, depth=depth,
+                                            max_workers=max_workers)
+        return sync
+
+    run_id = f'{socket.gethostname()}-{os.getpid()}-{int(time.time())}'
+
+    def export_metrics():
+        if metrics_textfile:
+            metrics.default_registry.write_textfile(metrics_textfile)
+        metrics.default_registry.write_clickhouse(connection, run_id=run_id)
+
+    operations = OperationsStore(parser, connection)
+    jobs = [
+        Job('metrics', export_metrics, metrics_period, priority=0),
+        Job('hot_figi', sync_hot_figi, timedelta(minutes=30), priority=0, service='operations'),
+        Job('instruments', sync_instruments, timedelta(hours=12), priority=1, service='instruments'),
+        Job('operations', lambda: operations.sync(parser.get_accounts()), timedelta(minutes=15),
+            priority=3, service='operations'),
+        Job('operations_reconcile', lambda: operations.reconcile(parser.get_accounts()), timedelta(days=1),
+            priority=8, service='operations'),
+    ]
+    for interval, (table, depth, period) in candle_schedule.items():
+        name = interval.name.replace('CANDLE_INTERVAL_', '').lower()
+        if interval == CandleInterval.CANDLE_INTERVAL_1_MIN:
+            jobs.append(Job(f'candles_{name}_hot', sync_candles(interval, table, depth, True), hot_period,
+                            priority=2, service='market_data'))
+        else:
+            jobs.append(Job(f'candles_{name}_hot', sync_candles(interval, table, depth, True), period,
+                            priority=4, service='market_data'))
+        jobs.append(Job(f'candles_{name}', sync_candles(interval, table, depth, False), period,
+                        priority=5, service='market_data'))
+
+    minute_table = candle_schedule.get(CandleInterval.CANDLE_INTERVAL_1_MIN, (None,))[0]
+    if minute_table == schema.ROLLUP_SOURCE:
+        # повторно вставленные свечи удваивают объём в агрегатах 5m/1h/1d до пересборки
+        jobs.append(Job('rollups', lambda: schema.rebuild_rollups(
+            connection, minute_table, since=datetime.now(timezone.utc) - timedelta(days=2)),
+            timedelta(hours=6), priority=9))
+    return jobs
+
+
+def create_tables(connection, candle_schedule=None):
+    """
+    Создаю таблицы, в которые пишет сервис (IF NOT EXISTS),
+    справочник инструментов перевожу на ReplacingMergeTree
+    """
+    schema.upgrade_instruments_table(connection, connection['table'])
+    for table, _, _ in (candle_schedule or CANDLE_SCHEDULE).values():
+        schema.create_candles_table(connection, table)
+    schema.create_coverage_table(connection)
+    schema.create_operations_table(connection)
+    schema.create_snapshots_table(connection)
+    schema.create_metrics_table(connection)
+
+
+def run(parser, connection, state_path=Path('sync_state.json'), max_workers=4, **kwargs):
+    """
+    Запускаю сервис синхронизации до остановки (Ctrl+C или SIGTERM)
+    :param parser: InformationParser
+    :param connection:
+    :param state_path:
+    :param max_workers: задач одновременно
+    :param kwargs: параметры build_jobs
+    """
+    create_tables(connection, kwargs.get('candle_schedule'))
+    scheduler = Scheduler(state_path, max_workers=max_workers)
+    for job in build_jobs(parser, connection, **kwargs):
+        scheduler.add(job)
+    signal.signal(signal.SIGTERM, lambda *_: scheduler.stop())
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
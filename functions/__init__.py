@@ -0,0 +1,44 @@
+"""
+Классы для работы с tinkoff api.
+Подмодули загружаются при первом обращении к их классам, так что
+`import functions` не тянет pandas и tinkoff.invest:
+    functions.PorfolioManager   -> functions.portfolio
+    functions.InformationParser -> functions.information
+Командная строка: python -m functions --help
+"""
+import importlib
+
+_LAZY = {
+    'PorfolioManager': 'functions.portfolio',
+    'InformationParser': 'functions.information',
+}
+
+__all__ = [*_LAZY, 'configure_display']
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *_LAZY])
+
+
+def configure_display():
+    """
+    Настройки вывода DataFrame в консоль и отключение FutureWarning;
+    раньше выполнялись при импорте модуля, теперь - только там, где нужны (CLI, скрипты)
+    """
+    import warnings
+
+    import pandas as pd
+
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+    pd.set_option('display.max_rows', 500)
+    pd.set_option('display.max_columns', 500)
+    pd.set_option('display.width', 1000)
@@ -0,0 +1,190 @@
+"""
+Командная строка для коротких задач по расписанию (cron).
+Каждая команда импортирует только то, что ей нужно: --help и разбор аргументов
+не загружают pandas и tinkoff.invest.
+
+    python -m functions sync-instruments
+    python -m functions sync-candles --type future --interval 1m --days 7
+    python -m functions snapshot-portfolio --write
+    python -m functions fx-rate usd eur
+    python -m functions stream --type share
+"""
+import argparse
+import os
+import sys
+import time
+
+INTERVALS = {
+    '1m': 'CANDLE_INTERVAL_1_MIN',
+    '5m': 'CANDLE_INTERVAL_5_MIN',
+    '15m': 'CANDLE_INTERVAL_15_MIN',
+    '1h': 'CANDLE_INTERVAL_HOUR',
+    '1d': 'CANDLE_INTERVAL_DAY',
+}
+
+
+def _connection(args):
+    return {'host': args.host, 'database': args.database, 'table': args.instruments_table}
+
+
+def _client(args):
+    from tinkoff.invest import Client
+
+    if not args.token:
+        sys.exit('READ_TOKEN не задан')
+    return Client(args.token)
+
+
+def sync_candles(args):
+    from datetime import timedelta
+
+    from tinkoff.invest import CandleInterval
+
+    import daemon
+    import schema
+    from functions.information import InformationParser
+
+    interval = CandleInterval[INTERVALS[args.interval]]
+    table = args.table or daemon.CANDLE_SCHEDULE.get(interval, (None,))[0]
+    if table is None:
+        sys.exit(f'для интервала {args.interval} укажите --table')
+    connection = _connection(args)
+    schema.create_candles_table(connection, table)
+    schema.create_coverage_table(connection)
+    figi_list = args.figi or daemon.instrument_figi(connection, args.type)
+    with _client(args) as client:
+        failed = InformationParser(client).update_candles_table(
+            figi_list, table, connection, interval=interval, depth=timedelta(days=args.days),
+            max_workers=args.workers)
+    return 1 if failed else 0
+
+
+def sync_instruments(args):
+    import schema
+    from functions.information import InformationParser
+    from instrument_cache import InstrumentCache
+
+    if not args.no_cache:
+        schema.upgrade_instruments_table(_connection(args), args.instruments_table)
+    with _client(args) as client:
+        cache = None if args.no_cache else InstrumentCache()
+        InformationParser(client).update_instruments_table(_connection(args), cache=cache, force=args.force)
+    return 0
+
+
+def snapshot_portfolio(args):
+    import schema
+    from functions import configure_display
+    from functions.portfolio import PorfolioManager
+    from operations_store import OperationsStore
+    from snapshot import take_snapshot, write_snapshot
+
+    configure_display()
+    with _client(args) as client:
+        manager = PorfolioManager(client, candle_cache=False)
+        snapshot = take_snapshot(manager, accounts=args.accounts)
+        if args.operations:
+            # только операции новее уже загруженных, а не вся история с 2015 года
+            schema.create_operations_table(_connection(args))
+            OperationsStore(manager, _connection(args)).sync(args.accounts or manager.get_accounts())
+    if args.write:
+        schema.create_snapshots_table(_connection(args))
+        write_snapshot(snapshot, _connection(args))
+    print(snapshot.consolidated_positions())
+    return 1 if snapshot.failed else 0
+
+
+def fx_rate(args):
+    from fx import FxRates
+    from ratelimit import default_limiter
+
+    with _client(args) as client:
+        rates = FxRates(client, default_limiter).rates(set(args.currencies))
+    for currency in args.currencies:
+        print(f'{currency}: {rates.get(currency.lower())}')
+    return 0
+
+
+def stream(args):
+    import logging
+    import signal
+
+    import daemon
+    import schema
+    from functions.information import InformationParser
+    from streaming import StreamIngestor
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=logging.INFO)
+    connection = _connection(args)
+    schema.create_candles_table(connection, args.table)
+    schema.create_coverage_table(connection)
+    if args.prices_table:
+        schema.create_last_prices_table(connection, args.prices_table)
+    figi_list = args.figi or daemon.instrument_figi(connection, args.type)
+    with _client(args) as client:
+        ingestor = StreamIngestor(InformationParser(client), figi_list, connection, candles_table=args.table,
+                                  prices_table=args.prices_table or None)
+        signal.signal(signal.SIGTERM, lambda *_: ingestor.stop())
+        try:
+            ingestor.run()
+        except KeyboardInterrupt:
+            ingestor.stop()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m functions', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--token', default=os.environ.get('READ_TOKEN'), help='по умолчанию READ_TOKEN')
+    parser.add_argument('--host', default=os.environ.get('CLICKHOUSE_HOST', 'http://localhost:8123'))
+    parser.add_argument('--database', default=os.environ.get('CLICKHOUSE_DATABASE', 'tinkoff'))
+    parser.add_argument('--instruments-table', default='instruments')
+    parser.add_argument('--timings', action='store_true', help='напечатать время запуска и выполнения')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    candles = commands.add_parser('sync-candles', help='догрузить свечи по индексу покрытия')
+    candles.add_argument('--figi', nargs='+', help='по умолчанию - все figi типов --type из таблицы инструментов')
+    candles.add_argument('--type', nargs='+', default=['share', 'etf', 'future'])
+    candles.add_argument('--interval', choices=list(INTERVALS), default='1m')
+    candles.add_argument('--table', help='по умолчанию - таблица интервала из daemon.CANDLE_SCHEDULE')
+    candles.add_argument('--days', type=int, default=365, help='глубина истории')
+    candles.add_argument('--workers', type=int, default=8)
+    candles.set_defaults(func=sync_candles)
+
+    instruments = commands.add_parser('sync-instruments', help='обновить таблицу инструментов')
+    instruments.add_argument('--force', action='store_true', help='обновить кэш независимо от ttl')
+    instruments.add_argument('--no-cache', action='store_true', help='без InstrumentCache: добавить только новые figi')
+    instruments.set_defaults(func=sync_instruments)
+
+    snapshot = commands.add_parser('snapshot-portfolio', help='снимок портфеля по всем счетам')
+    snapshot.add_argument('--accounts', nargs='+', help='по умолчанию - все доступные токену')
+    snapshot.add_argument('--write', action='store_true', help='записать в portfolio_snapshots')
+    snapshot.add_argument('--operations', action='store_true',
+                          help='догрузить новые операции счетов в таблицу operations (OperationsStore)')
+    snapshot.set_defaults(func=snapshot_portfolio)
+
+    fx = commands.add_parser('fx-rate', help='курсы валют к рублю')
+    fx.add_argument('currencies', nargs='+')
+    fx.set_defaults(func=fx_rate)
+
+    market_data = commands.add_parser('stream', help='минутные свечи и последние цены из стрима до Ctrl+C')
+    market_data.add_argument('--figi', nargs='+', help='по умолчанию - все figi типов --type из таблицы инструментов')
+    market_data.add_argument('--type', nargs='+', default=['share', 'etf', 'future'])
+    market_data.add_argument('--table', default='candles')
+    market_data.add_argument('--prices-table', default='last_prices', help='пустая строка - без последних цен')
+    market_data.set_defaults(func=stream)
+    return parser
+
+
+def main(argv=None):
+    started = time.perf_counter()
+    args = build_parser().parse_args(argv)
+    parsed = time.perf_counter()
+    code = args.func(args)
+    if args.timings:
+        print(f'запуск {parsed - started:.3f} с, команда {time.perf_counter() - parsed:.3f} с', file=sys.stderr)
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
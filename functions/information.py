@@ -0,0 +1,328 @@
+"""
+Рыночные данные: свечи и справочник инструментов, загрузка в ClickHouse
+"""
+from typing import Optional
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Full
+from threading import Event
+from time import perf_counter
+from datetime import timedelta
+import logging
+
+import pandahouse
+from tinkoff.invest import (
+    RequestError, CandleInterval,
+    SharesResponse, EtfsResponse, FuturesResponse, BondsResponse)
+from tinkoff.invest.utils import now
+from tinkoff.invest.schemas import InstrumentStatus
+import pandas as pd
+from pandas import DataFrame
+from tqdm import tqdm
+
+from candles import (
+    CandleColumns, CandleWriter, candle_windows, floor_time, CANDLE_INTERVAL_STEP, CANDLE_INTERVAL_WINDOW)
+from candles_coverage import CoverageIndex
+from instrument_cache import InstrumentCache
+from instrument_fields import (
+    instruments_to_frame, money_to_rub, SHARE_FIELDS, ETF_FIELDS, BOND_FIELDS, FUTURE_FIELDS, INSTRUMENT_FIELDS)
+import metrics
+from functions.portfolio import PorfolioManager
+
+logger = logging.getLogger(__name__)
+
+
+class InformationParser(PorfolioManager):
+
+    def iter_history_candles(self, figi, delta, interval=CandleInterval.CANDLE_INTERVAL_1_MIN, progress=True,
+                             to=None, stop=None):
+        """
+        Загружаю свечи окнами GetCandles через лимитер market_data.
+        Неудачное окно повторяется само, уже загруженные окна не перезапрашиваются
+        :param figi:
+        :param delta: начало периода
+        :param interval: CandleInterval
+        :param progress: показывать tqdm
+        :param to: конец периода, по умолчанию - текущий момент
+        :param stop: threading.Event, проверяется перед запросом каждого окна
+        :return: генератор (window_from, window_to, CandleColumns)
+        """
+        for window_from, window_to in tqdm(candle_windows(delta, to or now(), interval), disable=not progress):
+            if stop is not None and stop.is_set():
+                return
+            yield window_from, window_to, self.get_candles_window(figi, window_from, window_to, interval)
+
+    def get_candles_window(self, figi, window_from, window_to, interval):
+        """
+        Свечи одного окна GetCandles.
+        Если выровненное окно целиком в прошлом, оно читается через candle_cache:
+        при промахе запрашивается всё окно и кладётся в кэш, затем вырезается [window_from, window_to)
+        :param figi:
+        :param window_from:
+        :param window_to:
+        :param interval: CandleInterval
+        :return: CandleColumns
+        """
+        aligned_from = floor_time(window_from, CANDLE_INTERVAL_WINDOW[interval])
+        aligned_to = aligned_from + CANDLE_INTERVAL_WINDOW[interval]
+        if not self.candle_cache or aligned_to > floor_time(now(), CANDLE_INTERVAL_STEP[interval]):
+            return self.request_candles(figi, window_from, window_to, interval)
+
+        columns = self.candle_cache.get(figi, interval, aligned_from)
+        if columns is None:
+            columns = self.request_candles(figi, aligned_from, aligned_to, interval)
+            self.candle_cache.put(figi, interval, aligned_from, columns)
+        if (window_from, window_to) == (aligned_from, aligned_to):
+            return columns
+        return columns.slice(window_from, window_to)
+
+    def request_candles(self, figi, from_, to, interval):
+        r = self.limiter.call('market_data', self.client.market_data.get_candles,
+                              figi=figi, from_=from_, to=to, interval=interval)
+        with metrics.timer('candles_convert_seconds', 'GetCandles response to CandleColumns'):
+            columns = CandleColumns(figi)
+            columns.extend(r.candles)
+        return columns
+
+    def get_history_candles_df(self, figi: object, delta=None,
+                               interval=CandleInterval.CANDLE_INTERVAL_1_MIN, progress=True):
+        """
+        :param figi:
+        :param delta: начало периода, по умолчанию - год назад от момента вызова
+        :param interval: CandleInterval
+        :param progress: показывать tqdm
+        :return:
+        """
+        if delta is None:
+            delta = now() - timedelta(days=365)
+        candles = CandleColumns(figi)
+        print('Загружаем свечи: ', figi)
+        for _, _, columns in self.iter_history_candles(figi, delta, interval, progress):
+            candles.extend_columns(columns)
+
+        print('Свечи загружены')
+        return candles.to_frame()
+
+    def get_shares_df(self, raw_money=False) -> Optional[DataFrame]:
+        """
+        Преобразую SharesResponse в pandas.DataFrame
+        :param raw_money: MoneyValue без перевода в рубли (см. instruments_to_frame)
+        """
+        r: SharesResponse = self.limiter.call('instruments', self.client.instruments.shares,
+                                              instrument_status=InstrumentStatus(2))
+        if len(r.instruments) < 1: return None
+        df = instruments_to_frame(r.instruments, SHARE_FIELDS, self.fx.rates, raw_money)
+        df['instrument_type'] = 'share'
+        return df
+
+    def get_etf_df(self, raw_money=False) -> Optional[DataFrame]:
+        """
+        Преобразую EtfsResponse в pandas.DataFrame
+        :param raw_money: MoneyValue без перевода в рубли (см. instruments_to_frame)
+        """
+        r: EtfsResponse = self.limiter.call('instruments', self.client.instruments.etfs,
+                                            instrument_status=InstrumentStatus(2))
+        if len(r.instruments) < 1: return None
+        df = instruments_to_frame(r.instruments, ETF_FIELDS, self.fx.rates, raw_money)
+        df['instrument_type'] = 'etf'
+        return df
+
+    def get_bonds_df(self, raw_money=False) -> Optional[DataFrame]:
+        """
+        Преобразую BondsResponse в pandas.DataFrame
+        :param raw_money: MoneyValue без перевода в рубли (см. instruments_to_frame)
+        """
+        r: BondsResponse = self.limiter.call('instruments', self.client.instruments.bonds,
+                                             instrument_status=InstrumentStatus(2))
+        if len(r.instruments) < 1: return None
+        df = instruments_to_frame(r.instruments, BOND_FIELDS, self.fx.rates, raw_money)
+        df['instrument_type'] = 'bond'
+        return df
+
+    def get_futures_df(self, raw_money=False) -> Optional[DataFrame]:
+        """
+        Преобразую FuturesResponse в pandas.DataFrame
+        :param raw_money: MoneyValue без перевода в рубли (см. instruments_to_frame)
+        """
+        r: FuturesResponse = self.limiter.call('instruments', self.client.instruments.futures,
+                                               instrument_status=InstrumentStatus(2))
+        if len(r.instruments) < 1: return None
+        df = instruments_to_frame(r.instruments, FUTURE_FIELDS, self.fx.rates, raw_money)
+        df['instrument_type'] = 'future'
+        return df
+
+    def instruments_getters(self, raw_money=False):
+        return {
+            'bond': partial(self.get_bonds_df, raw_money),
+            'share': partial(self.get_shares_df, raw_money),
+            'etf': partial(self.get_etf_df, raw_money),
+            'future': partial(self.get_futures_df, raw_money),
+        }
+
+    def total_instruments_df(self, cache: Optional[InstrumentCache] = None):
+        """
+        :param cache: InstrumentCache; если передан, API запрашивается только для устаревших типов,
+            изменения в кэш не записываются (это делает update_instruments_table после вставки)
+        :return:
+        """
+        if cache is None:
+            frames = [getter() for getter in self.instruments_getters().values()]
+        else:
+            frames = [self._to_rub(instrument_type, cache.get(instrument_type, getter))
+                      for instrument_type, getter in self.instruments_getters(raw_money=True).items()]
+        concat_df = pd.concat(frames, axis=0, join='outer',
+                              ignore_index=False, keys=None,
+                              levels=None, names=None, verify_integrity=False, copy=True)
+
+        return concat_df
+
+    def _to_rub(self, instrument_type, df):
+        """
+        DataFrame из кэша (MoneyValue в своей валюте) в вид таблицы инструментов
+        """
+        if df is None:
+            return None
+        return money_to_rub(df, INSTRUMENT_FIELDS[instrument_type], self.fx.rates)
+
+    def update_instruments_table(self, connection, cache: Optional[InstrumentCache] = None, force=False):
+        """
+        Без кэша добавляю в бд figi, которых там ещё нет.
+        С кэшем вставляю только новые и изменившиеся по сравнению с кэшем строки
+        (сравниваются поля из API, MoneyValue - до перевода в рубли),
+        таблица ReplacingMergeTree оставляет последнюю версию инструмента
+        :param connection: connection pandahouse
+        :param cache: InstrumentCache
+        :param force: обновить кэш независимо от ttl
+        :return:
+        """
+        try:
+            if cache is None:
+                q = f'''SELECT figi from {connection["database"]}.{connection["table"]}'''
+                figi_exists = pandahouse.read_clickhouse(q, connection=connection)['figi'].to_list()
+                concat_df = self.total_instruments_df()
+                concat_df = concat_df[~concat_df['figi'].isin(figi_exists)]
+                pandahouse.to_clickhouse(concat_df, connection['table'], connection=connection, index=False)
+                print(f'Добавлено {concat_df.shape[0]} значений')
+                print(concat_df)
+                return
+
+            for instrument_type, getter in self.instruments_getters(raw_money=True).items():
+                df, changed = cache.refresh(instrument_type, getter, force=force, save=False)
+                if changed is None or changed.empty:
+                    continue
+                pandahouse.to_clickhouse(self._to_rub(instrument_type, changed), connection['table'],
+                                         connection=connection, index=False)
+                cache.save(instrument_type, df)
+                print(f'{instrument_type}: обновлено {changed.shape[0]} значений')
+        except RequestError as err:
+            tracking_id = err.metadata.tracking_id if err.metadata else ""
+            logger.error("Error tracking_id=%s code=%s", tracking_id, str(err.code))
+
+    def update_candles_table(self, figi_list, table, connection, interval=CandleInterval.CANDLE_INTERVAL_1_MIN,
+                             depth=timedelta(days=365), max_workers=1, flush_rows=100_000, queue_size=64,
+                             coverage_table='candles_coverage'):
+        """
+        Догружаю только пропуски за последние depth по индексу CoverageIndex,
+        так что повторный запуск без новых данных почти не обращается к API.
+        Окно отмечается загруженным только после вставки его свечей.
+        Загрузка идёт в max_workers потоках, окна свечей через ограниченную очередь
+        попадают в CandleWriter текущего потока, так что загрузка и вставка перекрываются,
+        а память не зависит от длины истории.
+        Ошибка по одному figi не останавливает остальные.
+        :param figi_list: список figi свечи, которых нужно достать
+        :param table: таблица для обновления
+        :param connection: connection pandahouse
+        :param interval: CandleInterval
+        :param depth: глубина истории
+        :param max_workers: количество параллельных загрузок
+        :param flush_rows: размер пачки вставки в строках
+        :param queue_size: сколько окон свечей может ждать вставки
+        :param coverage_table: таблица индекса загруженных интервалов
+        :return: список figi, по которым загрузка не удалась
+        """
+        print('Начинаю собирать данные...')
+        print(f'Необходимо собрать данные по {len(figi_list)} инструментам')
+        print()
+        failed = []
+        coverage = CoverageIndex(connection, interval, table=coverage_table)
+        coverage.load(figi_list, candles_table=table)
+        # незавершённую свечу не загружаем: она попадёт в следующий запуск уже окончательной
+        started = perf_counter()
+        end = floor_time(now(), CANDLE_INTERVAL_STEP[interval])
+        start = end - depth
+        batches = Queue(maxsize=queue_size)
+        stop = Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=1)
+                    return
+                except Full:
+                    pass
+
+        def produce(figi):
+            # после ошибки вставки задачи из очереди пула не делают запросов
+            if stop.is_set():
+                return
+            figi_started = perf_counter()
+            try:
+                for gap_from, gap_to in coverage.gaps(figi, start, end):
+                    for window_from, window_to, columns in self.iter_history_candles(
+                            figi, gap_from, interval, progress=max_workers == 1, to=gap_to, stop=stop):
+                        put((figi, (window_from, window_to), columns))
+                    if stop.is_set():
+                        return
+                put((figi, None, None))
+            except Exception as err:
+                put((figi, None, err))
+            finally:
+                metrics.histogram('candles_figi_seconds', 'Candles sync time per figi', figi=figi).observe(
+                    perf_counter() - figi_started)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        loaded = {}
+        try:
+            with CandleWriter(table, connection, flush_rows=flush_rows, on_flush=coverage.add) as writer:
+                for figi in figi_list:
+                    executor.submit(produce, figi)
+                pending = len(figi_list)
+                candles_loaded = metrics.counter('candles_loaded_total', 'Candles received from the API')
+                with metrics.profile('update_candles_table'):
+                    while pending:
+                        with metrics.timer('candles_queue_wait_seconds', 'Writer waiting for candle windows'):
+                            figi, window, item = batches.get()
+                        if isinstance(item, CandleColumns):
+                            writer.write(item, window)
+                            loaded[figi] = loaded.get(figi, 0) + len(item)
+                            candles_loaded.inc(len(item))
+                            continue
+                        pending -= 1
+                        if item is None:
+                            print(f'У {figi} загружено новых {loaded.get(figi, 0)} свечей')
+                        elif isinstance(item, RequestError):
+                            tracking_id = item.metadata.tracking_id if item.metadata else ""
+                            logger.error("figi=%s error tracking_id=%s code=%s", figi, tracking_id, str(item.code))
+                            failed.append(figi)
+                        else:
+                            logger.error("figi=%s candles update failed: %r", figi, item)
+                            failed.append(figi)
+        except BaseException:
+            # ошибка вставки: запущенные загрузки останавливаются перед следующим окном, ожидающие отменяются
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True)
+
+        elapsed = perf_counter() - started
+        total = sum(loaded.values())
+        metrics.counter('candles_failed_figi_total', 'Figi whose candles sync failed').inc(len(failed))
+        metrics.gauge('candles_per_second', 'Candles loaded per second in the last sync').set(
+            total / elapsed if elapsed else 0.0)
+
+        print(f'Все данные собраны: {total} свечей за {elapsed:.1f} с')
+        if self.candle_cache:
+            print(f'Кэш свечей: {self.candle_cache.stats()}')
+        if failed:
+            print(f'Не удалось загрузить {len(failed)} инструментов: {failed}')
+        return failed
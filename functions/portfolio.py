@@ -0,0 +1,235 @@
+"""
+Портфель: счета, позиции, деньги и операции
+"""
+from typing import Optional
+from datetime import datetime
+from pathlib import Path
+import logging
+
+from tinkoff.invest import (
+    PortfolioResponse,
+    PositionsResponse, PortfolioPosition,
+    AccessLevel, Operation, OperationsResponse,
+    GetOperationsByCursorRequest, GetOperationsByCursorResponse, OperationItem)
+from tinkoff.invest.services import Services
+from tinkoff.invest.utils import now
+import pandas as pd
+from pandas import DataFrame
+
+from candle_cache import CandleCache
+from ratelimit import default_limiter
+from fx import FxRates
+
+logger = logging.getLogger(__name__)
+
+
+class PorfolioManager:
+    def __init__(self, client: Services, limiter=None, candle_cache=None, fx=None):
+        """
+        :param client:
+        :param limiter: RateLimiter, по умолчанию общий на процесс
+        :param candle_cache: CandleCache для исторических свечей, False - без кэша
+        :param fx: FxRates, можно передать один на несколько менеджеров
+        """
+        self.client = client
+        self.limiter = limiter or default_limiter
+        self.fx = fx or FxRates(client, self.limiter)
+        self.accounts = []
+        self.comission = 0.0025  # TODO: прописать парсинг коммиссии
+        self.candle_cache = CandleCache(base_dir=Path("market_data_cache")) if candle_cache is None else candle_cache
+
+    def cast_money(self, v, to_rub=True):
+        """
+        https://tinkoff.github.io/investAPI/faq_custom_types/
+        :param to_rub:
+        :param v:
+        :return:
+        """
+        r = v.units + v.nano / 1e9
+        if to_rub:
+            r *= self.rub_rate(getattr(v, 'currency', ''))
+
+        return r
+
+    def rub_rate(self, currency):
+        """
+        Множитель перевода в рубли; для валют без известного курса - 1
+        :param currency:
+        :return:
+        """
+        if not currency or currency.lower() == 'rub':
+            return 1.0
+        rate = self.fx.rate(currency)
+        return 1.0 if rate is None else rate
+
+    def get_usdrur(self):
+        """
+        Получаю курс только если он нужен, кэш с истечением в FxRates
+        :return:
+        """
+        return self.fx.rate('usd')
+
+    def get_accounts(self):
+        """
+            Получаю все аккаунты и буду использовать только те
+            кот текущий токен может хотябы читать,
+            остальные акк пропускаю
+            :return:w
+            """
+        r = self.limiter.call('users', self.client.users.get_accounts)
+        self.accounts = []
+        for acc in r.accounts:
+            if acc.access_level != AccessLevel.ACCOUNT_ACCESS_LEVEL_NO_ACCESS:
+                self.accounts.append(acc.id)
+
+        return self.accounts
+
+    def portfolio_pose_todict(self, p: PortfolioPosition):
+        """
+        Преобразую PortfolioPosition в dict
+        :param p:
+        :return:
+        """
+        r = {
+            'figi': p.figi,
+            'quantity': self.cast_money(p.quantity),
+            'expected_yield': self.cast_money(p.expected_yield),
+            'instrument_type': p.instrument_type,
+            'average_buy_price': self.cast_money(p.average_position_price),
+            'current_price': self.cast_money(p.current_price),
+            'currency': p.average_position_price.currency,
+            'current_nkd': self.cast_money(p.current_nkd),
+            'sell_sum': (self.cast_money(p.current_price) + self.cast_money(p.current_nkd)) * self.cast_money(
+                p.quantity),
+            'comission': self.cast_money(p.current_price) * self.cast_money(p.quantity) * self.comission,
+        }
+
+        # expected_yield в Quotation а там нет currency
+        r['expected_yield'] *= self.rub_rate(r['currency'])
+
+        return r
+
+    def get_portfolio_df(self, account_id: str) -> Optional[DataFrame]:
+        """
+        Преобразую PortfolioResponse в pandas.DataFrame
+        :param account_id:
+        :return:
+        """
+        r: PortfolioResponse = self.limiter.call('operations', self.client.operations.get_portfolio,
+                                                 account_id=account_id)
+        if len(r.positions) < 1: return None
+        # все нужные курсы одним запросом до построчного преобразования
+        self.fx.rates({p.average_position_price.currency for p in r.positions})
+        df = pd.DataFrame([self.portfolio_pose_todict(p) for p in r.positions])
+        return df
+
+    def get_operations_df(self, account_id: str, from_=datetime(2015, 1, 1)) -> Optional[DataFrame]:
+        """
+        Преобразую PortfolioResponse в pandas.DataFrame
+        :param account_id:
+        :param from_: начало периода; для регулярной загрузки - OperationsStore
+        :return:
+        """
+        r: OperationsResponse = self.limiter.call(
+            'operations', self.client.operations.get_operations,
+            account_id=account_id,
+            from_=from_,
+            to=datetime.utcnow()
+        )
+
+        if len(r.operations) < 1: return None
+        df = pd.DataFrame([self.operation_todict(p, account_id) for p in r.operations])
+        return df
+
+    def operation_todict(self, o: Operation, account_id: str):
+        """
+        Преобразую PortfolioPosition в dict
+        :param o:
+        :return:
+        """
+        r = {
+            'acc': account_id,
+            'date': o.date,
+            'type': o.type,
+            'otype': o.operation_type,
+            'currency': o.currency,
+            'instrument_type': o.instrument_type,
+            'figi': o.figi,
+            'quantity': o.quantity,
+            'state': o.state,
+            'payment': self.cast_money(o.payment, False),
+            'price': self.cast_money(o.price, False),
+        }
+
+        return r
+
+    def iter_operations(self, account_id: str, from_: datetime, to: Optional[datetime] = None, limit=1000):
+        """
+        Операции счета постранично через GetOperationsByCursor
+        :param account_id:
+        :param from_:
+        :param to: по умолчанию - текущий момент
+        :param limit: размер страницы
+        :return: генератор списков OperationItem
+        """
+        cursor = ''
+        # конец периода один на все страницы курсора
+        to = to or now()
+        while True:
+            r: GetOperationsByCursorResponse = self.limiter.call(
+                'operations', self.client.operations.get_operations_by_cursor,
+                GetOperationsByCursorRequest(account_id=account_id, from_=from_, to=to,
+                                             cursor=cursor, limit=limit))
+            yield r.items
+            if not r.has_next:
+                break
+            cursor = r.next_cursor
+
+    def operation_item_todict(self, o: OperationItem, account_id: str):
+        """
+        Преобразую OperationItem в dict с колонками operation_todict и id операции
+        :param o:
+        :return:
+        """
+        r = {
+            'id': o.id,
+            'acc': account_id,
+            'date': o.date,
+            'type': o.name,
+            'otype': int(o.type),
+            'currency': o.payment.currency,
+            'instrument_type': o.instrument_type,
+            'figi': o.figi,
+            'quantity': o.quantity,
+            'state': int(o.state),
+            'payment': self.cast_money(o.payment, False),
+            'price': self.cast_money(o.price, False),
+        }
+
+        return r
+
+    def get_money_df(self, account_id: str) -> Optional[DataFrame]:
+        """
+        Преобразую PositionsResponse в pandas.DataFrame
+        :param account_id:
+        :return:
+        """
+        r: PositionsResponse = self.limiter.call('operations', self.client.operations.get_positions,
+                                                 account_id=account_id)
+        if len(r.money) < 1: return None
+        self.fx.rates({p.currency for p in r.money})
+        df = pd.DataFrame([self.money_pose_todict(p) for p in r.money])
+        return df
+
+    def money_pose_todict(self, p: PortfolioPosition):
+        """
+        Преобразую PortfolioPosition в dict
+        :param p:
+        :return:
+        """
+        r = {
+            'currency': p.currency,
+            'quantity': self.cast_money(p),
+        }
+
+        return r
@@ -0,0 +1,88 @@
+"""
+Курсы валют к рублю по последним ценам инструментов *RUB_TOM
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from tinkoff.invest import RequestError
+
+logger = logging.getLogger(__name__)
+
+CURRENCY_FIGI = {
+    'usd': 'BBG0013HGFT4',  # USD000UTSTOM
+    'eur': 'BBG0013HJJ31',  # EUR_RUB__TOM
+    'cny': 'BBG0013HRTL0',  # CNYRUB_TOM
+    'hkd': 'BBG0013HSW87',  # HKDRUB_TOM
+}
+
+
+class FxRates:
+    """
+    Кэш курсов с истечением через ttl, общий для потоков.
+    Все устаревшие курсы запрашиваются одним get_last_prices
+    """
+
+    def __init__(self, client, limiter, ttl=timedelta(minutes=5), currency_figi=None):
+        """
+        :param client: Services
+        :param limiter: RateLimiter
+        :param ttl: сколько курс считается актуальным
+        :param currency_figi: dict валюта -> figi инструмента с курсом в рублях
+        """
+        self.client = client
+        self.limiter = limiter
+        self.ttl = ttl.total_seconds()
+        self.currency_figi = currency_figi or CURRENCY_FIGI
+        self.lock = threading.Lock()
+        self._rates = {}  # валюта -> (курс, time.monotonic() получения)
+        self._unknown = set()
+
+    def rates(self, currencies):
+        """
+        Курсы к рублю
+        :param currencies: iterable кодов валют ('usd', 'rub', ...)
+        :return: dict валюта -> курс; валют без известного инструмента в ответе нет
+        """
+        currencies = {c.lower() for c in currencies if c}
+        result = {'rub': 1.0} if 'rub' in currencies else {}
+        currencies.discard('rub')
+        with self.lock:
+            moment = time.monotonic()
+            stale = [c for c in currencies if c not in self._rates or moment - self._rates[c][1] > self.ttl]
+            if stale:
+                self._fetch(stale)
+            result.update({c: self._rates[c][0] for c in currencies if c in self._rates})
+        return result
+
+    def rate(self, currency):
+        """
+        Курс одной валюты к рублю или None, если инструмент для валюты неизвестен
+        """
+        return self.rates([currency]).get(currency.lower())
+
+    def _fetch(self, currencies):
+        figi_currency = {}
+        for c in currencies:
+            if c in self.currency_figi:
+                figi_currency[self.currency_figi[c]] = c
+            elif c not in self._unknown:
+                self._unknown.add(c)
+                logger.warning("No rate instrument for currency %s, values are left unconverted", c)
+        if not figi_currency:
+            return
+        try:
+            r = self.limiter.call('market_data', self.client.market_data.get_last_prices,
+                                  figi=list(figi_currency))
+        except RequestError as err:
+            tracking_id = err.metadata.tracking_id if err.metadata else ""
+            logger.error("Error tracking_id=%s code=%s", tracking_id, str(err.code))
+            if any(c not in self._rates for c in figi_currency.values()):
+                raise
+            # все курсы уже были получены: работаю на последних известных
+            return
+        moment = time.monotonic()
+        for p in r.last_prices:
+            if p.figi in figi_currency:
+                self._rates[figi_currency[p.figi]] = (p.price.units + p.price.nano / 1e9, moment)
@@ -0,0 +1,346 @@
+"""
+Технические индикаторы с инкрементальным состоянием.
+
+Состояние индикатора - массивы по N инструментам, update обновляет его за O(1)
+на инструмент: можно передать свечу одного инструмента (index) или строку по всем.
+batch считает целый массив [T, N] без цикла по строкам: SMA - накопленной суммой
+(совпадает с update бит в бит), EMA и сглаживание Уайлдера (RSI, ATR) - накопленной
+суммой по блокам (smooth; совпадает с update с точностью до округления,
+относительная разница порядка 1e-12). После batch состояние
+продолжает обновляться через update (история -> стрим).
+NaN во входе означает, что у инструмента нет свечи: его состояние не меняется.
+Инструменты с пропусками или уже начатым состоянием batch считает по строкам через update.
+"""
+import numpy as np
+
+from candles import quotation_to_float
+
+SMOOTH_RANGE = 1e4
+
+
+def smooth(x, alpha, initial):
+    """
+    Рекурсивный фильтр y_t = (1 - alpha) * y_{t-1} + alpha * x_t по оси 0 без цикла по строкам:
+    внутри блока y_i = decay^i * (decay * y_{-1} + alpha * cumsum(x_k * decay^-k)_i).
+    Длина блока такая, что decay^-k не больше SMOOTH_RANGE, поэтому масштабирование
+    не переполняется и почти не теряет точность; между блоками передаётся последнее y
+    :param x: массив [T, N]
+    :param alpha:
+    :param initial: y_{-1}, массив [N]
+    :return: массив [T, N]
+    """
+    decay = 1 - alpha
+    if decay <= 0:
+        return x.copy()
+    size = max(1, int(np.log(SMOOTH_RANGE) / -np.log(decay)))
+    powers = decay ** np.arange(size)
+    result = np.empty_like(x)
+    y = initial
+    for start in range(0, len(x), size):
+        block = x[start:start + size]
+        n = len(block)
+        result[start:start + n] = powers[:n, None] * (
+            decay * y + alpha * np.cumsum(block / powers[:n, None], axis=0))
+        y = result[start + n - 1]
+    return result
+
+
+class Indicator:
+    """
+    Базовый класс: наследник задаёт inputs и _step
+    """
+    inputs = ('close',)
+
+    def __init__(self, size):
+        """
+        :param size: количество инструментов
+        """
+        self.size = size
+        self.value = np.full(size, np.nan)
+
+    def update(self, *values, index=None):
+        """
+        :param values: по массиву на каждое поле из inputs
+        :param index: номера инструментов для values; None - все
+        :return: значения индикатора для index
+        """
+        index = np.arange(self.size) if index is None else np.atleast_1d(index)
+        values = [np.atleast_1d(np.asarray(v, dtype=np.float64)) for v in values]
+        valid = ~np.logical_or.reduce([np.isnan(v) for v in values])
+        if valid.any():
+            self._step(index[valid], *(v[valid] for v in values))
+        return self.value[index]
+
+    def batch(self, *values):
+        """
+        :param values: по массиву [T, N] на каждое поле из inputs
+        :return: значения индикатора [T, N]
+        """
+        values = [np.asarray(v, dtype=np.float64) for v in values]
+        rows = values[0].shape[0]
+        result = np.empty(values[0].shape)
+        fast = self._fresh() & ~np.logical_or.reduce([np.isnan(v).any(axis=0) for v in values])
+        if rows and fast.any():
+            index = np.flatnonzero(fast)
+            result[:, index] = self._batch(index, *(v[:, index] for v in values))
+        rest = np.flatnonzero(~fast)
+        if len(rest):
+            for t in range(rows):
+                result[t, rest] = self.update(*(v[t, rest] for v in values), index=rest)
+        return result
+
+    def _fresh(self):
+        """
+        Инструменты без состояния: их batch считает через _batch
+        """
+        return np.zeros(self.size, dtype=bool)
+
+    def _batch(self, index, *values):
+        """
+        Весь массив [T, len(index)] без NaN для инструментов index без состояния,
+        состояние после последней строки - как после update
+        """
+        raise NotImplementedError
+
+    def _step(self, index, *values):
+        raise NotImplementedError
+
+
+class SMA(Indicator):
+    """
+    Простая скользящая средняя: (S_t - S_{t-window}) / window, где S - накопленная сумма.
+    Кольцевой буфер хранит последние window накопленных сумм
+    """
+
+    def __init__(self, size, window):
+        super().__init__(size)
+        self.window = window
+        self.total = np.zeros(size)
+        self.ring = np.zeros((window, size))
+        self.count = np.zeros(size, dtype=np.int64)
+
+    def _step(self, index, close):
+        self.total[index] += close
+        pos = self.count[index] % self.window
+        old = self.ring[pos, index]
+        self.ring[pos, index] = self.total[index]
+        self.count[index] += 1
+        self.value[index] = np.where(self.count[index] >= self.window,
+                                     (self.total[index] - old) / self.window, np.nan)
+
+    def _fresh(self):
+        return self.count == 0
+
+    def _batch(self, index, close):
+        # np.cumsum складывает последовательно, как update, поэтому результат тот же
+        total = np.cumsum(close, axis=0)
+        old = np.zeros_like(total)
+        old[self.window:] = total[:-self.window]
+        result = (total - old) / self.window
+        result[:self.window - 1] = np.nan
+
+        rows = close.shape[0]
+        last = np.arange(max(0, rows - self.window), rows)
+        self.ring[np.ix_(last % self.window, index)] = total[last]
+        self.total[index] = total[-1]
+        self.count[index] = rows
+        self.value[index] = result[-1]
+        return result
+
+
+class EMA(Indicator):
+    """
+    Экспоненциальная средняя с alpha = 2 / (window + 1), начальное значение - первая цена;
+    первые window - 1 значений - NaN
+    """
+
+    def __init__(self, size, window):
+        super().__init__(size)
+        self.window = window
+        self.alpha = 2 / (window + 1)
+        self.average = np.full(size, np.nan)
+        self.count = np.zeros(size, dtype=np.int64)
+
+    def _step(self, index, close):
+        average = self.average[index]
+        average = np.where(self.count[index] == 0, close, average + self.alpha * (close - average))
+        self.average[index] = average
+        self.count[index] += 1
+        self.value[index] = np.where(self.count[index] >= self.window, average, np.nan)
+
+    def _fresh(self):
+        return self.count == 0
+
+    def _batch(self, index, close):
+        average = np.empty_like(close)
+        average[0] = close[0]
+        average[1:] = smooth(close[1:], self.alpha, close[0])
+        result = average.copy()
+        result[:self.window - 1] = np.nan
+        self.average[index] = average[-1]
+        self.count[index] = len(close)
+        self.value[index] = result[-1]
+        return result
+
+
+class WilderAverage:
+    """
+    Сглаживание Уайлдера: первое значение - среднее первых window наблюдений,
+    дальше avg = (avg * (window - 1) + x) / window
+    """
+
+    def __init__(self, size, window):
+        self.window = window
+        self.average = np.zeros(size)
+        self.count = np.zeros(size, dtype=np.int64)
+
+    def step(self, index, x):
+        count = self.count[index] + 1
+        average = self.average[index]
+        self.average[index] = np.where(
+            count < self.window, average + x,
+            np.where(count == self.window, (average + x) / self.window,
+                     (average * (self.window - 1) + x) / self.window))
+        self.count[index] = count
+        return np.where(count >= self.window, self.average[index], np.nan)
+
+    def batch(self, index, x):
+        """
+        Как step по строкам x [T, len(index)] для инструментов index без наблюдений
+        """
+        rows = len(x)
+        result = np.full(x.shape, np.nan)
+        self.count[index] = rows
+        if rows < self.window:
+            self.average[index] = x.sum(axis=0)
+            return result
+        result[self.window - 1] = np.cumsum(x[:self.window], axis=0)[-1] / self.window
+        result[self.window:] = smooth(x[self.window:], 1 / self.window, result[self.window - 1])
+        self.average[index] = result[-1]
+        return result
+
+
+class RSI(Indicator):
+    """
+    RSI Уайлдера по изменениям цены закрытия
+    """
+
+    def __init__(self, size, window=14):
+        super().__init__(size)
+        self.window = window
+        self.previous = np.full(size, np.nan)
+        self.gains = WilderAverage(size, window)
+        self.losses = WilderAverage(size, window)
+
+    def _step(self, index, close):
+        previous = self.previous[index]
+        self.previous[index] = close
+        has_previous = ~np.isnan(previous)
+        index, close, previous = index[has_previous], close[has_previous], previous[has_previous]
+        change = close - previous
+        gain = self.gains.step(index, np.maximum(change, 0))
+        loss = self.losses.step(index, np.maximum(-change, 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.value[index] = np.where(loss == 0, 100.0, 100 - 100 / (1 + gain / loss))
+
+    def _fresh(self):
+        return np.isnan(self.previous)
+
+    def _batch(self, index, close):
+        result = np.full(close.shape, np.nan)
+        change = np.diff(close, axis=0)
+        self.previous[index] = close[-1]
+        if len(change):
+            gain = self.gains.batch(index, np.maximum(change, 0))
+            loss = self.losses.batch(index, np.maximum(-change, 0))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result[1:] = np.where(loss == 0, 100.0, 100 - 100 / (1 + gain / loss))
+        self.value[index] = result[-1]
+        return result
+
+
+class ATR(Indicator):
+    """
+    Средний истинный диапазон Уайлдера; у первой свечи TR = high - low
+    """
+    inputs = ('high', 'low', 'close')
+
+    def __init__(self, size, window=14):
+        super().__init__(size)
+        self.window = window
+        self.previous = np.full(size, np.nan)
+        self.ranges = WilderAverage(size, window)
+
+    def _step(self, index, high, low, close):
+        previous = self.previous[index]
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+        self.previous[index] = close
+        self.value[index] = self.ranges.step(index, true_range)
+
+    def _fresh(self):
+        return np.isnan(self.previous)
+
+    def _batch(self, index, high, low, close):
+        previous = np.vstack([np.full((1, len(index)), np.nan), close[:-1]])
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+        self.previous[index] = close[-1]
+        result = self.ranges.batch(index, true_range)
+        self.value[index] = result[-1]
+        return result
+
+
+class IndicatorSet:
+    """
+    Набор индикаторов по списку figi.
+    warm_up считает историю из backtest.Panel в batch-режиме,
+    on_candle обновляет индикаторы одной свечой, например из StreamIngestor:
+        indicators = IndicatorSet(figi_list, {'sma50': lambda n: SMA(n, 50), 'rsi': RSI})
+        indicators.warm_up(load_panel(store, figi_list, start, end))
+        ingestor.add_listener(indicators.on_candle)
+    """
+
+    def __init__(self, figi_list, factories):
+        """
+        :param figi_list:
+        :param factories: dict имя -> функция(size) -> Indicator
+        """
+        self.figi = list(figi_list)
+        self.positions = {figi: i for i, figi in enumerate(self.figi)}
+        self.indicators = {name: factory(len(self.figi)) for name, factory in factories.items()}
+
+    def warm_up(self, panel):
+        """
+        :param panel: backtest.Panel с полями, которые нужны индикаторам
+        :return: dict имя -> значения [T, len(figi_list)]
+        """
+        columns = {figi: i for i, figi in enumerate(panel.figi)}
+        order = [columns.get(figi) for figi in self.figi]
+
+        def field(name):
+            values = np.full((len(panel.time), len(self.figi)), np.nan)
+            present = [i for i, column in enumerate(order) if column is not None]
+            values[:, present] = panel[name][:, [order[i] for i in present]]
+            return values
+
+        return {name: indicator.batch(*(field(f) for f in indicator.inputs))
+                for name, indicator in self.indicators.items()}
+
+    def on_candle(self, candle):
+        """
+        Обновляю индикаторы закрытой свечой Candle из стрима (у свечи есть figi)
+        """
+        index = self.positions.get(candle.figi)
+        if index is None:
+            return
+        for indicator in self.indicators.values():
+            values = [quotation_to_float(getattr(candle, f).units, getattr(candle, f).nano) for f in indicator.inputs]
+            indicator.update(*values, index=index)
+
+    def values(self, figi=None):
+        """
+        Текущие значения: dict имя -> массив по figi_list или число для одного figi
+        """
+        if figi is None:
+            return {name: indicator.value.copy() for name, indicator in self.indicators.items()}
+        index = self.positions[figi]
+        return {name: indicator.value[index] for name, indicator in self.indicators.items()}
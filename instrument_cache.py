@@ -0,0 +1,104 @@
+"""
+Локальный кэш справочника инструментов по типам (share, etf, bond, future)
+"""
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    CACHE_FORMAT = 'parquet'
+except ImportError:
+    CACHE_FORMAT = 'pickle'
+
+
+def diff_instruments(old, new):
+    """
+    Строки new, которых нет в old или у которых изменилось хоть одно поле.
+    Сравнение идёт по всем колонкам, так что ключ figi/uid тоже учитывается.
+    Кэш хранит поля как в ответе API (MoneyValue - в своей валюте, см. raw_money
+    в instruments_to_frame), поэтому смена курса не делает инструменты изменившимися
+    :param old: DataFrame из кэша или None
+    :param new: свежий DataFrame
+    :return: DataFrame
+    """
+    if old is None or old.empty or list(old.columns) != list(new.columns):
+        return new
+    merged = new.merge(old.drop_duplicates(), on=list(new.columns), how='left', indicator=True)
+    return merged.loc[merged['_merge'] == 'left_only', list(new.columns)]
+
+
+class InstrumentCache:
+    """
+    Справочник каждого типа инструментов хранится в отдельном файле (parquet, если есть pyarrow).
+    Файл считается свежим ttl с момента записи
+    """
+
+    def __init__(self, base_dir=Path('instruments_cache'), ttl=timedelta(hours=12)):
+        self.base_dir = Path(base_dir)
+        self.ttl = ttl
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+
+    def path(self, instrument_type):
+        return self.base_dir / f'{instrument_type}.{CACHE_FORMAT}'
+
+    def is_fresh(self, instrument_type):
+        path = self.path(instrument_type)
+        return path.exists() and time.time() - path.stat().st_mtime < self.ttl.total_seconds()
+
+    def load(self, instrument_type):
+        path = self.path(instrument_type)
+        if not path.exists():
+            return None
+        if CACHE_FORMAT == 'parquet':
+            return pd.read_parquet(path)
+        return pd.read_pickle(path)
+
+    def save(self, instrument_type, df):
+        path = self.path(instrument_type)
+        tmp = path.with_suffix('.tmp')
+        if CACHE_FORMAT == 'parquet':
+            df.to_parquet(tmp, index=False)
+        else:
+            df.reset_index(drop=True).to_pickle(tmp)
+        os.replace(tmp, path)
+
+    def touch(self, instrument_type):
+        """
+        Продлеваю ttl файла без перезаписи
+        """
+        os.utime(self.path(instrument_type))
+
+    def refresh(self, instrument_type, fetch, force=False, save=True):
+        """
+        Обновляю кэш типа инструментов, если он устарел
+        :param instrument_type:
+        :param fetch: функция загрузки DataFrame из API
+        :param force: обновить независимо от ttl
+        :param save: записать в кэш сразу; иначе вызывающий сохраняет сам,
+            например после успешной вставки изменений в бд. Если изменений нет,
+            ttl кэша продлевается в любом случае - иначе каждый вызов заново запрашивал бы API
+        :return: (актуальный DataFrame, изменившиеся строки)
+        """
+        old = self.load(instrument_type)
+        if old is not None and not force and self.is_fresh(instrument_type):
+            return old, old.iloc[0:0]
+        new = fetch()
+        if new is None:
+            return old, None
+        changed = diff_instruments(old, new)
+        if save:
+            self.save(instrument_type, new)
+        elif changed.empty and old is not None:
+            self.touch(instrument_type)
+        return new, changed
+
+    def get(self, instrument_type, fetch):
+        """
+        Актуальный DataFrame только для чтения: кэш не перезаписывается,
+        он остаётся базой сравнения для следующего update_instruments_table
+        """
+        return self.refresh(instrument_type, fetch, save=False)[0]
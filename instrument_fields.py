@@ -0,0 +1,202 @@
+"""
+Описание полей инструментов и поколоночное преобразование
+списка protobuf-сообщений (Share, Etf, Bond, Future) в DataFrame
+"""
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from candles import quotation_to_float
+
+VALUE = 'value'
+QUOTATION = 'quotation'
+MONEY = 'money'  # MoneyValue: в рублях по курсу, как cast_money
+ENUM = 'enum'
+DATETIME = 'datetime'
+
+# колонка валюты MoneyValue при instruments_to_frame(..., raw_money=True)
+CURRENCY_SUFFIX = '_currency'
+
+
+class Field(NamedTuple):
+    column: str
+    kind: str = VALUE
+    dtype: Optional[str] = None  # тип колонки tinkoff.instruments, если отличается от естественного
+
+
+COMMON_HEAD = [
+    Field('figi'),
+    Field('ticker'),
+    Field('class_code'),
+]
+
+MARGIN_FIELDS = [
+    Field('lot', dtype='float64'),
+    Field('currency'),
+    Field('klong', QUOTATION),
+    Field('kshort', QUOTATION),
+    Field('dlong', QUOTATION),
+    Field('dshort', QUOTATION),
+    Field('dlong_min', QUOTATION),
+    Field('dshort_min', QUOTATION),
+    Field('short_enabled_flag'),
+    Field('name'),
+    Field('exchange'),
+]
+
+COMMON_TAIL = [
+    Field('min_price_increment', QUOTATION),
+    Field('api_trade_available_flag'),
+    Field('uid'),
+    Field('real_exchange', ENUM),
+    Field('position_uid'),
+]
+
+CANDLE_DATES = [
+    Field('for_iis_flag'),
+    Field('first_1min_candle_date', DATETIME),
+    Field('first_1day_candle_date', DATETIME),
+]
+
+TRADING_FLAGS = [
+    Field('trading_status', ENUM),
+    Field('otc_flag'),
+    Field('buy_available_flag'),
+    Field('sell_available_flag'),
+]
+
+SHARE_FIELDS = COMMON_HEAD + [Field('isin')] + MARGIN_FIELDS + [
+    Field('issue_size', dtype='float64'),
+    Field('country_of_risk'),
+    Field('country_of_risk_name'),
+    Field('sector'),
+    Field('issue_size_plan', dtype='float64'),
+    Field('nominal', MONEY),
+    *TRADING_FLAGS,
+    Field('div_yield_flag'),
+    Field('share_type', ENUM, dtype='float64'),
+] + COMMON_TAIL + CANDLE_DATES
+
+ETF_FIELDS = COMMON_HEAD + [Field('isin')] + MARGIN_FIELDS + [
+    Field('fixed_commission', MONEY),
+    Field('focus_type'),
+    Field('num_shares', MONEY),
+    Field('country_of_risk'),
+    Field('country_of_risk_name'),
+    Field('sector'),
+    Field('rebalancing_freq'),
+    *TRADING_FLAGS,
+] + COMMON_TAIL + CANDLE_DATES
+
+BOND_FIELDS = COMMON_HEAD + [Field('isin')] + MARGIN_FIELDS + [
+    Field('coupon_quantity_per_year', dtype='float64'),
+    Field('nominal', MONEY),
+    Field('placement_price', MONEY),
+    Field('aci_value', MONEY),
+    Field('country_of_risk'),
+    Field('country_of_risk_name'),
+    Field('sector'),
+    Field('issue_kind'),
+    Field('issue_size', dtype='float64'),
+    Field('issue_size_plan', dtype='float64'),
+    *TRADING_FLAGS,
+    Field('floating_coupon_flag'),
+    Field('perpetual_flag'),
+    Field('amortization_flag'),
+] + COMMON_TAIL + CANDLE_DATES
+
+FUTURE_FIELDS = COMMON_HEAD + MARGIN_FIELDS + [
+    Field('futures_type'),
+    Field('asset_type'),
+    Field('basic_asset'),
+    Field('basic_asset_size', MONEY),
+    Field('country_of_risk'),
+    Field('country_of_risk_name'),
+    Field('sector'),
+    *TRADING_FLAGS,
+] + COMMON_TAIL + [Field('basic_asset_position_uid')] + CANDLE_DATES
+
+INSTRUMENT_FIELDS = {
+    'share': SHARE_FIELDS,
+    'etf': ETF_FIELDS,
+    'bond': BOND_FIELDS,
+    'future': FUTURE_FIELDS,
+}
+
+
+def decode_money(values, rates=None):
+    """
+    Пакетное преобразование Quotation/MoneyValue в float64.
+    MoneyValue не в рублях переводится в рубли, как в cast_money
+    :param values: список Quotation/MoneyValue
+    :param rates: функция set валют -> dict валюта -> курс (FxRates.rates)
+    :return: np.ndarray float64
+    """
+    n = len(values)
+    r = quotation_to_float(np.fromiter((v.units for v in values), dtype=np.int64, count=n),
+                           np.fromiter((v.nano for v in values), dtype=np.int64, count=n))
+    if rates is not None:
+        currency = np.array([getattr(v, 'currency', '').lower() for v in values], dtype=object)
+        foreign = set(currency) - {'', 'rub'}
+        if foreign:
+            for c, rate in rates(foreign).items():
+                r[currency == c] *= rate
+    return r
+
+
+def instruments_to_frame(instruments, fields, rates=None, raw_money=False) -> pd.DataFrame:
+    """
+    Преобразую список инструментов в DataFrame по описанию полей, колонка за колонкой
+    :param instruments: список Share/Etf/Bond/Future
+    :param fields: список Field
+    :param rates: функция курсов для MoneyValue (FxRates.rates)
+    :param raw_money: MoneyValue без перевода в рубли, валюта - в колонке <поле>_currency;
+        в рубли по текущему курсу переводит money_to_rub
+    :return:
+    """
+    n = len(instruments)
+    columns = {}
+    for field in fields:
+        values = [getattr(p, field.column) for p in instruments]
+        if field.kind == QUOTATION:
+            column = decode_money(values)
+        elif field.kind == MONEY and raw_money:
+            column = decode_money(values)
+            columns[field.column + CURRENCY_SUFFIX] = [getattr(v, 'currency', '').lower() for v in values]
+        elif field.kind == MONEY:
+            column = decode_money(values, rates)
+        elif field.kind == ENUM:
+            column = np.fromiter((int(v) for v in values), dtype=np.int64, count=n)
+        elif field.kind == DATETIME:
+            column = pd.to_datetime(values, utc=True).tz_localize(None)
+        else:
+            column = values
+        if field.dtype is not None:
+            column = np.asarray(column, dtype=field.dtype)
+        columns[field.column] = column
+    return pd.DataFrame(columns)
+
+
+def money_to_rub(df, fields, rates) -> pd.DataFrame:
+    """
+    Перевожу MoneyValue из DataFrame instruments_to_frame(..., raw_money=True) в рубли,
+    колонки <поле>_currency убираю: результат такой же, как instruments_to_frame с rates
+    :param df:
+    :param fields: список Field
+    :param rates: функция set валют -> dict валюта -> курс (FxRates.rates)
+    :return: новый DataFrame
+    """
+    df = df.copy()
+    currency_columns = [f.column + CURRENCY_SUFFIX for f in fields
+                        if f.kind == MONEY and f.column + CURRENCY_SUFFIX in df]
+    foreign = set().union(*(df[c] for c in currency_columns)) - {'', 'rub'}
+    known = rates(foreign) if foreign else {}
+    for currency_column in currency_columns:
+        column = currency_column[:-len(CURRENCY_SUFFIX)]
+        values = df[column].to_numpy(dtype=np.float64, copy=True)
+        currency = df[currency_column].to_numpy()
+        for c, rate in known.items():
+            values[currency == c] *= rate
+        df[column] = values
+    return df.drop(columns=currency_columns)
@@ -1,13 +1,10 @@
+import logging
 import os
-import functions
+
 from tinkoff.invest import Client
-from tinkoff.invest import (
-    RequestError, PortfolioResponse,
-    PositionsResponse, PortfolioPosition,
-    AccessLevel, Operation, CandleInterval, )
-import pandahouse
-from datetime import timezone, datetime, timezone
 
+import daemon
+import functions
 
 READ_TOKEN = os.environ.get('READ_TOKEN')
 
@@ -17,66 +14,21 @@ connection = {
     'table': 'instruments',
 }
 
-q = 'SELECT * FROM tinkoff.instruments'
-table = 'instruments'
+# figi, свечи которых обновляются первыми вместе с позициями портфеля
+HOT_FIGI = os.environ.get('HOT_FIGI', '').split(',') if os.environ.get('HOT_FIGI') else []
+
+# файл метрик в формате Prometheus для node_exporter; метрики также пишутся в pipeline_metrics
+METRICS_TEXTFILE = os.environ.get('METRICS_TEXTFILE')
 
 
 def main():
+    logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=logging.INFO)
     with Client(READ_TOKEN) as client:
-        porfolio_manager = functions.PorfolioManager(client)
-        # # Курс доллара
-        # print(f'Текущий курс доллара: {porfolio_manager.get_usdrur()} р.')
-        # # Cчета
-        # accounts = porfolio_manager.get_accounts()
-        # print(f'Актуальные счета: {accounts}')
-        #
-        # # Вывод актуальных позиций на кажом счете
-        # portfolio = porfolio_manager.get_portfolio_df('2125540118')
-        # print(portfolio.tail())
-        #
-        # # Операции по счету
-        # operations = porfolio_manager.get_operations_df('2125540118')
-        #
-        # print(operations.tail())
-        #
-        # # Денежные позиции на счете
-        # print(porfolio_manager.get_money_df('2125540118'))
-
-        # Исторические данные по свечам
         information_parser = functions.InformationParser(client)
-
-        # candles = information_parser.get_history_candles_df('BBG000HS77T5')
-
-        # Обновление БД по свечам всех акций
-        shares = pandahouse.read_clickhouse("SELECT figi FROM tinkoff.instruments WHERE instrument_type = 'share'", connection=connection)
-        shares = shares['figi'].to_list()
-
-        # Обновление БД по свечам фьючерсов
-        futures = pandahouse.read_clickhouse("SELECT figi FROM tinkoff.instruments WHERE instrument_type = 'future'", connection=connection)
-        futures = futures['figi'].to_list()
-        # information_parser.update_candles_table(figi_list=futures, table='candles', connection=connection)
-
-        figi = ['BBG000BB07P9', 'BBG000B9XRY4']
-        information_parser.update_candles_table(figi_list=futures, table='candles', connection=connection)
-        # information_parser.get_history_candles_df('BBG000BB07P9')
-
-        # print(candles.tail())
-        # # Выгрузка всей информации по акциям
-        # shares = information_parser.get_shares_df()
-        # print(shares.tail())
-        # # Выгрузка всей информации по etf
-        # etf = information_parser.get_etf_df()
-        # print(etf.tail())
-        # # Выгрузка всей информации по облигациям
-        # bonds = information_parser.get_bonds_df()
-        # print(bonds.tail())
-        #
-        # # Выгрузка всей информации по фьючерсам
-        # futures = information_parser.get_futures_df()
-        # print(futures.tail())
-        #
-        # # обновление БД по инструментам
-        # information_parser.update_instruments_table(connection=connection)
+        # Справочник инструментов, свечи 1m/1h/1d и операции по расписанию daemon.CANDLE_SCHEDULE;
+        # состояние задач в sync_state.json, после перезапуска выполняются только просроченные задачи
+        daemon.run(information_parser, connection, state_path=os.environ.get('SYNC_STATE', 'sync_state.json'),
+                   hot_figi=HOT_FIGI, metrics_textfile=METRICS_TEXTFILE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,207 @@
+"""
+Метрики загрузки данных: счётчики, значения и гистограммы времени по стадиям.
+Экспорт в текстовом формате Prometheus (для node_exporter textfile collector)
+или в таблицу ClickHouse pipeline_metrics.
+
+    with metrics.timer('candles_insert_seconds'):
+        ...
+    metrics.counter('candles_rows_inserted_total').inc(rows)
+    metrics.default_registry.write_textfile('/var/lib/node_exporter/tinkoff.prom')
+
+Профилирование горячих участков включается переменной окружения PIPELINE_PROFILE=<каталог>:
+    with metrics.profile('update_candles_table'):
+        ...
+"""
+import cProfile
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import clickhouse
+
+# границы гистограмм времени, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    items = [*labels, *extra]
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{str(v)}"' for k, v in items) + '}'
+
+
+class Counter:
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Gauge:
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip((*self.buckets, float('inf')), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """
+    Метрики по имени и набору меток; потокобезопасный
+    """
+
+    def __init__(self):
+        self.metrics = {}  # name -> (тип, help, {labels_key: metric})
+        self.lock = threading.Lock()
+
+    def _get(self, kind, factory, name, help, labels):
+        key = _labels_key(labels)
+        with self.lock:
+            _, _, series = self.metrics.setdefault(name, (kind, help, {}))
+            metric = series.get(key)
+            if metric is None:
+                metric = series[key] = factory()
+            return metric
+
+    def counter(self, name, help='', **labels) -> Counter:
+        return self._get('counter', Counter, name, help, labels)
+
+    def gauge(self, name, help='', **labels) -> Gauge:
+        return self._get('gauge', Gauge, name, help, labels)
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS, **labels) -> Histogram:
+        return self._get('histogram', lambda: Histogram(buckets), name, help, labels)
+
+    @contextmanager
+    def timer(self, name, help='', **labels):
+        """
+        Время блока в гистограмму name
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histogram(name, help, **labels).observe(time.perf_counter() - started)
+
+    def series(self):
+        with self.lock:
+            return [(name, kind, help, list(series.items()))
+                    for name, (kind, help, series) in sorted(self.metrics.items())]
+
+    def to_prometheus(self) -> str:
+        """
+        Все метрики в текстовом формате Prometheus
+        https://prometheus.io/docs/instrumenting/exposition_formats/
+        """
+        lines = []
+        for name, kind, help, series in self.series():
+            if help:
+                lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, metric in series:
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {metric.value}')
+                    continue
+                for bound, total in metric.cumulative():
+                    le = '+Inf' if bound == float('inf') else bound
+                    lines.append(f'{name}_bucket{_format_labels(labels, [("le", le)])} {total}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {metric.sum}')
+                lines.append(f'{name}_count{_format_labels(labels)} {metric.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """
+        Атомарно записываю to_prometheus() в файл
+        """
+        path = Path(path)
+        tmp = path.with_suffix(path.suffix + '.tmp')
+        tmp.write_text(self.to_prometheus())
+        os.replace(tmp, path)
+
+    def rows(self, run_id=''):
+        """
+        Строки для таблицы pipeline_metrics: у гистограммы value - сумма, count - количество наблюдений
+        """
+        ts = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        rows = []
+        for name, kind, _, series in self.series():
+            for labels, metric in series:
+                row = {'ts': ts, 'run_id': run_id, 'name': name, 'labels': dict(labels)}
+                if kind == 'histogram':
+                    rows.append({**row, 'value': metric.sum, 'count': metric.count})
+                else:
+                    rows.append({**row, 'value': metric.value, 'count': 0})
+        return rows
+
+    def write_clickhouse(self, connection, table='pipeline_metrics', run_id=''):
+        """
+        Записываю текущие значения метрик в ClickHouse (см. schema.create_metrics_table)
+        """
+        clickhouse.insert_rows(table, self.rows(run_id), connection)
+
+    def reset(self):
+        with self.lock:
+            self.metrics.clear()
+
+
+# общий на процесс, как default_limiter
+default_registry = MetricsRegistry()
+counter = default_registry.counter
+gauge = default_registry.gauge
+histogram = default_registry.histogram
+timer = default_registry.timer
+
+
+@contextmanager
+def profile(name, directory=None):
+    """
+    cProfile блока текущего потока, если задан directory или PIPELINE_PROFILE.
+    Результат - <directory>/<name>-<время>.prof, смотреть через snakeviz или pstats
+    """
+    directory = directory or os.environ.get('PIPELINE_PROFILE')
+    if not directory:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(Path(directory) / f'{name}-{datetime.now():%Y%m%d-%H%M%S}.prof')
@@ -0,0 +1,92 @@
+"""
+Инкрементальная загрузка операций по счетам в ClickHouse
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+
+import pandahouse
+import pandas as pd
+from tinkoff.invest import RequestError
+from tinkoff.invest.utils import now
+
+import clickhouse
+
+logger = logging.getLogger(__name__)
+
+HISTORY_START = datetime(2015, 1, 1, tzinfo=timezone.utc)
+
+
+class OperationsStore:
+    """
+    Таблица operations (ReplacingMergeTree по id операции) с watermark по счёту:
+    sync догружает операции новее последней известной,
+    reconcile перезапрашивает последние дни ради поздних смен статуса
+    """
+
+    def __init__(self, manager, connection, table='operations'):
+        """
+        :param manager: PorfolioManager
+        :param connection: connection pandahouse
+        :param table:
+        """
+        self.manager = manager
+        self.connection = connection
+        self.table = table
+
+    def watermarks(self, accounts):
+        """
+        Дата последней сохранённой операции по каждому счёту одним запросом
+        :return: dict счёт -> datetime (UTC)
+        """
+        rows = clickhouse.read_rows(
+            f"SELECT acc, max(date) AS t FROM {self.connection['database']}.{self.table} "
+            "WHERE acc IN {accounts:Array(String)} GROUP BY acc",
+            self.connection, params={'accounts': list(accounts)})
+        return {r['acc']: clickhouse.parse_datetime(r['t']) for r in rows}
+
+    def load(self, account_id, from_, to=None):
+        """
+        Загружаю операции счёта за период и записываю их в таблицу
+        :return: количество операций
+        """
+        synced_at = now().replace(tzinfo=None, microsecond=0)
+        total = 0
+        for items in self.manager.iter_operations(account_id, from_, to):
+            if not items:
+                continue
+            df = pd.DataFrame([self.manager.operation_item_todict(o, account_id) for o in items])
+            df['date'] = pd.to_datetime(df['date'], utc=True).dt.tz_localize(None)
+            df['synced_at'] = synced_at
+            pandahouse.to_clickhouse(df, self.table, connection=self.connection, index=False)
+            total += df.shape[0]
+        return total
+
+    def sync(self, accounts):
+        """
+        Догружаю операции новее watermark; счёт без операций в бд грузится с HISTORY_START
+        :param accounts:
+        :return: dict счёт -> количество загруженных операций
+        """
+        watermarks = self.watermarks(accounts)
+        return self._load_accounts({acc: watermarks.get(acc, HISTORY_START) for acc in accounts})
+
+    def reconcile(self, accounts, days=3):
+        """
+        Перезапрашиваю операции за последние days дней: новые версии заменят старые
+        :param accounts:
+        :param days:
+        :return: dict счёт -> количество загруженных операций
+        """
+        since = now() - timedelta(days=days)
+        return self._load_accounts({acc: since for acc in accounts})
+
+    def _load_accounts(self, starts):
+        loaded = {}
+        for account_id, from_ in starts.items():
+            try:
+                loaded[account_id] = self.load(account_id, from_)
+                print(f'Счёт {account_id}: загружено {loaded[account_id]} операций с {from_:%Y-%m-%d %H:%M}')
+            except RequestError as err:
+                tracking_id = err.metadata.tracking_id if err.metadata else ""
+                logger.error("account=%s error tracking_id=%s code=%s", account_id, tracking_id, str(err.code))
+        return loaded
@@ -0,0 +1,140 @@
+"""
+Клиентское ограничение частоты запросов к Tinkoff Invest API
+https://tinkoff.github.io/investAPI/limits/
+"""
+import logging
+import random
+import threading
+import time
+
+from grpc import StatusCode
+from tinkoff.invest import RequestError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# лимиты unary-запросов в минуту на сервис
+DEFAULT_LIMITS = {
+    'market_data': 600,
+    'instruments': 200,
+    'operations': 200,
+    'users': 100,
+}
+
+RETRY_CODES = {
+    StatusCode.RESOURCE_EXHAUSTED,
+    StatusCode.UNAVAILABLE,
+    StatusCode.DEADLINE_EXCEEDED,
+    StatusCode.INTERNAL,
+}
+
+
+class TokenBucket:
+    """
+    Token bucket: rate_per_minute токенов в минуту, не больше capacity в запасе.
+    Потокобезопасный
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, moment):
+        self.tokens = min(self.capacity, self.tokens + (moment - self.updated) * self.rate)
+        self.updated = moment
+
+    def acquire(self):
+        """
+        Жду свободный токен
+        :return: сколько секунд пришлось ждать
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                moment = time.monotonic()
+                self._refill(moment)
+                wait = self.blocked_until - moment
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def update_from_metadata(self, metadata):
+        """
+        Подстраиваюсь под ratelimit-заголовки ответа сервера
+        :param metadata: RequestError.metadata
+        :return:
+        """
+        remaining = getattr(metadata, 'ratelimit_remaining', None)
+        reset = getattr(metadata, 'ratelimit_reset', None)
+        with self.lock:
+            moment = time.monotonic()
+            self._refill(moment)
+            if remaining is not None:
+                self.tokens = min(self.tokens, float(remaining))
+            if reset and not remaining:
+                # квота исчерпана: до сброса окна запросы не отправляем
+                self.blocked_until = max(self.blocked_until, moment + int(reset))
+
+
+class RateLimiter:
+    """
+    Набор TokenBucket по сервисам API с повтором запросов
+    (экспоненциальная задержка с jitter)
+    """
+
+    def __init__(self, limits=None, retries=5, base_delay=1.0, max_delay=60.0):
+        limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.buckets = {service: TokenBucket(rate) for service, rate in limits.items()}
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def acquire(self, service):
+        return self.buckets[service].acquire()
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, service, func, *args, **kwargs):
+        """
+        Вызываю метод API с учётом лимита сервиса.
+        Повторяю при исчерпании квоты и временных ошибках
+        :param service: ключ из DEFAULT_LIMITS
+        :param func: метод клиента, например client.market_data.get_candles
+        :return: ответ func
+        """
+        bucket = self.buckets[service]
+        for attempt in range(self.retries + 1):
+            metrics.counter('ratelimit_wait_seconds_total', 'Client-side rate limit waits',
+                            service=service).inc(bucket.acquire())
+            metrics.counter('api_requests_total', 'Tinkoff API requests', service=service).inc()
+            try:
+                with metrics.timer('api_request_seconds', 'Tinkoff API request latency', service=service):
+                    return func(*args, **kwargs)
+            except RequestError as err:
+                if err.metadata:
+                    bucket.update_from_metadata(err.metadata)
+                if attempt == self.retries or err.code not in RETRY_CODES:
+                    metrics.counter('api_errors_total', 'Failed Tinkoff API requests',
+                                    service=service, code=err.code.name).inc()
+                    raise
+                metrics.counter('api_retries_total', 'Retried Tinkoff API requests',
+                                service=service, code=err.code.name).inc()
+                delay = self.backoff(attempt)
+                tracking_id = err.metadata.tracking_id if err.metadata else ""
+                logger.warning("Retry %s/%s in %.1fs tracking_id=%s code=%s",
+                               attempt + 1, self.retries, delay, tracking_id, str(err.code))
+                time.sleep(delay)
+
+
+# общий на процесс: квоты считаются на токен, а не на объект клиента
+default_limiter = RateLimiter()
@@ -0,0 +1,390 @@
+"""
+Схема таблиц ClickHouse и миграции.
+DDL здесь - источник правды, table.txt повторяет его для ручного запуска
+"""
+import logging
+from datetime import timedelta
+
+import clickhouse
+
+logger = logging.getLogger(__name__)
+
+CANDLES_DDL = '''
+CREATE TABLE IF NOT EXISTS {database}.{table}
+(
+    figi LowCardinality(String),
+    time DateTime CODEC(DoubleDelta, LZ4),
+    volume Int64 CODEC(T64, LZ4),
+    open Float64 CODEC(Gorilla, LZ4),
+    close Float64 CODEC(Gorilla, LZ4),
+    high Float64 CODEC(Gorilla, LZ4),
+    low Float64 CODEC(Gorilla, LZ4)
+
+) ENGINE = ReplacingMergeTree() ORDER BY (figi, time) PARTITION BY toYYYYMM(time)
+'''
+
+COVERAGE_DDL = '''
+CREATE TABLE IF NOT EXISTS {database}.{table}
+(
+    figi LowCardinality(String),
+    interval LowCardinality(String),
+    time_from Array(DateTime),
+    time_to Array(DateTime),
+    loaded_at DateTime64(3) DEFAULT now64(3)
+
+) ENGINE = ReplacingMergeTree(loaded_at) ORDER BY (figi, interval)
+'''
+
+SNAPSHOTS_DDL = '''
+CREATE TABLE IF NOT EXISTS {database}.{table}
+(
+    snapshot_time DateTime,
+    account_id LowCardinality(String),
+    kind LowCardinality(String),
+    figi String,
+    instrument_type LowCardinality(String),
+    currency LowCardinality(String),
+    quantity Float64,
+    average_buy_price Float64,
+    current_price Float64,
+    expected_yield Float64,
+    current_nkd Float64,
+    sell_sum Float64,
+    comission Float64
+
+) ENGINE = MergeTree() ORDER BY (account_id, snapshot_time) PARTITION BY toYYYYMM(snapshot_time)
+'''
+
+OPERATIONS_DDL = '''
+CREATE TABLE IF NOT EXISTS {database}.{table}
+(
+    id String,
+    acc LowCardinality(String),
+    date DateTime,
+    type String,
+    otype Int64,
+    currency LowCardinality(String),
+    instrument_type LowCardinality(String),
+    figi String,
+    quantity Int64,
+    state Int64,
+    payment Float64,
+    price Float64,
+    synced_at DateTime
+
+) ENGINE = ReplacingMergeTree(synced_at) ORDER BY (acc, id) PARTITION BY toYYYYMM(date)
+'''
+
+LAST_PRICES_DDL = '''
+CREATE TABLE IF NOT EXISTS {database}.{table}
+(
+    figi LowCardinality(String),
+    time DateTime64(3) CODEC(DoubleDelta, LZ4),
+    price Float64 CODEC(Gorilla, LZ4)
+
+) ENGINE = ReplacingMergeTree() ORDER BY (figi, time) PARTITION BY toYYYYMM(time)
+'''
+
+METRICS_DDL = '''
+CREATE TABLE IF NOT EXISTS {database}.{table}
+(
+    ts DateTime,
+    run_id String,
+    name LowCardinality(String),
+    labels Map(LowCardinality(String), String),
+    value Float64,
+    count UInt64
+
+) ENGINE = MergeTree() ORDER BY (name, ts) PARTITION BY toYYYYMM(ts)
+'''
+
+ROLLUP_DDL = '''
+CREATE TABLE IF NOT EXISTS {database}.{table}
+(
+    figi LowCardinality(String),
+    time DateTime CODEC(DoubleDelta, LZ4),
+    open AggregateFunction(argMin, Float64, DateTime),
+    close AggregateFunction(argMax, Float64, DateTime),
+    high SimpleAggregateFunction(max, Float64),
+    low SimpleAggregateFunction(min, Float64),
+    volume SimpleAggregateFunction(sum, Int64)
+
+) ENGINE = AggregatingMergeTree() ORDER BY (figi, time) PARTITION BY {partition}
+'''
+
+# в подзапросе колонки переименованы: иначе алиасы open/time в SELECT
+# перекрыли бы исходные колонки внутри агрегатных функций
+ROLLUP_SELECT = '''
+SELECT figi, toStartOfInterval(t, INTERVAL {seconds} SECOND) AS time,
+       argMinState(o, t) AS open, argMaxState(c, t) AS close,
+       max(h) AS high, min(l) AS low, sum(v) AS volume
+FROM (SELECT figi, time AS t, open AS o, close AS c, high AS h, low AS l, volume AS v FROM {database}.{source} {where})
+GROUP BY figi, time
+'''
+
+# таблица минутных свечей, по которой строятся агрегаты
+ROLLUP_SOURCE = 'candles'
+
+# таблица агрегатов -> (длина свечи, партиционирование);
+# месячные партиции, чтобы rebuild_rollups пересобирал только последние месяцы
+ROLLUPS = {
+    'candles_5m': (timedelta(minutes=5), 'toYYYYMM(time)'),
+    'candles_1h': (timedelta(hours=1), 'toYYYYMM(time)'),
+    'candles_1d': (timedelta(days=1), 'toYYYYMM(time)'),
+}
+
+
+def create_candles_table(connection, table='candles'):
+    """
+    Создаю таблицу свечей: сортировка (figi, time), месячные партиции,
+    ReplacingMergeTree схлопывает повторно загруженные свечи.
+    Для ROLLUP_SOURCE создаются и агрегаты: CandleStore читает из них свечи от 5 минут.
+    Если агрегатов ещё не было, они собираются по уже загруженным свечам
+    :param connection: connection pandahouse
+    :param table:
+    :return:
+    """
+    clickhouse.execute(CANDLES_DDL.format(database=connection['database'], table=table), connection)
+    if table == ROLLUP_SOURCE:
+        missing = any(table_engine(connection, rollup) is None for rollup in ROLLUPS)
+        create_rollups(connection, table, populate=missing)
+
+
+def column_type(connection, table, column):
+    """
+    Тип колонки по system.columns или None, если таблицы или колонки нет
+    """
+    rows = clickhouse.read_rows(
+        'SELECT type FROM system.columns '
+        'WHERE database = {database:String} AND table = {table:String} AND name = {column:String}',
+        connection, params={'database': connection['database'], 'table': table, 'column': column})
+    return rows[0]['type'] if rows else None
+
+
+def create_coverage_table(connection, table='candles_coverage'):
+    """
+    Создаю индекс загруженных интервалов [time_from, time_to) по figi и интервалу свечей:
+    одна строка на (figi, interval), последняя версия по loaded_at.
+    Таблица старого вида (строка на интервал) переводится migrate_coverage_table
+    :param connection: connection pandahouse
+    :param table:
+    :return:
+    """
+    clickhouse.execute(COVERAGE_DDL.format(database=connection['database'], table=table), connection)
+    if column_type(connection, table, 'time_from') == 'DateTime':
+        migrate_coverage_table(connection, table)
+
+
+def migrate_coverage_table(connection, table='candles_coverage', drop_old=False):
+    """
+    Перевожу индекс покрытия со строки на интервал на строку на (figi, interval).
+    Интервалы переносятся как есть, CoverageIndex.load объединит и перепишет их при первом чтении
+    :param connection: connection pandahouse
+    :param table:
+    :param drop_old: удалить {table}_old после переноса
+    :return:
+    """
+    database = connection['database']
+    new_table = f'{table}_new'
+    clickhouse.execute(COVERAGE_DDL.format(database=database, table=new_table), connection)
+    clickhouse.execute(
+        f'INSERT INTO {database}.{new_table} (figi, interval, time_from, time_to) '
+        'SELECT figi, interval, arrayMap(x -> x.1, pairs), arrayMap(x -> x.2, pairs) '
+        'FROM (SELECT figi, interval, groupArray((time_from, time_to)) AS pairs '
+        f'FROM {database}.{table} FINAL GROUP BY figi, interval)', connection)
+    clickhouse.execute(
+        f'RENAME TABLE {database}.{table} TO {database}.{table}_old, {database}.{new_table} TO {database}.{table}',
+        connection)
+    if drop_old:
+        clickhouse.execute(f'DROP TABLE {database}.{table}_old', connection)
+    print(f'Индекс покрытия {database}.{table} переведён на строку на figi')
+
+
+def create_snapshots_table(connection, table='portfolio_snapshots'):
+    """
+    Создаю таблицу снимков портфеля (позиции и деньги по счетам)
+    :param connection: connection pandahouse
+    :param table:
+    :return:
+    """
+    clickhouse.execute(SNAPSHOTS_DDL.format(database=connection['database'], table=table), connection)
+
+
+def create_operations_table(connection, table='operations'):
+    """
+    Создаю таблицу операций: одна строка на id операции, последняя версия по synced_at
+    :param connection: connection pandahouse
+    :param table:
+    :return:
+    """
+    clickhouse.execute(OPERATIONS_DDL.format(database=connection['database'], table=table), connection)
+
+
+def create_last_prices_table(connection, table='last_prices'):
+    """
+    Создаю таблицу последних цен из стрима
+    :param connection: connection pandahouse
+    :param table:
+    :return:
+    """
+    clickhouse.execute(LAST_PRICES_DDL.format(database=connection['database'], table=table), connection)
+
+
+def create_metrics_table(connection, table='pipeline_metrics'):
+    """
+    Создаю таблицу метрик загрузки (metrics.MetricsRegistry.write_clickhouse)
+    :param connection: connection pandahouse
+    :param table:
+    :return:
+    """
+    clickhouse.execute(METRICS_DDL.format(database=connection['database'], table=table), connection)
+
+
+def create_rollups(connection, source=ROLLUP_SOURCE, populate=False):
+    """
+    Создаю агрегаты свечей 5m/1h/1d (AggregatingMergeTree) и materialized view,
+    которые наполняют их при каждой вставке в source.
+    Объём суммируется на вставке, поэтому повторная вставка уже загруженной свечи
+    (ReplacingMergeTree в source её схлопнет) удваивает объём в агрегате,
+    пока rebuild_rollups не пересоберёт партицию
+    :param connection: connection pandahouse
+    :param source: таблица минутных свечей
+    :param populate: собрать агрегаты по уже загруженным свечам (rebuild_rollups)
+    :return:
+    """
+    database = connection['database']
+    for table, (step, partition) in ROLLUPS.items():
+        clickhouse.execute(ROLLUP_DDL.format(database=database, table=table, partition=partition), connection)
+        select = ROLLUP_SELECT.format(database=database, source=source, seconds=int(step.total_seconds()), where='')
+        clickhouse.execute(
+            f'CREATE MATERIALIZED VIEW IF NOT EXISTS {database}.{table}_mv TO {database}.{table} AS {select}',
+            connection)
+    if populate:
+        rebuild_rollups(connection, source)
+
+
+def rebuild_rollups(connection, source=ROLLUP_SOURCE, since=None):
+    """
+    Пересобираю из {source} FINAL партиции агрегатов, в которые попадают свечи новее since:
+    так объём, удвоенный повторной вставкой свечи (сбой между вставкой свечей и индекса покрытия,
+    пересечение задач синхронизации, migrate_candles_table), возвращается к схлопнутым свечам.
+    Партиция собирается в {table}_rebuild и подменяется через REPLACE PARTITION;
+    свечи, вставленные в source во время пересборки, попадут в агрегат при следующей.
+    Агрегаты, которых нет, пропускаются
+    :param connection: connection pandahouse
+    :param source: таблица минутных свечей
+    :param since: datetime; None - все партиции
+    :return:
+    """
+    database = connection['database']
+    where = '' if since is None else 'WHERE time >= {since:DateTime}'
+    for table, (step, _) in ROLLUPS.items():
+        # партиционирование из system.tables: агрегаты, созданные раньше, могли быть с другим
+        partition = table_partition_key(connection, table)
+        if partition is None:
+            continue
+        partitions = clickhouse.read_rows(
+            f'SELECT DISTINCT {partition} AS p FROM {database}.{source} {where}',
+            connection, params=None if since is None else {'since': since})
+        clickhouse.execute(f'CREATE TABLE IF NOT EXISTS {database}.{table}_rebuild AS {database}.{table}',
+                           connection)
+        for r in partitions:
+            clickhouse.execute(f'TRUNCATE TABLE {database}.{table}_rebuild', connection)
+            select = ROLLUP_SELECT.format(database=database, source=f'{source} FINAL',
+                                          seconds=int(step.total_seconds()), where=f'WHERE {partition} = {r["p"]}')
+            clickhouse.execute(f'INSERT INTO {database}.{table}_rebuild {select}', connection)
+            clickhouse.execute(
+                f'ALTER TABLE {database}.{table} REPLACE PARTITION {r["p"]} FROM {database}.{table}_rebuild',
+                connection)
+        clickhouse.execute(f'TRUNCATE TABLE {database}.{table}_rebuild', connection)
+        print(f'Агрегат {table}: пересобрано партиций {len(partitions)}')
+
+
+def migrate_candles_table(connection, table='candles', drop_old=False):
+    """
+    Перевожу старую таблицу свечей (ORDER BY map PARTITION BY figi) на CANDLES_DDL.
+    Данные копируются по одному figi,
+    затем таблицы меняются местами, старая остаётся как {table}_old
+    :param connection: connection pandahouse
+    :param table:
+    :param drop_old: удалить {table}_old после переноса
+    :return:
+    """
+    database = connection['database']
+    new_table = f'{table}_new'
+    create_candles_table(connection, new_table)
+
+    # старая таблица партиционирована по figi: копирование по figi читает ровно одну партицию
+    figi_list = clickhouse.read_rows(f'SELECT DISTINCT figi FROM {database}.{table}', connection)
+    print(f'Переношу свечи {len(figi_list)} инструментов из {database}.{table}')
+    for r in figi_list:
+        clickhouse.execute(
+            f'INSERT INTO {database}.{new_table} SELECT figi, time, volume, open, close, high, low '
+            f'FROM {database}.{table} WHERE figi = {{figi:String}}',
+            connection, params={'figi': r['figi']})
+
+    clickhouse.execute(
+        f'RENAME TABLE {database}.{table} TO {database}.{table}_old, {database}.{new_table} TO {database}.{table}',
+        connection)
+    if drop_old:
+        clickhouse.execute(f'DROP TABLE {database}.{table}_old', connection)
+    if table == ROLLUP_SOURCE:
+        # агрегаты пересобираю по перенесённым свечам, а не по тому, что записали materialized view
+        rebuild_rollups(connection, table)
+    print('Миграция завершена')
+
+
+def migrate_instruments_table(connection, table='instruments', drop_old=False):
+    """
+    Перевожу справочник инструментов на ReplacingMergeTree,
+    чтобы повторная вставка изменившегося инструмента заменяла старую версию
+    :param connection: connection pandahouse
+    :param table:
+    :param drop_old: удалить {table}_old после переноса
+    :return:
+    """
+    database = connection['database']
+    new_table = f'{table}_new'
+    clickhouse.execute(
+        f'CREATE TABLE IF NOT EXISTS {database}.{new_table} AS {database}.{table} '
+        'ENGINE = ReplacingMergeTree() ORDER BY figi PARTITION BY instrument_type', connection)
+    clickhouse.execute(f'INSERT INTO {database}.{new_table} SELECT * FROM {database}.{table}', connection)
+    clickhouse.execute(
+        f'RENAME TABLE {database}.{table} TO {database}.{table}_old, {database}.{new_table} TO {database}.{table}',
+        connection)
+    if drop_old:
+        clickhouse.execute(f'DROP TABLE {database}.{table}_old', connection)
+    print('Миграция завершена')
+
+
+def _table_property(connection, table, column):
+    rows = clickhouse.read_rows(
+        f'SELECT {column} FROM system.tables WHERE database = {{database:String}} AND name = {{table:String}}',
+        connection, params={'database': connection['database'], 'table': table})
+    return rows[0][column] if rows else None
+
+
+def table_engine(connection, table):
+    """
+    Движок таблицы по system.tables или None, если таблицы нет
+    """
+    return _table_property(connection, table, 'engine')
+
+
+def table_partition_key(connection, table):
+    """
+    Выражение партиционирования таблицы по system.tables или None, если таблицы нет
+    """
+    return _table_property(connection, table, 'partition_key')
+
+
+def upgrade_instruments_table(connection, table='instruments'):
+    """
+    Перевожу справочник на ReplacingMergeTree, если он ещё MergeTree:
+    иначе вставка изменившихся инструментов из InstrumentCache дублирует строки
+    :param connection: connection pandahouse
+    :param table:
+    :return:
+    """
+    if table_engine(connection, table) == 'MergeTree':
+        migrate_instruments_table(connection, table)
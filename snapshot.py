@@ -0,0 +1,141 @@
+"""
+Снимок портфеля по всем доступным счетам:
+позиции, деньги и (по запросу) операции запрашиваются параллельно по всем счетам.
+Регулярная загрузка операций в бд - OperationsStore
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from functools import partial
+from time import perf_counter
+
+import pandahouse
+import pandas as pd
+from tinkoff.invest import RequestError
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_COLUMNS = {
+    'snapshot_time': None,
+    'account_id': '',
+    'kind': '',
+    'figi': '',
+    'instrument_type': '',
+    'currency': '',
+    'quantity': 0.0,
+    'average_buy_price': 0.0,
+    'current_price': 0.0,
+    'expected_yield': 0.0,
+    'current_nkd': 0.0,
+    'sell_sum': 0.0,
+    'comission': 0.0,
+}
+
+
+class PortfolioSnapshot:
+    """
+    Результат take_snapshot: DataFrame с колонкой account_id по каждому виду данных
+    и время каждого вызова API
+    """
+
+    def __init__(self, taken_at, positions, money, operations, timings, failed):
+        self.taken_at = taken_at
+        self.positions = positions
+        self.money = money
+        self.operations = operations
+        self.timings = timings
+        self.failed = failed
+
+    def consolidated_positions(self) -> pd.DataFrame:
+        """
+        Позиции, сложенные по всем счетам
+        """
+        if self.positions.empty:
+            return self.positions
+        return self.positions.groupby(['figi', 'instrument_type', 'currency'], as_index=False).agg(
+            quantity=('quantity', 'sum'),
+            expected_yield=('expected_yield', 'sum'),
+            sell_sum=('sell_sum', 'sum'),
+            comission=('comission', 'sum'),
+            accounts=('account_id', 'nunique'),
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Позиции и деньги одной таблицей в формате portfolio_snapshots
+        """
+        positions = self.positions.assign(kind='position')
+        money = self.money.assign(kind='money')
+        df = pd.concat([positions, money], ignore_index=True)
+        df['snapshot_time'] = self.taken_at.replace(tzinfo=None)
+        for column, default in SNAPSHOT_COLUMNS.items():
+            if column not in df:
+                df[column] = default
+            elif default is not None:
+                df[column] = df[column].fillna(default)
+        return df[list(SNAPSHOT_COLUMNS)]
+
+
+def _timed(func, account_id):
+    started = perf_counter()
+    df = func(account_id)
+    return df, perf_counter() - started
+
+
+def take_snapshot(manager, accounts=None, max_workers=8, operations_from=None) -> PortfolioSnapshot:
+    """
+    :param manager: PorfolioManager
+    :param accounts: список счетов, по умолчанию все доступные токену
+    :param max_workers: количество параллельных запросов
+    :param operations_from: начало периода операций в снимке; None - без операций
+    :return: PortfolioSnapshot
+    """
+    taken_at = datetime.now(timezone.utc)
+    if accounts is None:
+        accounts = manager.get_accounts()
+    calls = {'positions': manager.get_portfolio_df, 'money': manager.get_money_df}
+    if operations_from is not None:
+        calls['operations'] = partial(manager.get_operations_df, from_=operations_from)
+
+    frames = {name: [] for name in ('positions', 'money', 'operations')}
+    timings = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_timed, func, account_id): (account_id, name)
+            for account_id in accounts
+            for name, func in calls.items()
+        }
+        for future in as_completed(futures):
+            account_id, name = futures[future]
+            try:
+                df, seconds = future.result()
+            except RequestError as err:
+                tracking_id = err.metadata.tracking_id if err.metadata else ""
+                logger.error("account=%s %s error tracking_id=%s code=%s",
+                             account_id, name, tracking_id, str(err.code))
+                failed.append((account_id, name))
+                continue
+            timings.append({'account_id': account_id, 'call': name, 'seconds': seconds})
+            if df is not None:
+                frames[name].append(df.assign(account_id=account_id))
+
+    merged = {name: pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=['account_id'])
+              for name, dfs in frames.items()}
+    return PortfolioSnapshot(taken_at, merged['positions'], merged['money'], merged['operations'],
+                             pd.DataFrame(timings, columns=['account_id', 'call', 'seconds']), failed)
+
+
+def write_snapshot(snapshot: PortfolioSnapshot, connection, table='portfolio_snapshots'):
+    """
+    Записываю позиции и деньги всех счетов одной вставкой.
+    Операции снимка не пишутся: в таблицу operations их загружает OperationsStore
+    :param snapshot:
+    :param connection: connection pandahouse
+    :param table:
+    :return:
+    """
+    df = snapshot.to_frame()
+    if not df.empty:
+        pandahouse.to_clickhouse(df, table, connection=connection, index=False)
+    print(f'Записан снимок {snapshot.taken_at:%Y-%m-%d %H:%M:%S}: {df.shape[0]} строк')
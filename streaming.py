@@ -0,0 +1,211 @@
+"""
+Загрузка минутных свечей и последних цен из стрима market data в ClickHouse
+"""
+import logging
+import random
+import threading
+import time
+from datetime import timedelta, timezone
+from queue import Queue, Empty
+
+from tinkoff.invest import (
+    CandleInstrument, LastPriceInstrument, SubscriptionInterval, CandleInterval)
+from tinkoff.invest.utils import now
+
+import clickhouse
+from candles import CandleColumns, CandleWriter
+from candles_coverage import CoverageIndex
+
+logger = logging.getLogger(__name__)
+
+
+class StreamIngestor:
+    """
+    Читает MarketDataStream в одном потоке и пишет в ClickHouse в другом.
+    Очередь между ними ограничена: если бд не успевает, чтение стрима
+    приостанавливается (backpressure).
+    Минутная свеча пишется, только когда закрылась (пришла свеча следующей минуты),
+    поэтому в таблицу не попадают промежуточные версии свечи.
+    Индекс покрытия обновляется не на каждой вставке, а раз в coverage_interval.
+    При обрыве стрим переподключается с экспоненциальной задержкой,
+    пропущенный период догружается из истории через update_candles_table
+    """
+
+    def __init__(self, parser, figi_list, connection, candles_table='candles', prices_table='last_prices',
+                 coverage_table='candles_coverage', stream_factory=None, flush_rows=10_000, max_latency=5.0,
+                 coverage_interval=60.0, queue_size=10_000, reconnect_delay=1.0, max_reconnect_delay=60.0):
+        """
+        :param parser: InformationParser, через него догружается история
+        :param figi_list:
+        :param connection: connection pandahouse
+        :param candles_table:
+        :param prices_table: таблица последних цен, None - не подписываться на цены
+        :param coverage_table: индекс загруженных интервалов свечей
+        :param stream_factory: функция без аргументов, возвращающая MarketDataStreamManager
+            или совместимый объект (например, локальный fake); по умолчанию client.create_market_data_stream
+        :param flush_rows: размер пачки вставки
+        :param max_latency: максимальная задержка записи, секунды
+        :param coverage_interval: как часто записанные свечи отмечаются в индексе покрытия, секунды
+        :param queue_size: сколько событий может ждать записи
+        :param reconnect_delay: первая задержка переподключения, секунды
+        :param max_reconnect_delay:
+        """
+        self.parser = parser
+        self.figi_list = list(figi_list)
+        self.connection = connection
+        self.candles_table = candles_table
+        self.prices_table = prices_table
+        self.stream_factory = stream_factory or parser.client.create_market_data_stream
+        self.flush_rows = flush_rows
+        self.max_latency = max_latency
+        self.coverage_interval = coverage_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.coverage = CoverageIndex(connection, CandleInterval.CANDLE_INTERVAL_1_MIN, table=coverage_table)
+        self.events = Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.listeners = []
+        self._stream = None
+        self._open_candles = {}  # figi -> последняя версия незакрытой свечи
+
+    def add_listener(self, callback):
+        """
+        callback(candle) вызывается для каждой закрытой свечи в потоке записи
+        """
+        self.listeners.append(callback)
+
+    def stop(self):
+        self.stop_event.set()
+        if self._stream is not None:
+            self._stream.stop()
+
+    def run(self):
+        """
+        Работаю до stop(): поток записи + чтение стрима с переподключением
+        """
+        writer = threading.Thread(target=self._write_loop, name='stream-writer', daemon=True)
+        writer.start()
+        delay = self.reconnect_delay
+        disconnected_at = None
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self._connect()
+                    if disconnected_at is not None:
+                        self._gap_fill(disconnected_at)
+                        disconnected_at = None
+                    for event in self._stream:
+                        if self.stop_event.is_set():
+                            break
+                        delay = self.reconnect_delay
+                        self._on_event(event)
+                except Exception as err:
+                    if self.stop_event.is_set():
+                        break
+                    logger.error("Market data stream failed: %r, reconnect in %.1fs", err, delay)
+                else:
+                    if self.stop_event.is_set():
+                        break
+                    logger.warning("Market data stream closed, reconnect in %.1fs", delay)
+                if disconnected_at is None:
+                    disconnected_at = now()
+                self._open_candles.clear()
+                self.stop_event.wait(random.uniform(delay / 2, delay))
+                delay = min(delay * 2, self.max_reconnect_delay)
+        finally:
+            self.stop_event.set()
+            writer.join()
+
+    def _connect(self):
+        self._stream = self.stream_factory()
+        self._stream.candles.subscribe([
+            CandleInstrument(figi=figi, interval=SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE)
+            for figi in self.figi_list
+        ])
+        if self.prices_table:
+            self._stream.last_price.subscribe([LastPriceInstrument(figi=figi) for figi in self.figi_list])
+
+    def _gap_fill(self, disconnected_at):
+        """
+        Догружаю свечи за время обрыва из истории в отдельном потоке, чтобы не задерживать стрим
+        """
+        depth = now() - disconnected_at + timedelta(minutes=5)
+        threading.Thread(
+            target=self.parser.update_candles_table, name='stream-gap-fill', daemon=True,
+            args=(self.figi_list, self.candles_table, self.connection),
+            kwargs={'depth': depth, 'coverage_table': self.coverage.table},
+        ).start()
+
+    def _on_event(self, event):
+        candle = getattr(event, 'candle', None)
+        if candle is not None:
+            opened = self._open_candles.get(candle.figi)
+            if opened is not None and candle.time > opened.time:
+                # пришла свеча следующей минуты: предыдущая окончательная,
+                # минуты между ними без сделок тоже покрыты
+                self.events.put(('candle', opened, (opened.time, candle.time)))
+            self._open_candles[candle.figi] = candle
+        last_price = getattr(event, 'last_price', None)
+        if last_price is not None and self.prices_table:
+            self.events.put(('price', last_price, None))
+
+    def _write_loop(self):
+        candles = {}
+        windows = []
+        prices = []
+        covered = []  # окна записанных свечей, ещё не отмеченные в индексе покрытия
+        rows = 0
+        first_at = None
+        covered_at = time.monotonic()
+        with CandleWriter(self.candles_table, self.connection, flush_rows=float('inf')) as writer:
+            while True:
+                stopping = self.stop_event.is_set() and self.events.empty()
+                item = None
+                if not stopping:
+                    try:
+                        kind, item, window = self.events.get(timeout=0.5)
+                    except Empty:
+                        pass
+                if item is not None:
+                    if first_at is None:
+                        first_at = time.monotonic()
+                    rows += 1
+                    if kind == 'candle':
+                        candles.setdefault(item.figi, CandleColumns(item.figi)).append(item)
+                        windows.append((item.figi, *window))
+                        for callback in self.listeners:
+                            callback(item)
+                    else:
+                        prices.append(item)
+                if rows and (rows >= self.flush_rows or time.monotonic() - first_at >= self.max_latency
+                             or self.stop_event.is_set()):
+                    try:
+                        for columns in candles.values():
+                            writer.write(columns)
+                        writer.flush()
+                        covered.extend(windows)
+                        self._write_prices(prices)
+                    except Exception:
+                        # свечи не отмечены в индексе покрытия и будут догружены из истории как пропуск
+                        writer.clear()
+                        logger.exception("Stream batch insert failed, %s events dropped", rows)
+                    candles, windows, prices, rows, first_at = {}, [], [], 0, None
+                if covered and (stopping or time.monotonic() - covered_at >= self.coverage_interval):
+                    try:
+                        self.coverage.add(covered)
+                        covered = []
+                    except Exception:
+                        logger.exception("Stream coverage update failed, retry in %.0fs", self.coverage_interval)
+                    covered_at = time.monotonic()
+                if stopping:
+                    break
+
+    def _write_prices(self, prices):
+        clickhouse.insert_rows(self.prices_table, [
+            {
+                'figi': p.figi,
+                'time': p.time.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+                'price': p.price.units + p.price.nano / 1e9,
+            }
+            for p in prices
+        ], self.connection)
@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+
+from candles import CandleColumns
+
+
+def q(units, nano):
+    return SimpleNamespace(units=units, nano=nano)
+
+
+def candle(minute, volume, open_, close, high, low):
+    return SimpleNamespace(time=datetime(2022, 1, 3, 7, minute, tzinfo=timezone.utc), volume=volume,
+                           open=q(*open_), close=q(*close), high=q(*high), low=q(*low))
+
+
+def test_to_row_binary_layout():
+    columns = CandleColumns('BBG000B9XRY4')
+    columns.extend([
+        candle(0, 10, (100, 500_000_000), (101, 0), (102, 250_000_000), (99, 0)),
+        candle(1, 7, (101, 0), (100, 0), (101, 0), (-1, -500_000_000)),
+    ])
+    data = columns.to_row_binary()
+
+    row = np.dtype([('length', 'u1'), ('figi', 'S12'), ('time', '<u4'), ('volume', '<i8'),
+                    ('open', '<f8'), ('close', '<f8'), ('high', '<f8'), ('low', '<f8')])
+    assert len(data) == 2 * row.itemsize
+    rows = np.frombuffer(data, dtype=row)
+    assert list(rows['length']) == [12, 12]
+    assert list(rows['figi']) == [b'BBG000B9XRY4'] * 2
+    assert list(rows['time']) == [1641193200, 1641193260]
+    assert list(rows['volume']) == [10, 7]
+    assert list(rows['open']) == [100.5, 101.0]
+    assert list(rows['high']) == [102.25, 101.0]
+    assert list(rows['low']) == [99.0, -1.5]
+
+
+def test_to_row_binary_empty():
+    assert CandleColumns('FIGI').to_row_binary() == b''
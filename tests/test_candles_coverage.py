@@ -0,0 +1,58 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from tinkoff.invest import CandleInterval
+
+from benchmarks.local_clickhouse import LocalClickHouse
+from candles_coverage import CoverageIndex, merge_intervals
+
+T0 = datetime(2022, 1, 3, 7, tzinfo=timezone.utc)
+
+
+def t(minutes):
+    return T0 + timedelta(minutes=minutes)
+
+
+def test_merge_intervals_joins_overlapping_and_adjacent():
+    assert merge_intervals([(t(5), t(7)), (t(0), t(2)), (t(2), t(3)), (t(6), t(9))]) == \
+        [(t(0), t(3)), (t(5), t(9))]
+
+
+def test_merge_intervals_keeps_nested_and_disjoint():
+    assert merge_intervals([(t(0), t(10)), (t(2), t(4)), (t(11), t(12))]) == [(t(0), t(10)), (t(11), t(12))]
+    assert merge_intervals([]) == []
+
+
+def index(intervals=None, session=None):
+    connection = {'host': 'http://localhost:8123', 'database': 'tinkoff', 'session': session or LocalClickHouse()}
+    coverage = CoverageIndex(connection, CandleInterval.CANDLE_INTERVAL_1_MIN)
+    coverage.intervals = intervals or {}
+    return coverage
+
+
+def test_gaps_without_coverage_is_whole_range():
+    assert index().gaps('FIGI', t(0), t(60)) == [(t(0), t(60))]
+
+
+def test_gaps_between_and_around_covered_intervals():
+    coverage = index({'FIGI': [(t(10), t(20)), (t(30), t(40))]})
+    assert coverage.gaps('FIGI', t(0), t(60)) == [(t(0), t(10)), (t(20), t(30)), (t(40), t(60))]
+    assert coverage.gaps('FIGI', t(15), t(35)) == [(t(20), t(30))]
+    assert coverage.gaps('FIGI', t(10), t(20)) == []
+
+
+def test_add_rewrites_one_merged_row_per_figi():
+    session = LocalClickHouse(keep_data=True)
+    coverage = index({'A': [(t(0), t(10))]}, session)
+    coverage.add([('A', t(10), t(20)), ('A', t(25), t(30)), ('B', t(0), t(5))])
+    coverage.add([('A', t(20), t(25))])
+
+    assert coverage.intervals == {'A': [(t(0), t(30))], 'B': [(t(0), t(5))]}
+    first, second = session.data['tinkoff.candles_coverage']
+    rows = {r['figi']: r for r in map(json.loads, first.splitlines())}
+    assert rows['A']['time_from'] == ['2022-01-03 07:00:00', '2022-01-03 07:25:00']
+    assert rows['A']['time_to'] == ['2022-01-03 07:20:00', '2022-01-03 07:30:00']
+    assert [json.loads(line) for line in second.splitlines()] == [{
+        'figi': 'A', 'interval': 'CANDLE_INTERVAL_1_MIN',
+        'time_from': ['2022-01-03 07:00:00'], 'time_to': ['2022-01-03 07:30:00'],
+    }]
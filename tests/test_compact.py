@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from compact import CompactCandles
+
+TICKS = {'A': 0.01, 'B': 0.5, 'C': 1.0}
+
+
+def candles(rows=3000, volume=None):
+    rnd = np.random.default_rng(0)
+    figi = np.repeat(list(TICKS), rows // len(TICKS))
+    tick = np.array([TICKS[f] for f in figi])
+    prices = {c: np.round(rnd.integers(100, 10_000, len(figi)) * tick, 2) for c in ('open', 'close', 'high', 'low')}
+    return pd.DataFrame({
+        'figi': pd.Categorical(figi),
+        'time': np.tile(pd.date_range('2022-01-03 07:00', periods=rows // len(TICKS), freq='min')
+                        .to_numpy().astype('datetime64[ns]'),
+                        len(TICKS)),
+        'volume': rnd.integers(0, 10_000, len(figi)) if volume is None else volume,
+        **prices,
+    })
+
+
+def test_round_trip_and_select():
+    df = candles()
+    compact = CompactCandles.from_frame(df, TICKS)
+    pd.testing.assert_frame_equal(compact.to_frame()[list(df.columns)], df, check_categorical=False)
+
+    part = compact.select('B', pd.Timestamp('2022-01-03 07:10'), pd.Timestamp('2022-01-03 07:20'))
+    assert len(part) == 10
+    assert np.shares_memory(part.time, compact.arrays['time'])
+
+
+def test_bytes_per_row_against_candle_store_frame():
+    df = candles()
+    compact = CompactCandles.from_frame(df, TICKS)
+    frame = compact.to_frame()
+    assert compact.nbytes == 24 * len(df) + 8 * (len(TICKS) + 1)
+    ratio = frame.memory_usage(index=False, deep=True).sum() / compact.nbytes
+    assert 2.0 < ratio < 2.1
+
+
+def test_volume_out_of_uint32_range_is_rejected():
+    df = candles(volume=np.full(3000, 2 ** 32, dtype=np.int64))
+    with pytest.raises(ValueError, match='volume'):
+        CompactCandles.from_frame(df, TICKS)
+
+
+def test_off_tick_price_is_rejected():
+    df = candles()
+    # шаг B сменился с 0.25 на 0.5: старая цена не кратна текущему шагу
+    df.loc[df['figi'] == 'B', 'close'] = df.loc[df['figi'] == 'B', 'close'].to_numpy() + np.r_[0.25, np.zeros(999)]
+    with pytest.raises(ValueError, match=r"close .*\['B'\]"):
+        CompactCandles.from_frame(df, TICKS)
+    pd.testing.assert_series_equal(CompactCandles.from_frame(df).to_frame()['close'],
+                                   df['close'].astype(np.float32).astype(np.float64), check_names=False)
@@ -0,0 +1,63 @@
+import threading
+import time
+from datetime import timedelta
+
+from daemon import Job, Scheduler
+
+
+def noop():
+    pass
+
+
+def test_due_orders_by_priority_and_respects_slots(tmp_path):
+    scheduler = Scheduler(tmp_path / 'state.json', max_workers=3, service_slots={'market_data': 2})
+    for name, priority in [('c', 5), ('a', 1), ('b', 2), ('d', 9)]:
+        scheduler.add(Job(name, noop, timedelta(hours=1), priority=priority, service='market_data'))
+    scheduler.add(Job('later', noop, timedelta(hours=1), priority=0))
+    scheduler.state['later']['next_run'] = time.time() + 3600
+
+    assert [job.name for job in scheduler.due(time.time())] == ['a', 'b']
+
+    scheduler.running.add('a')
+    assert [job.name for job in scheduler.due(time.time())] == ['b']
+
+
+def test_due_respects_max_workers(tmp_path):
+    scheduler = Scheduler(tmp_path / 'state.json', max_workers=2)
+    for name in 'abc':
+        scheduler.add(Job(name, noop, timedelta(hours=1)))
+    assert len(scheduler.due(time.time())) == 2
+
+
+def test_run_waits_for_free_slot_without_spinning(tmp_path):
+    release = threading.Event()
+    done = []
+
+    def work(name):
+        def func():
+            release.wait(5)
+            done.append(name)
+        return func
+
+    scheduler = Scheduler(tmp_path / 'state.json', max_workers=4, service_slots={'market_data': 2})
+    for name in 'abc':
+        scheduler.add(Job(name, work(name), timedelta(hours=1), service='market_data'))
+    loops = []
+    due = scheduler.due
+    scheduler.due = lambda moment: loops.append(moment) or due(moment)
+
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    time.sleep(0.3)
+    # третья задача ждёт слот: цикл не должен крутиться вхолостую
+    assert len(loops) <= 2
+    release.set()
+    deadline = time.time() + 5
+    while len(done) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    thread.join(5)
+
+    assert sorted(done) == ['a', 'b', 'c']
+    assert len(loops) < 10
+    assert all(scheduler.state[name]['next_run'] > time.time() for name in 'abc')
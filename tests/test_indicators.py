@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from indicators import ATR, EMA, RSI, SMA, smooth
+
+
+def prices(rows=500, size=4, seed=0):
+    rnd = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rnd.normal(0, 1, (rows, size)), axis=0)
+    return close + rnd.random((rows, size)), close - rnd.random((rows, size)), close
+
+
+def updates(indicator, *values):
+    return np.array([indicator.update(*(v[t] for v in values)) for t in range(len(values[0]))])
+
+
+@pytest.mark.parametrize('window', [1, 2, 14, 50])
+@pytest.mark.parametrize('factory', [SMA, EMA, RSI, ATR])
+def test_batch_matches_updates_and_continues(factory, window):
+    high, low, close = prices()
+    close[10:13, 1] = np.nan  # пропуски: инструмент считается по строкам
+    close[:, 2] = np.nan
+    inputs = {'high': high, 'low': low, 'close': close}
+    batch, stepwise = factory(4, window), factory(4, window)
+    values = [inputs[name] for name in batch.inputs]
+
+    np.testing.assert_allclose(batch.batch(*values), updates(stepwise, *values), rtol=1e-10, equal_nan=True)
+    following = [v[-1] + 1 for v in values]
+    np.testing.assert_allclose(batch.update(*following), stepwise.update(*following), rtol=1e-10, equal_nan=True)
+
+
+def test_batch_shorter_than_window():
+    _, _, close = prices(rows=5)
+    batch, stepwise = RSI(4, 14), RSI(4, 14)
+    np.testing.assert_array_equal(batch.batch(close), updates(stepwise, close))
+    np.testing.assert_allclose(batch.gains.average, stepwise.gains.average)
+
+
+def test_smooth_long_series_is_stable():
+    x = np.full((100_000, 1), 5.0)
+    np.testing.assert_allclose(smooth(x, 2 / 6, np.zeros(1))[-1], [5.0])
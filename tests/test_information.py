@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+import pytest
+from tinkoff.invest import CandleInterval
+
+from benchmarks.fake_client import FakeServices, unlimited_limiter
+from benchmarks.local_clickhouse import LocalClickHouse
+from functions import InformationParser
+
+
+class FailingClickHouse(LocalClickHouse):
+    """
+    INSERT в candles падает, остальные запросы как у LocalClickHouse
+    """
+
+    def post(self, url, params=None, data=None, **kwargs):
+        if 'INSERT INTO tinkoff.candles ' in (params or {}).get('query', ''):
+            raise RuntimeError('clickhouse down')
+        return super().post(url, params=params, data=data, **kwargs)
+
+
+def test_update_candles_table_stops_fetching_after_insert_error():
+    client = FakeServices()
+    calls = []
+    get_candles = client.market_data.get_candles
+    client.market_data.get_candles = lambda **kwargs: calls.append(kwargs['figi']) or get_candles(**kwargs)
+    parser = InformationParser(client, limiter=unlimited_limiter(), candle_cache=False)
+    connection = {'host': 'http://localhost:8123', 'database': 'tinkoff', 'session': FailingClickHouse()}
+    figi_list = [f'share_figi_{i}' for i in range(200)]
+
+    with pytest.raises(RuntimeError, match='clickhouse down'):
+        parser.update_candles_table(figi_list, 'candles', connection, interval=CandleInterval.CANDLE_INTERVAL_1_MIN,
+                                    depth=timedelta(days=7), max_workers=2, flush_rows=1)
+
+    # до ошибки и во время неё окна грузят только уже запущенные потоки
+    assert len(calls) < 50
@@ -0,0 +1,95 @@
+import os
+import time
+from datetime import timedelta
+
+import pandas as pd
+
+from benchmarks.fake_client import synthetic_instruments
+from instrument_cache import InstrumentCache, diff_instruments
+from instrument_fields import BOND_FIELDS, instruments_to_frame, money_to_rub
+
+
+def frame(**rows):
+    return pd.DataFrame({'figi': list(rows), 'lot': list(rows.values())})
+
+
+def test_diff_instruments_returns_new_and_changed_rows():
+    old = frame(A=1.0, B=10.0, C=100.0)
+    new = frame(A=1.0, B=20.0, D=5.0)
+    assert diff_instruments(old, new)['figi'].tolist() == ['B', 'D']
+    assert diff_instruments(old, old.copy()).empty
+
+
+def test_diff_instruments_without_cache_or_with_other_columns_returns_everything():
+    new = frame(A=1.0)
+    assert diff_instruments(None, new) is new
+    assert diff_instruments(new.assign(extra=1), new) is new
+
+
+class Fetch:
+    def __init__(self, df):
+        self.df = df
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.df
+
+
+def expire(cache, instrument_type):
+    past = time.time() - cache.ttl.total_seconds() - 60
+    os.utime(cache.path(instrument_type), (past, past))
+
+
+def test_refresh_uses_fresh_cache_without_fetch(tmp_path):
+    cache = InstrumentCache(tmp_path, ttl=timedelta(hours=1))
+    fetch = Fetch(frame(A=1.0))
+    df, changed = cache.refresh('share', fetch)
+    assert fetch.calls == 1 and changed['figi'].tolist() == ['A']
+    df, changed = cache.refresh('share', fetch)
+    assert fetch.calls == 1 and changed.empty and df['figi'].tolist() == ['A']
+
+
+def test_refresh_without_changes_extends_ttl_when_caller_saves(tmp_path):
+    cache = InstrumentCache(tmp_path, ttl=timedelta(hours=1))
+    fetch = Fetch(frame(A=1.0))
+    cache.refresh('share', fetch)
+    expire(cache, 'share')
+
+    for _ in range(3):
+        _, changed = cache.refresh('share', fetch, save=False)
+        assert changed.empty
+    assert fetch.calls == 2
+    assert cache.is_fresh('share')
+
+
+def test_refresh_with_changes_and_save_false_keeps_cache_stale(tmp_path):
+    cache = InstrumentCache(tmp_path, ttl=timedelta(hours=1))
+    cache.refresh('share', Fetch(frame(A=1.0)))
+    expire(cache, 'share')
+
+    _, changed = cache.refresh('share', Fetch(frame(A=2.0)), save=False)
+    assert changed['lot'].tolist() == [2.0]
+    assert not cache.is_fresh('share')
+
+
+def test_fx_rate_change_does_not_change_raw_instruments():
+    bonds = synthetic_instruments(BOND_FIELDS, 50, seed=1)
+    assert any(b.nominal.currency == 'usd' for b in bonds)
+    old = instruments_to_frame(bonds, BOND_FIELDS, raw_money=True)
+    new = instruments_to_frame(bonds, BOND_FIELDS, raw_money=True)
+    assert diff_instruments(old, new).empty
+
+    converted = money_to_rub(new, BOND_FIELDS, lambda currencies: {'usd': 80.0})
+    expected = instruments_to_frame(bonds, BOND_FIELDS, lambda currencies: {'usd': 80.0})
+    pd.testing.assert_frame_equal(converted, expected)
+
+
+def test_get_does_not_overwrite_diff_baseline(tmp_path):
+    cache = InstrumentCache(tmp_path, ttl=timedelta(hours=1))
+    cache.refresh('share', Fetch(frame(A=1.0)))
+    expire(cache, 'share')
+
+    assert cache.get('share', Fetch(frame(A=2.0)))['lot'].tolist() == [2.0]
+    _, changed = cache.refresh('share', Fetch(frame(A=2.0)), save=False)
+    assert changed['lot'].tolist() == [2.0]
@@ -0,0 +1,108 @@
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from benchmarks.fake_stream import FakeMarketDataStream
+from benchmarks.local_clickhouse import LocalClickHouse, LocalResponse
+from streaming import StreamIngestor
+
+FIRST = datetime(2022, 1, 3, 7, tzinfo=timezone.utc)
+SECOND = FIRST + timedelta(hours=1)
+ROW = np.dtype([('length', 'u1'), ('figi', 'S5'), ('time', '<u4'), ('volume', '<i8'),
+                ('open', '<f8'), ('close', '<f8'), ('high', '<f8'), ('low', '<f8')])
+
+
+class HistoryParser:
+    """
+    Вместо InformationParser: догрузка истории после обрыва только запоминается
+    """
+
+    def __init__(self):
+        self.gap_fills = []
+        self.gap_filled = threading.Event()
+
+    def update_candles_table(self, figi_list, table, connection, **kwargs):
+        self.gap_fills.append((list(figi_list), table))
+        self.gap_filled.set()
+
+
+def run_ingestor(streams, sink, **kwargs):
+    connection = {'host': 'http://localhost:8123', 'database': 'tinkoff', 'session': sink}
+    parser = HistoryParser()
+    ingestor = None
+
+    def stream_factory():
+        if not streams:
+            ingestor.stop()
+            return FakeMarketDataStream(minutes=0)
+        return streams.pop(0)
+
+    ingestor = StreamIngestor(parser, ['FIGI0', 'FIGI1'], connection, stream_factory=stream_factory,
+                              reconnect_delay=0.01, **kwargs)
+    ingestor.run()
+    return parser
+
+
+def test_stream_reconnects_after_drop_and_writes_closed_candles():
+    sink = LocalClickHouse(keep_data=True)
+    parser = run_ingestor([
+        # 2 figi x 3 обновления в минуту: обрыв на 6-й минуте
+        FakeMarketDataStream(minutes=10, start=FIRST, fail_after=30),
+        FakeMarketDataStream(minutes=10, start=SECOND, seed=1),
+    ], sink)
+
+    rows = np.frombuffer(b''.join(sink.data['tinkoff.candles']), dtype=ROW)
+    for figi in (b'FIGI0', b'FIGI1'):
+        times = sorted(rows['time'][rows['figi'] == figi])
+        # незакрытая свеча на момент обрыва и последняя свеча стрима не пишутся
+        expected = [FIRST + timedelta(minutes=m) for m in range(4)] + \
+                   [SECOND + timedelta(minutes=m) for m in range(9)]
+        assert times == [int(t.timestamp()) for t in expected]
+    assert parser.gap_filled.wait(5)
+    assert parser.gap_fills[0] == (['FIGI0', 'FIGI1'], 'candles')
+
+    prices = b'\n'.join(sink.data['tinkoff.last_prices']).splitlines()
+    assert len(prices) == 30 + 60
+
+
+def test_stream_coverage_is_written_once_per_interval():
+    sink = LocalClickHouse(keep_data=True)
+    run_ingestor([
+        FakeMarketDataStream(minutes=10, start=FIRST, fail_after=30),
+        FakeMarketDataStream(minutes=10, start=SECOND, seed=1),
+    ], sink)
+
+    assert sink.inserts['tinkoff.candles_coverage'] == 1
+    coverage = {r['figi']: r for r in map(json.loads, sink.data['tinkoff.candles_coverage'][0].splitlines())}
+    assert set(coverage) == {'FIGI0', 'FIGI1'}
+    assert coverage['FIGI0']['time_from'] == ['2022-01-03 07:00:00', '2022-01-03 08:00:00']
+    assert coverage['FIGI0']['time_to'] == ['2022-01-03 07:04:00', '2022-01-03 08:09:00']
+
+
+class FailingOnce(LocalClickHouse):
+    """
+    Первая вставка свечей падает
+    """
+
+    def __init__(self):
+        super().__init__(keep_data=True)
+        self.failed = False
+
+    def post(self, url, params=None, data=None, **kwargs):
+        if not self.failed and 'INSERT INTO tinkoff.candles ' in (params or {}).get('query', ''):
+            self.failed = True
+            return LocalResponse(b'clickhouse down', status_code=500)
+        return super().post(url, params=params, data=data, **kwargs)
+
+
+def test_failed_batch_is_dropped_not_resent():
+    sink = FailingOnce()
+    run_ingestor([FakeMarketDataStream(minutes=10, start=FIRST)], sink, flush_rows=6)
+
+    assert sink.failed
+    rows = np.frombuffer(b''.join(sink.data['tinkoff.candles']), dtype=ROW)
+    # свечи неудачной пачки не отправляются повторно с каждой следующей
+    assert 0 < len(rows) < 2 * 9
+    assert len(rows) == len(set(zip(rows['figi'], rows['time'])))